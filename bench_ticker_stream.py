@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+import websockets
+
+import market_data
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- قياس فك بث !miniTicker@arr لـ "العيون" (رسائل/ثانية على بث مسجل) ---
+#
+#   python bench_ticker_stream.py record ticks.jsonl --seconds 120   (يسجل الرسائل الخام + خريطة الأسواق)
+#   python bench_ticker_stream.py replay ticks.jsonl --symbols 30     (المسار القديم مقابل TickerDecoder)
+# =======================================================================================
+
+def _markets_path(path: str) -> str:
+    return path + ".markets.json"
+
+
+async def record(path: str, seconds: float):
+    """يسجل رسائل البث كما وصلت (سطر لكل رسالة) + أسواق spot من Binance (لبناء الخريطة بدون شبكة لاحقاً)."""
+    import ccxt.async_support as ccxt
+    exchange = ccxt.binance({'enableRateLimit': True, 'options': {'defaultType': 'spot'}})
+    try:
+        markets = await exchange.load_markets()
+    finally:
+        await exchange.close()
+    with open(_markets_path(path), 'w') as f:
+        json.dump({s: {'id': m['id'], 'spot': m.get('spot', True)} for s, m in markets.items()}, f)
+    count, deadline = 0, time.time() + seconds
+    async with websockets.connect(market_data.ALL_TICKERS_STREAM_URI, ping_interval=180, ping_timeout=60) as ws:
+        with open(path, 'w') as f:
+            while time.time() < deadline:
+                message = await ws.recv()
+                f.write((message.decode() if isinstance(message, bytes) else message) + "\n")
+                count += 1
+    logger.info(f"BENCH: Recorded {count} messages to {path}.")
+
+
+def _legacy_prices(message, wanted) -> List[Tuple[str, float]]:
+    """المسار قبل V6: json.loads + استبدال 'USDT' نصياً لكل عنصر."""
+    ticks = []
+    for data in json.loads(message):
+        symbol = data['s'].replace('USDT', '/USDT')
+        if symbol in wanted:
+            ticks.append((symbol, float(data['c'])))
+    return ticks
+
+
+def _rate(decode: Callable, messages: List[bytes], wanted, rounds: int) -> Tuple[float, int]:
+    ticks = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            ticks += len(decode(message, wanted))
+    return rounds * len(messages) / (time.perf_counter() - start), ticks // rounds
+
+
+def replay(path: str, symbols: int, rounds: int) -> Dict[str, float]:
+    with open(path, 'rb') as f:
+        messages = [line.rstrip(b"\n") for line in f if line.strip()]
+    with open(_markets_path(path)) as f:
+        markets = json.load(f)
+    decoder = market_data.TickerDecoder(markets)
+    # (الرموز المراقبة: أزواج USDT الأكثر ظهوراً في التسجيل، كعدد الصفقات المفتوحة المعتاد)
+    seen: Dict[str, int] = {}
+    for message in messages:
+        for data in json.loads(message):
+            symbol = decoder.id_to_symbol.get(data['s'])
+            if symbol and symbol.endswith('/USDT'):
+                seen[symbol] = seen.get(symbol, 0) + 1
+    wanted = set(sorted(seen, key=seen.get, reverse=True)[:symbols])
+    elements = sum(len(json.loads(m)) for m in messages) / max(len(messages), 1)
+    mismatched = sum(sorted(_legacy_prices(m, wanted)) != sorted(decoder.prices(m, wanted)) for m in messages)
+    if mismatched:
+        logger.warning(f"BENCH: {mismatched} messages decode differently (legacy 'USDT' replace maps some ids wrongly).")
+
+    legacy_rate, legacy_ticks = _rate(_legacy_prices, messages, wanted, rounds)
+    fast_rate, fast_ticks = _rate(decoder.prices, messages, wanted, rounds)
+    logger.info(f"BENCH: {len(messages)} messages (~{elements:.0f} tickers each), watching {len(wanted)} symbols, orjson={market_data.ORJSON_AVAILABLE}.")
+    logger.info(f"BENCH: legacy  {legacy_rate:10.1f} msg/s ({legacy_ticks} ticks/pass)")
+    logger.info(f"BENCH: decoder {fast_rate:10.1f} msg/s ({fast_ticks} ticks/pass) = x{fast_rate / legacy_rate:.2f}")
+    return {"legacy": legacy_rate, "decoder": fast_rate}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="قياس فك بث الأسعار لـ العيون")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record")
+    rec.add_argument("path")
+    rec.add_argument("--seconds", type=float, default=60)
+    rep = sub.add_parser("replay")
+    rep.add_argument("path")
+    rep.add_argument("--symbols", type=int, default=30)
+    rep.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    if args.command == "record":
+        asyncio.run(record(args.path, args.seconds))
+    else:
+        replay(args.path, args.symbols, args.rounds)
@@ -1,17 +1,29 @@
 import asyncio
 import logging
+import os
 import ccxt.async_support as ccxt
 import websockets
 import json
+import math
 import time
+import socket
 import pandas as pd
 import pandas_ta as ta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from uuid import UUID
 
 # --- استيراد الوحدات الجديدة ---
 import db_utils
 import core_logic
+import market_data
+import candle_store
+import vector_engine
+import process_engine
+import request_scheduler
+import sharding
+import trade_index
+import write_behind
+from request_scheduler import prioritized, PRIORITY_CLOSE, PRIORITY_ORDER, PRIORITY_ANALYTICS
 from db_utils import UserSettings, TradingVariables, ActiveStrategy, UserKeys, BotSettings
 
 # --- إعداد السجلات ---
@@ -19,15 +31,48 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 logger = logging.getLogger("BotWorker_V4_Final")
 
 # --- (الثوابت والمخابئ كما هي) ---
-SCAN_INTERVAL_SECONDS = 900
+SCAN_TIMEFRAME = '15m'
+SCAN_INTERVAL_SECONDS = market_data.TIMEFRAME_MS[SCAN_TIMEFRAME] // 1000
+SCAN_CLOSE_DELAY_SECONDS = float(os.getenv("SCAN_CLOSE_DELAY_SECONDS", "3")) # (مهلة بعد الإغلاق حتى تصل الشمعة الجديدة)
+SCAN_SPREAD_SECONDS = float(os.getenv("SCAN_SPREAD_SECONDS", "60")) # (نافذة توزيع المستخدمين بعد كل إغلاق)
 SUPERVISOR_INTERVAL_SECONDS = 10
+PROFIT_NOTIFICATION_STEP_PCT = float(os.getenv("PROFIT_NOTIFICATION_STEP_PCT", "2.0")) # (إشعار ربح كل ارتفاع بهذه النسبة فوق آخر إشعار)
+WISE_GUARDIAN_TRIGGER_PCT = float(os.getenv("WISE_GUARDIAN_TRIGGER_PCT", "-1.5")) # (تراجع عن أعلى سعر يُفعّل الحارس الحكيم)
+CLOSE_CLAIM_BATCH = 20 # (V6) صفقات تطالب بها النسخة في كل دورة للأيدي
+CLOSE_CLAIM_TIMEOUT_SECONDS = float(os.getenv("CLOSE_CLAIM_TIMEOUT_SECONDS", "120")) # (مطالبة نسخة متوقفة تنتهي بعدها)
 CACHE_SYNC_INTERVAL_SECONDS = 60
-
-PUBLIC_EXCHANGE = ccxt.binance({'enableRateLimit': True, 'options': {'defaultType': 'spot'}})
+SCAN_ENGINE = os.getenv("SCAN_ENGINE", "pandas") # pandas | vector (لوحة NumPy لكل الرموز) | process (ProcessPoolExecutor)
+SCAN_PROCESS_WORKERS = int(os.getenv("SCAN_PROCESS_WORKERS", "0")) # (0 = كل الأنوية)
+CANDLE_CACHE_TTL_SECONDS = float(os.getenv("CANDLE_CACHE_TTL_SECONDS", "30")) # (صلاحية الشمعة المفتوحة في مخبأ الشموع)
+DEPTH_MAX_AGE_SECONDS = float(os.getenv("DEPTH_MAX_AGE_SECONDS", "30")) # (صلاحية دفتر الأوامر المشترك)
+DEPTH_MAX_AGE_OVERRIDES = json.loads(os.getenv("DEPTH_MAX_AGE_OVERRIDES", "{}")) # {"BTC/USDT": 5, ...}
+MARKET_DATA_FEED = os.getenv("MARKET_DATA_FEED", "stream") # stream (بث kline) | rest (سحب كل دورة)
+EYES_EVALUATORS = int(os.getenv("EYES_EVALUATORS", "4")) # (مقيّمو العيون المتوازون؛ نفس الرمز لا يُقيّم مرتين معاً)
+EYES_STREAM_MODE = os.getenv("EYES_STREAM_MODE", "all") # all (!miniTicker@arr لكل السوق) | symbols (<id>@miniTicker لرموز الصفقات المفتوحة) | book (<id>@bookTicker)
+CANDLE_STORE_ENABLED = os.getenv("CANDLE_STORE_ENABLED", "true").lower() == "true" # (المجلد: CANDLE_STORE_DIR)
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all") # all (عملية واحدة) | primary (العيون + الأيدي + نشر اللقطة + شظية) | scanner (شظية فحص فقط)
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}" # (V6) هوية النسخة (القفل، المطالبات، الشظية)
+SCANNER_SHARD_ID = os.getenv("SCANNER_SHARD_ID") or WORKER_ID
+SCAN_SNAPSHOT_WAIT_SECONDS = float(os.getenv("SCAN_SNAPSHOT_WAIT_SECONDS", "60")) # (مهلة انتظار الشظية للقطة المنشورة)
+
+PUBLIC_EXCHANGE = request_scheduler.ScheduledBinance({'enableRateLimit': True, 'options': {'defaultType': 'spot'}}) # (V6) وزن IP مشترك عبر SCHEDULER
+CANDLE_STORE = candle_store.CandleStore() if CANDLE_STORE_ENABLED else None # (V6) التاريخ على القرص (بدء دافئ بلا REST)
+MARKET_DATA = market_data.MarketDataService(PUBLIC_EXCHANGE, timeframes=('15m', '1h'), limit=100, store=CANDLE_STORE)
+CANDLE_CACHE = market_data.CandleCache(PUBLIC_EXCHANGE, CANDLE_CACHE_TTL_SECONDS, store=CANDLE_STORE)
+DEPTH_CACHE = market_data.DepthCache(PUBLIC_EXCHANGE, DEPTH_MAX_AGE_SECONDS, DEPTH_MAX_AGE_OVERRIDES)
+PROCESS_ENGINE = process_engine.ProcessScanEngine(SCAN_PROCESS_WORKERS or None)
+SHARDS = sharding.ShardCoordinator(SCANNER_SHARD_ID) if WORKER_ROLE != "all" else None # (V6) توزيع المستخدمين على الشظايا
+LEADER = sharding.LeaderElection("eyes", WORKER_ID) # (V6) العيون (ونشر اللقطة) في نسخة واحدة فقط
 GLOBAL_ACTIVE_TRADES_CACHE: Dict[str, List[Dict]] = {}
+TRADE_INDEX = trade_index.ThresholdIndex() # (V6) عتبات العيون المرتبة لكل رمز (نفس قواميس GLOBAL_ACTIVE_TRADES_CACHE)
+PRICE_QUEUE = market_data.LatestPriceQueue() # (V6) آخر سعر لكل رمز بين قارئ البث ومقيّمي العيون
+TRADE_WRITES = write_behind.TradeWriteBehind() # (V6) أعلى سعر/الوقف/الإشعار تُكتب دفعات بدلاً من UPDATE لكل تيك
+USER_OPEN_TRADES_CACHE: Dict[UUID, Dict[int, str]] = {} # (V6) {user_id: {trade_id: symbol}} (نفس مصدر العيون)
+ACTIVE_TRADES_CACHE_READY = asyncio.Event()
 USER_SETTINGS_CACHE: Dict[UUID, TradingVariables] = {}
 USER_STRATEGIES_CACHE: Dict[UUID, List[ActiveStrategy]] = {}
 USER_EXCHANGE_CACHE: Dict[UUID, ccxt.Exchange] = {}
+USER_KEYS_CACHE: Dict[UUID, UserKeys] = {}
 LAST_DEEP_ANALYSIS_TIME: Dict[int, float] = {}
 SCAN_SKIP_NOTIFICATION_CACHE: Dict[UUID, str] = {}
 
@@ -39,18 +84,19 @@ SCAN_SKIP_NOTIFICATION_CACHE: Dict[UUID, str] = {}
 async def get_user_exchange(user_id: UUID) -> Optional[ccxt.Exchange]:
     if user_id in USER_EXCHANGE_CACHE:
         return USER_EXCHANGE_CACHE[user_id]
-    keys = await db_utils.get_user_api_keys(user_id)
+    keys = USER_KEYS_CACHE.get(user_id) or await db_utils.get_user_api_keys(user_id)
     if not keys:
         logger.warning(f"WORKER: No valid keys for user {user_id}.")
         return None
     try:
-        exchange = ccxt.binance({'apiKey': keys.api_key, 'secret': keys.api_secret, 'enableRateLimit': True, 'options': {'defaultType': 'spot'}})
+        exchange = request_scheduler.ScheduledBinance({'apiKey': keys.api_key, 'secret': keys.api_secret, 'enableRateLimit': True, 'options': {'defaultType': 'spot'}})
         await exchange.load_markets()
         USER_EXCHANGE_CACHE[user_id] = exchange
         return exchange
     except Exception as e:
         logger.error(f"WORKER: Failed to create CCXT instance for user {user_id}: {e}")
         await db_utils.set_api_keys_valid(user_id, False)
+        USER_KEYS_CACHE.pop(user_id, None)
         if user_id in USER_EXCHANGE_CACHE: del USER_EXCHANGE_CACHE[user_id]
         return None
 
@@ -68,6 +114,15 @@ async def get_user_strategies(user_id: UUID) -> List[ActiveStrategy]:
     USER_STRATEGIES_CACHE[user_id] = strategies
     return strategies
 
+async def hydrate_user_caches(user_ids: set):
+    """(V6) يملأ مخابئ الإعدادات/الاستراتيجيات/المفاتيح/الصفقات المفتوحة لكل المستخدمين برحلة DB واحدة."""
+    global USER_SETTINGS_CACHE, USER_STRATEGIES_CACHE, USER_KEYS_CACHE, USER_OPEN_TRADES_CACHE
+    contexts = await db_utils.get_worker_user_contexts(list(user_ids))
+    USER_SETTINGS_CACHE = {uid: ctx.settings for uid, ctx in contexts.items() if ctx.settings}
+    USER_STRATEGIES_CACHE = {uid: ctx.strategies for uid, ctx in contexts.items()}
+    USER_KEYS_CACHE = {uid: ctx.keys for uid, ctx in contexts.items() if ctx.keys}
+    USER_OPEN_TRADES_CACHE = {uid: ctx.open_trades for uid, ctx in contexts.items() if ctx.open_trades}
+
 async def close_all_user_exchanges():
     logger.info("WORKER: Closing all cached user CCXT connections...")
     for exchange in USER_EXCHANGE_CACHE.values():
@@ -94,6 +149,40 @@ def _remove_trade_from_cache(trade: Dict):
     if symbol in GLOBAL_ACTIVE_TRADES_CACHE:
         GLOBAL_ACTIVE_TRADES_CACHE[symbol] = [t for t in GLOBAL_ACTIVE_TRADES_CACHE[symbol] if t['id'] != trade_id]
         if not GLOBAL_ACTIVE_TRADES_CACHE[symbol]: del GLOBAL_ACTIVE_TRADES_CACHE[symbol]
+    TRADE_INDEX.discard(trade_id)
+    USER_OPEN_TRADES_CACHE.get(trade['user_id'], {}).pop(trade_id, None)
+
+def _add_trade_to_cache(trade: Dict):
+    """(V6) صفقة فُتحت للتو: العيون تراقبها فوراً والماسح يستبعد رمزها (بدون انتظار المزامنة)."""
+    GLOBAL_ACTIVE_TRADES_CACHE.setdefault(trade['symbol'], []).append(trade)
+    _index_trade(trade)
+    USER_OPEN_TRADES_CACHE.setdefault(trade['user_id'], {})[trade['id']] = trade['symbol']
+
+def _trade_levels(trade: Dict) -> Tuple[float, float]:
+    """
+    (V6) (العتبة الصاعدة، العتبة الهابطة): أقرب سعر يغير شيئاً في الصفقة،
+    بنفس شروط حلقة العيون و _manage_active_trade (TP/SL، أعلى سعر، تفعيل الوقف المتحرك،
+    إشعار الربح، الحارس الحكيم). بين العتبتين لا يحدث شيء فلا داعي للمس الصفقة.
+    """
+    upper = [trade['take_profit'] if trade['take_profit'] is not None else math.inf]
+    lower = [trade['stop_loss'] if trade['stop_loss'] is not None else -math.inf]
+    settings = USER_SETTINGS_CACHE.get(trade['user_id'])
+    if settings:
+        highest = trade.get('highest_price') or 0
+        upper.append(math.nextafter(highest, math.inf)) # (سعر أعلى جديد: يحدّث أعلى سعر والوقف المتحرك)
+        if getattr(settings, 'trailing_sl_enabled', False) and not trade['trailing_sl_active']:
+            upper.append(trade['entry_price'] * (1 + settings.trailing_sl_activation_percent / 100))
+        last_notified = trade.get('last_profit_notification_price') or trade['entry_price']
+        upper.append(last_notified * (1 + PROFIT_NOTIFICATION_STEP_PCT / 100))
+        if getattr(settings, 'wise_guardian_enabled', False) and highest > 0:
+            lower.append(math.nextafter(highest * (1 + WISE_GUARDIAN_TRIGGER_PCT / 100), -math.inf))
+    return min(upper), max(lower)
+
+def _index_trade(trade: Dict):
+    TRADE_INDEX.set(trade, *_trade_levels(trade))
+
+def _rebuild_trade_index():
+    TRADE_INDEX.rebuild((trade, *_trade_levels(trade)) for trades in GLOBAL_ACTIVE_TRADES_CACHE.values() for trade in trades)
 
 # =======================================================================================
 # --- المكون الأول: "العيون" (WebSocket العام) ---
@@ -101,42 +190,94 @@ def _remove_trade_from_cache(trade: Dict):
 
 async def run_public_websocket_manager():
     """ "العيون": يراقب كل الصفقات النشطة (لكل المستخدمين) في بث واحد. """
-    global GLOBAL_ACTIVE_TRADES_CACHE
-    uri = "wss://stream.binance.com:9443/ws/!miniTicker@arr"
+    # [V6] القارئ يكتب آخر سعر لكل رمز فقط، والمقيّمون يديرون الصفقات بأحدث سعر (إدارة بطيئة لا تؤخر قراءة البث)
+    PRICE_QUEUE.clear()
+    reader = _run_all_tickers_stream() if EYES_STREAM_MODE == "all" else _run_symbol_ticker_streams()
+    await asyncio.gather(reader, *[_run_price_evaluator() for _ in range(EYES_EVALUATORS)])
+
+async def _run_price_evaluator():
+    """ (V6) مقيّم: يأخذ الرمز التالي بأحدث سعر له ويدير صفقاته. """
+    while True:
+        symbol, price = await PRICE_QUEUE.get()
+        try:
+            await _on_price(symbol, price)
+        except Exception as e:
+            logger.error(f"EYES: Error evaluating {symbol} at {price}: {e}", exc_info=True)
+        finally:
+            PRICE_QUEUE.done(symbol)
+
+async def _run_all_tickers_stream():
+    """ (V6) قارئ !miniTicker@arr (كل السوق). """
+    uri = market_data.ALL_TICKERS_STREAM_URI
     while True:
         try:
             logger.info(f"EYES: Connecting to Binance Public Ticker Stream...")
             async with websockets.connect(uri, ping_interval=180, ping_timeout=60) as ws:
+                decoder = market_data.TickerDecoder(PUBLIC_EXCHANGE.markets) # [V6] خريطة id→رمز من الأسواق المحملة
                 logger.info(f"EYES: Connected. Monitoring {len(GLOBAL_ACTIVE_TRADES_CACHE)} symbols.")
                 async for message in ws:
                     try:
-                        data_list = json.loads(message)
-                        for data in data_list:
-                            symbol = data['s'].replace('USDT', '/USDT')
-                            if symbol in GLOBAL_ACTIVE_TRADES_CACHE:
-                                price = float(data['c'])
-                                trades_to_check = list(GLOBAL_ACTIVE_TRADES_CACHE.get(symbol, []))
-                                for trade in trades_to_check:
-                                    if trade['status'] != 'active': continue
-                                    # 1. التحقق من TP
-                                    if price >= trade['take_profit']:
-                                        logger.info(f"EYES: Flagging TP for trade #{trade['id']} ({symbol})")
-                                        await db_utils.set_trade_status(trade['id'], 'closing_tp')
-                                        _remove_trade_from_cache(trade); continue
-                                    # 2. التحقق من SL
-                                    if price <= trade['stop_loss']:
-                                        reason = "closing_tsl" if trade['trailing_sl_active'] else "closing_sl"
-                                        logger.info(f"EYES: Flagging {reason} for trade #{trade['id']}")
-                                        await db_utils.set_trade_status(trade['id'], reason)
-                                        _remove_trade_from_cache(trade); continue
-                                    # 3. منطق إدارة الصفقات النشطة (TSL, إشعارات, الحارس)
-                                    await _manage_active_trade(trade, price)
+                        for symbol, price in decoder.prices(message, GLOBAL_ACTIVE_TRADES_CACHE.keys()):
+                            PRICE_QUEUE.put(symbol, price)
+                    except Exception as e:
+                        logger.error(f"EYES: Error processing message: {e}", exc_info=True)
+        except (websockets.exceptions.ConnectionClosed, Exception) as e:
+            logger.warning(f"EYES: Connection lost: {e}. Reconnecting in 5s...")
+            await asyncio.sleep(5)
+
+async def _run_symbol_ticker_streams():
+    """ (V6) قارئ وضع الرموز: بث <id>@miniTicker/@bookTicker لرموز الصفقات المفتوحة فقط (تكلفة فك JSON تتبع الصفقات لا السوق). """
+    subscriptions = market_data.TickerSubscriptions(PUBLIC_EXCHANGE, "bookTicker" if EYES_STREAM_MODE == "book" else "miniTicker")
+    while True:
+        try:
+            logger.info(f"EYES: Connecting to Binance combined {subscriptions.channel} stream...")
+            async with websockets.connect(market_data.TICKER_STREAM_URI, ping_interval=180, ping_timeout=60) as ws:
+                subscriptions.reset()
+                while True:
+                    # (المزامنة وفتح/إغلاق الصفقات يغيرون الرموز: نفس الاتصال يضيف/يزيل البث)
+                    messages = subscriptions.sync(GLOBAL_ACTIVE_TRADES_CACHE.keys())
+                    for request in messages:
+                        await ws.send(request)
+                    if messages:
+                        logger.info(f"EYES: Subscribed to {len(subscriptions)} symbol streams.")
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        continue
+                    try:
+                        tick = subscriptions.price(market_data.loads(message))
+                        if tick and tick[0] in TRADE_INDEX:
+                            PRICE_QUEUE.put(*tick)
                     except Exception as e:
                         logger.error(f"EYES: Error processing message: {e}", exc_info=True)
         except (websockets.exceptions.ConnectionClosed, Exception) as e:
             logger.warning(f"EYES: Connection lost: {e}. Reconnecting in 5s...")
             await asyncio.sleep(5)
 
+async def _on_price(symbol: str, price: float):
+    """ (V6) سعر جديد لرمز: فقط الصفقات التي عبر السعر عتباتها (بدلاً من كل صفقات الرمز). """
+    for trade in TRADE_INDEX.crossed(symbol, price):
+        if trade['status'] != 'active': continue
+        # 1. التحقق من TP (تغيير الحالة فوري، لا يمر بالكتابة المؤجلة)
+        if price >= trade['take_profit']:
+            logger.info(f"EYES: Flagging TP for trade #{trade['id']} ({symbol})")
+            await db_utils.set_trade_status(trade['id'], 'closing_tp')
+            _remove_trade_from_cache(trade); continue
+        # 2. التحقق من SL
+        if price <= trade['stop_loss']:
+            reason = "closing_tsl" if trade['trailing_sl_active'] else "closing_sl"
+            logger.info(f"EYES: Flagging {reason} for trade #{trade['id']}")
+            await db_utils.set_trade_status(trade['id'], reason)
+            _remove_trade_from_cache(trade); continue
+        # 3. منطق إدارة الصفقات النشطة (TSL, إشعارات, الحارس)
+        await _manage_active_trade(trade, price)
+        current = TRADE_INDEX.get(trade['id'])
+        if current is None: # (أُغلقت أثناء الانتظار)
+            continue
+        if current is not trade: # (استُبدلت بمزامنة أثناء الانتظار: ننقل ما غيرناه للنسخة الجديدة)
+            write_behind.merge_live(current, trade)
+        _index_trade(current) # (العتبات الجديدة بعد تحديث أعلى سعر/الوقف/الإشعار)
+
 async def _manage_active_trade(trade: Dict, price: float):
     """ (V4) دالة مساعدة لـ "العيون": تدير الوقف المتحرك والإشعارات "التافهة". """
     trade_id, user_id = trade['id'], trade['user_id']
@@ -146,7 +287,7 @@ async def _manage_active_trade(trade: Dict, price: float):
     # 1. تحديث أعلى سعر
     highest_price = max(trade.get('highest_price', 0), price)
     if highest_price > trade.get('highest_price', 0):
-        await db_utils.update_trade_highest_price(trade_id, highest_price)
+        TRADE_WRITES.set(trade_id, highest_price=highest_price) # [V6] كتابة مؤجلة
         trade['highest_price'] = highest_price
 
     # 2. منطق الوقف المتحرك (Trailing SL)
@@ -155,7 +296,7 @@ async def _manage_active_trade(trade: Dict, price: float):
         if not trade['trailing_sl_active'] and price >= trade['entry_price'] * (1 + settings.trailing_sl_activation_percent / 100):
             new_sl = trade['entry_price'] * 1.001
             if new_sl > trade['stop_loss']:
-                await db_utils.update_trade_after_tsl_activation(trade_id, new_sl)
+                TRADE_WRITES.set(trade_id, trailing_sl_active=True, stop_loss=new_sl)
                 trade['trailing_sl_active'] = True
                 trade['stop_loss'] = new_sl
                 logger.info(f"EYES: TSL Activated for trade #{trade_id}. New SL: {new_sl}")
@@ -167,14 +308,13 @@ async def _manage_active_trade(trade: Dict, price: float):
         if trade['trailing_sl_active']:
             new_sl_candidate = highest_price * (1 - settings.trailing_sl_callback_percent / 100)
             if new_sl_candidate > trade['stop_loss']:
-                await db_utils.update_trade_tsl(trade_id, new_sl_candidate)
+                TRADE_WRITES.set(trade_id, stop_loss=new_sl_candidate)
                 trade['stop_loss'] = new_sl_candidate
 
     # 3. منطق إشعارات الربح المتزايدة
-    increment_pct = 2.0 # (يجب جلب هذا من الإعدادات)
-    last_notified = trade.get('last_profit_notification_price', trade['entry_price'])
-    if price >= last_notified * (1 + increment_pct / 100):
-        await db_utils.update_trade_profit_notification(trade_id, price)
+    last_notified = trade.get('last_profit_notification_price') or trade['entry_price']
+    if price >= last_notified * (1 + PROFIT_NOTIFICATION_STEP_PCT / 100):
+        TRADE_WRITES.set(trade_id, last_profit_notification_price=price)
         trade['last_profit_notification_price'] = price
         profit_percent = ((price / trade['entry_price']) - 1) * 100
         logger.info(f"EYES: Incremental profit hit for trade #{trade_id}.")
@@ -192,8 +332,7 @@ async def _manage_active_trade(trade: Dict, price: float):
     # 4. منطق الحارس الحكيم (Wise Guardian)
     if settings.wise_guardian_enabled and trade.get('highest_price', 0) > 0:
         drawdown_pct = ((price / trade['highest_price']) - 1) * 100
-        trigger_pct = -1.5 # (يجب جلب هذا من الإعدادات)
-        if drawdown_pct < trigger_pct:
+        if drawdown_pct < WISE_GUARDIAN_TRIGGER_PCT:
             cooldown = 900
             last_analysis = LAST_DEEP_ANALYSIS_TIME.get(trade_id, 0)
             if (time.time() - last_analysis) > cooldown:
@@ -203,7 +342,7 @@ async def _manage_active_trade(trade: Dict, price: float):
 
 async def sync_cache_from_db():
     """(V4) يقوم بمزامنة ذاكرة التخزين المؤقت لـ "العيون" والإعدادات مع قاعدة البيانات."""
-    global GLOBAL_ACTIVE_TRADES_CACHE, USER_SETTINGS_CACHE, USER_STRATEGIES_CACHE
+    global GLOBAL_ACTIVE_TRADES_CACHE
     while True:
         try:
             logger.info("CACHE_SYNC: Syncing active trades and user settings...")
@@ -212,26 +351,38 @@ async def sync_cache_from_db():
             active_users = await db_utils.get_all_active_users()
             active_user_ids = {u.user_id for u in active_users}
             
+            # [V6] تحديث مخابئ المستخدمين دفعة واحدة (بدلاً من مسحها وإعادة تحميل كل مستخدم على حدة)
+            _clear_inactive_caches(active_user_ids)
+            hydrate_user_ids = active_user_ids
+            if SHARDS and not LEADER.is_leader:
+                # (شظية بلا عيون: سياق مستخدميها فقط؛ من تنتقل ملكيته بين المزامنات يُحمّل عند الحاجة)
+                hydrate_user_ids = {u.user_id for u in SHARDS.owned(active_users)}
+            await hydrate_user_caches(hydrate_user_ids)
+
             # مزامنة الصفقات (فقط للمستخدمين النشطين)
-            new_cache = {}
-            all_trades_count = 0
+            all_trades = []
             if active_user_ids:
                 async with db_utils.db_connection() as conn:
                     all_trades = await conn.fetch("SELECT * FROM trades WHERE status = 'active' AND user_id = ANY($1)", list(active_user_ids))
-                for r in all_trades:
-                    trade = dict(r)
-                    if trade['symbol'] not in new_cache: new_cache[trade['symbol']] = []
-                    new_cache[trade['symbol']].append(trade)
-                all_trades_count = len(all_trades)
+            all_trades_count = len(all_trades)
+            # [V6] من هنا بلا await حتى إعادة بناء الفهرس: مقيّمو العيون لا يعدلون النسخ القديمة بين البناء والتبديل.
+            # الصفوف قُرئت قبل ما غيرته العيون أثناء الانتظار: القيم الحية (ثم غير المكتوبة بعد) أحدث من DB.
+            new_cache = {}
+            for r in all_trades:
+                trade = dict(r)
+                live = TRADE_INDEX.get(trade['id'])
+                if live is not None:
+                    write_behind.merge_live(trade, live)
+                TRADE_WRITES.apply(trade)
+                new_cache.setdefault(trade['symbol'], []).append(trade)
             GLOBAL_ACTIVE_TRADES_CACHE = new_cache
-            
-            # مسح المخابئ
-            _clear_inactive_caches(active_user_ids)
-            for user_id in active_user_ids: # إجبار على إعادة التحميل
-                if user_id in USER_SETTINGS_CACHE: del USER_SETTINGS_CACHE[user_id]
-                if user_id in USER_STRATEGIES_CACHE: del USER_STRATEGIES_CACHE[user_id]
+            _rebuild_trade_index() # (بعد الإعدادات: عتبات الوقف المتحرك والحارس تعتمد عليها)
+            ACTIVE_TRADES_CACHE_READY.set()
 
-            logger.info(f"CACHE_SYNC: Complete. Monitoring {all_trades_count} trades across {len(active_user_ids)} active users. Caches cleared.")
+            logger.info(f"CACHE_SYNC: Complete. Monitoring {all_trades_count} trades across {len(active_user_ids)} active users. Caches refreshed.")
+            logger.info(f"SCHEDULER: Request budget {request_scheduler.SCHEDULER.metrics()}")
+            logger.info(f"WRITE_BEHIND: {TRADE_WRITES.metrics()}")
+            logger.info(f"EYES: Price queue {PRICE_QUEUE.metrics()}")
         except Exception as e:
             logger.error(f"CACHE_SYNC: Failed to sync cache: {e}", exc_info=True)
         await asyncio.sleep(CACHE_SYNC_INTERVAL_SECONDS)
@@ -244,28 +395,35 @@ async def run_supervisor():
     """ "الأيدي": يبحث عن الأعلام التي رفعتها "العيون" أو الواجهة وينفذ البيع. """
     while True:
         try:
-            async with db_utils.db_connection() as conn:
-                flagged_trades = await conn.fetch("SELECT * FROM trades WHERE status LIKE 'closing_%'")
+            # [V6] مطالبة (FOR UPDATE SKIP LOCKED) بدلاً من قراءة الكل: عدة نسخ تتقاسم الإغلاقات بلا بيع مزدوج
+            flagged_trades = await db_utils.claim_trades_for_closure(WORKER_ID, CLOSE_CLAIM_BATCH, CLOSE_CLAIM_TIMEOUT_SECONDS)
             
             if flagged_trades:
-                logger.info(f"HANDS: Found {len(flagged_trades)} trades flagged for closure.")
-                for trade_record in flagged_trades:
-                    trade = dict(trade_record)
-                    reason_code = trade['status']
-                    reason_map = {
-                        "closing_tp": "جني الأرباح (TP)", "closing_sl": "وقف الخسارة (SL)",
-                        "closing_tsl": "وقف الخسارة المتحرك (TSL)", "closing_manual": "إغلاق يدوي (من الواجهة)",
-                        "closing_wise_man": "إغلاق (بأمر الرجل الحكيم)",
-                    }
-                    final_reason = reason_map.get(reason_code, "إغلاق آلي")
-                    await _execute_close(trade['user_id'], trade, final_reason)
+                logger.info(f"HANDS: Claimed {len(flagged_trades)} trades flagged for closure.")
+                await _close_flagged_trades(flagged_trades)
         except Exception as e:
             logger.error(f"SUPERVISOR: Critical error in main loop: {e}", exc_info=True)
         await asyncio.sleep(SUPERVISOR_INTERVAL_SECONDS)
 
+async def _close_flagged_trades(flagged_trades: List[Dict]):
+    """ (V6) يغلق دفعة مطالب بها صفقةً صفقة (كل صفقة تُسلّم ذرياً قبل بيعها). """
+    reason_map = {
+        "closing_tp": "جني الأرباح (TP)", "closing_sl": "وقف الخسارة (SL)",
+        "closing_tsl": "وقف الخسارة المتحرك (TSL)", "closing_manual": "إغلاق يدوي (من الواجهة)",
+        "closing_wise_man": "إغلاق (بأمر الرجل الحكيم)",
+    }
+    for trade in flagged_trades:
+        final_reason = reason_map.get(trade['status'], "إغلاق آلي")
+        await _execute_close(trade['user_id'], trade, final_reason)
+
+@prioritized(PRIORITY_CLOSE)
 async def _execute_close(user_id: UUID, trade: Dict, reason: str):
     """ (V4) ينفذ أمر البيع الفعلي ويحدّث قاعدة البيانات. """
     trade_id, symbol = trade['id'], trade['symbol']
+    # [V6] المطالبة قد تنتهي أثناء انتظار الدفعة (إغلاقات بطيئة) فتأخذها نسخة أخرى: لا بيع بدون تسليم ذري
+    if not await db_utils.start_trade_closure(trade_id, WORKER_ID):
+        logger.warning(f"HANDS: Claim on trade #{trade_id} expired and was taken by another worker. Skipping.")
+        return
     exchange = await get_user_exchange(user_id)
     if not exchange:
         logger.error(f"HANDS: Cannot close trade #{trade_id}. No valid CCXT instance."); await db_utils.set_trade_status(trade_id, 'active'); return
@@ -311,27 +469,107 @@ async def _execute_close(user_id: UUID, trade: Dict, reason: str):
 # =======================================================================================
 
 async def run_scanner():
-    """ (V4) "الماسح": يلف على جميع المستخدمين النشطين وينفذ الفحص لهم. """
+    """ (V6) "الماسح": يستيقظ بعد إغلاق كل شمعة 15m مباشرة ويوزع فحص المستخدمين على نافذة زمنية. """
     while True:
-        logger.info("SCANNER: Starting new multi-user scan cycle...")
+        target = market_data.next_candle_close(SCAN_TIMEFRAME) + SCAN_CLOSE_DELAY_SECONDS
+        await asyncio.sleep(max(0.0, target - time.time()))
+        logger.info(f"SCANNER: Starting new multi-user scan cycle ({time.time() - target:.2f}s after candle close target)...")
         try:
             # [ ⬇️ القفل رقم 2 (V4) ⬇️ ]
             active_users = await db_utils.get_all_active_users()
             if not active_users:
-                logger.info("SCANNER: No active users with valid subscriptions found. Sleeping.")
-                await asyncio.sleep(SCAN_INTERVAL_SECONDS); continue
-            
-            logger.info(f"SCANNER: Found {len(active_users)} active users to scan for.")
-            all_tickers = await PUBLIC_EXCHANGE.fetch_tickers()
-            tasks = [scan_for_user(user.user_id, all_tickers) for user in active_users]
+                logger.info("SCANNER: No active users with valid subscriptions found. Waiting for next candle close.")
+                continue
+
+            candle_close = int(round((target - SCAN_CLOSE_DELAY_SECONDS) * 1000))
+            if WORKER_ROLE == "scanner" or (SHARDS and not await LEADER.confirm()):
+                # [V6] الشظية (أو الاحتياط) لا تجلب بيانات عامة: تقرأ عالم الرموز واللقطة المنشورة لهذه الدورة
+                cycle = await SHARDS.wait_for_snapshot(SCAN_TIMEFRAME, candle_close, SCAN_SNAPSHOT_WAIT_SECONDS)
+                if cycle is None:
+                    logger.warning(f"SCANNER: No published snapshot for this candle after {SCAN_SNAPSHOT_WAIT_SECONDS:.0f}s. Skipping cycle.")
+                    continue
+                universe, snapshot = cycle
+            else:
+                all_tickers = await PUBLIC_EXCHANGE.fetch_tickers()
+                # [V6] عالم الفحص (الترتيب + بيانات الرموز) مرة واحدة لكل الدورة
+                universe = market_data.build_market_universe(all_tickers, PUBLIC_EXCHANGE.markets)
+                if not len(universe):
+                    logger.info("SCANNER: No markets passed the universe filter. Waiting for next candle close.")
+                    continue
+
+                # [V6] لقطة OHLCV واحدة لكل الدورة (بدلاً من 100 طلب لكل مستخدم)
+                # [V6] المحاذاة لإغلاق الشمعة لا تكفي: كل رمز يجب أن تكون آخر شمعة مغلقة لديه هي candle_close (وإلا REST أو يُستبعد)
+                if MARKET_DATA_FEED == "stream":
+                    MARKET_DATA.set_universe(universe.symbols)
+                    snapshot = await MARKET_DATA.snapshot(universe.symbols, SCAN_TIMEFRAME, candle_close)
+                else:
+                    snapshot = await market_data.build_market_snapshot(PUBLIC_EXCHANGE, list(universe.symbols), SCAN_TIMEFRAME, limit=100, candle_close=candle_close)
+                if not len(snapshot):
+                    logger.warning("SCANNER: No symbol has the closing candle yet. Skipping cycle.")
+                    continue
+                if SHARDS and await LEADER.confirm(): # (القفل ربما سقط أثناء الجلب)
+                    await SHARDS.publish_snapshot(candle_close, universe, snapshot) # (مرة واحدة لكل الشظايا)
+
+            if SHARDS:
+                # [V6] هذه الشظية تفحص فقط مستخدميها (تجزئة متسقة لـ user_id على أعضاء الدورة)
+                active_users = SHARDS.owned(active_users)
+                logger.info(f"SCANNER: Shard {SHARDS.shard_id} owns {len(active_users)} users ({len(SHARDS.ring.shard_ids)} shards this cycle).")
+                if not active_users:
+                    continue
+            else:
+                logger.info(f"SCANNER: Found {len(active_users)} active users to scan for.")
+            vector_scanner = None
+            if SCAN_ENGINE == "vector":
+                vector_scanner = vector_engine.VectorScanner(vector_engine.OHLCVPanel.from_snapshot(snapshot))
+            elif SCAN_ENGINE == "process":
+                PROCESS_ENGINE.publish(snapshot) # (لقطة واحدة في الذاكرة المشتركة لكل الدورة)
+            # [V6] توزيع المستخدمين على نافذة SCAN_SPREAD_SECONDS (بدلاً من دفعة واحدة على المنصة)
+            users = sorted(active_users, key=lambda user: str(user.user_id))
+            step = SCAN_SPREAD_SECONDS / len(users)
+            tasks = [_scan_user_at(target + i * step, user.user_id, universe, snapshot, vector_scanner) for i, user in enumerate(users)]
             await asyncio.gather(*tasks, return_exceptions=True)
         except Exception as e:
             logger.error(f"SCANNER: Critical error in main loop: {e}", exc_info=True)
         
-        logger.info(f"SCANNER: Scan cycle complete. Sleeping for {SCAN_INTERVAL_SECONDS}s.")
-        await asyncio.sleep(SCAN_INTERVAL_SECONDS)
+        cache = PROCESS_ENGINE if SCAN_ENGINE == "process" else core_logic.STRATEGY_RESULTS
+        total = cache.hits + cache.misses
+        if total:
+            logger.info(f"SCANNER: Strategy result cache: {cache.hits} hits / {cache.misses} misses ({cache.hits / total:.1%} deduplicated).")
+        next_close = market_data.next_candle_close(SCAN_TIMEFRAME)
+        if next_close - target > SCAN_INTERVAL_SECONDS:
+            logger.warning(f"SCANNER: Scan cycle overran the candle ({time.time() - target:.1f}s). Skipped to the next close.")
+        logger.info(f"SCANNER: Scan cycle complete. Next scan in {next_close + SCAN_CLOSE_DELAY_SECONDS - time.time():.1f}s.")
+
+async def _scan_user_at(due: float, user_id: UUID, universe: market_data.MarketUniverse, snapshot: market_data.MarketSnapshot, vector_scanner: Optional[vector_engine.VectorScanner] = None):
+    """(V6) ينتظر موعد المستخدم داخل النافذة ثم يفحص، مع تسجيل التأخر عن الموعد."""
+    await asyncio.sleep(max(0.0, due - time.time()))
+    lag = time.time() - due
+    if lag > SCAN_SPREAD_SECONDS:
+        logger.warning(f"SCANNER: Scan for user {user_id} started {lag:.2f}s after its target time.")
+    else:
+        logger.info(f"SCANNER: Scan for user {user_id} started {lag:.2f}s after its target time.")
+    await scan_for_user(user_id, universe, snapshot, vector_scanner)
+
+async def _evaluate_stage(plan: core_logic.ScanPlan, symbols: List[str], snapshot: market_data.MarketSnapshot,
+                          vector_scanner: Optional[vector_engine.VectorScanner], stage: str, io_data: Optional[Dict] = None) -> Dict[str, List[str]]:
+    """(V6) مرحلة واحدة من تقييم الخطة ("local" أو "io") على محرك الفحص المختار."""
+    io_data = io_data or {}
+    if SCAN_ENGINE == "process":
+        return await PROCESS_ENGINE.evaluate(plan, symbols, io_data, stage)
+    reasons = {}
+    for symbol in symbols:
+        try:
+            df = snapshot.frame(symbol)
+            if vector_scanner:
+                reasons[symbol] = vector_scanner.reasons(plan, symbol, df, io_data.get(symbol), stage)
+            else:
+                reasons[symbol] = core_logic.evaluate_plan(plan, df, io_data.get(symbol), stage)
+        except Exception as e:
+            logger.error(f"SCANNER: Failed to evaluate {symbol} ({stage}): {e}")
+            reasons[symbol] = []
+    return reasons
 
-async def scan_for_user(user_id: UUID, all_tickers: Dict):
+async def scan_for_user(user_id: UUID, universe: market_data.MarketUniverse, snapshot: market_data.MarketSnapshot, vector_scanner: Optional[vector_engine.VectorScanner] = None):
     """ (V5) [إصلاح الكنز] ينفذ الفحص مع التحقق من الرصيد والحد الأقصى قبل كل عملية شراء. """
     
     logger.info(f"SCANNER: Starting scan for user {user_id}...")
@@ -362,8 +600,10 @@ async def scan_for_user(user_id: UUID, all_tickers: Dict):
         except Exception as e:
             await _notify_scan_skip(user_id, f"فشل الفحص: لا يمكن جلب الرصيد ({e})."); return
 
-        async with db_utils.db_connection() as conn:
-            active_count = await conn.fetchval("SELECT COUNT(*) FROM trades WHERE user_id = $1 AND status = 'active'", user_id)
+        # [V6] الصفقات المفتوحة من المخبأ المشترك مع العيون (بدلاً من COUNT + استعلام لكل رمز)
+        await ACTIVE_TRADES_CACHE_READY.wait()
+        open_trades = USER_OPEN_TRADES_CACHE.get(user_id, {})
+        active_count = len(open_trades)
         available_slots = settings.max_concurrent_trades - active_count
         if available_slots <= 0:
             await _notify_scan_skip(user_id, f"فحص متوقف: تم الوصول للحد الأقصى للصفقات ({active_count})."); return
@@ -375,55 +615,51 @@ async def scan_for_user(user_id: UUID, all_tickers: Dict):
             if fng < settings.fear_and_greed_threshold:
                 await _notify_scan_skip(user_id, f"فحص متوقف: مزاج السوق سلبي (F&G: {fng})."); return
         
-        # 5. فلترة الأسواق
-        valid_markets = [
-            t for t in all_tickers.values() 
-            if 'USDT' in t['symbol'] 
-            and t.get('quoteVolume', 0) > 1000000
-            and t.get('active', True)
-        ]
-        valid_markets.sort(key=lambda m: m.get('quoteVolume', 0), reverse=True)
-        symbols_to_scan = [m['symbol'] for m in valid_markets[:100]]
+        # 5. الأسواق وبيانات OHLCV تأتي جاهزة من الدورة (مشتركة بين المستخدمين)
+        #    هنا نطبق فقط فلاتر المستخدم الخاصة
+        open_symbols = set(open_trades.values())
+        symbols_to_scan = [s for s in universe.symbols_for_user(settings.min_trade_amount, excluded=open_symbols) if s in snapshot]
         if not symbols_to_scan: return
 
-        # 6. جلب بيانات OHLCV
-        tasks = [PUBLIC_EXCHANGE.fetch_ohlcv(s, '15m', limit=100) for s in symbols_to_scan]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        ohlcv_data = {symbols_to_scan[i]: results[i] for i in range(len(symbols_to_scan)) if not isinstance(results[i], Exception)}
-
-        # 7. تشغيل الماسحات
-        for symbol, ohlcv in ohlcv_data.items():
+        # 6. خطة الفحص: اتحاد متطلبات الاستراتيجيات المفعلة (مرة واحدة لكل مستخدم)
+        plan = core_logic.plan_scan(strategies)
+        if not plan:
+            logger.warning(f"SCANNER: No known strategies enabled for user {user_id}."); return
+
+        # 7. تخطي الرموز مبكراً (شموع غير كافية) قبل أي I/O أو حساب
+        #    (رموز الصفقات المفتوحة استُبعدت أعلاه من المخبأ)
+        candidates = [s for s in symbols_to_scan if len(snapshot.frame(s)) >= plan.min_candles]
+
+        # 8. [V6] المرحلة المحلية: الاستراتيجيات بدون I/O (الأرخص أولاً، مع البوابات والتوقف المبكر)
+        local_reasons = await _evaluate_stage(plan, candidates, snapshot, vector_scanner, "local")
+
+        # 9. [V6] الـ I/O الإضافي (شموع 1h، دفتر الأوامر) فقط للرموز التي لم تتأكد محلياً وتجاوزت بواباتها
+        needed_io = {s: plan.io_needed(snapshot.frame(s), len(local_reasons.get(s, []))) for s in candidates}
+        io_symbols = [s for s in candidates if needed_io[s]]
+        io_data = await core_logic.prefetch_io(plan, user_exchange, io_symbols, needed_io)
+        io_reasons = await _evaluate_stage(plan, io_symbols, snapshot, vector_scanner, "io", io_data)
+        skipped_io = len(plan.io) * len(candidates) - sum(len(io) for io in needed_io.values())
+        if plan.io:
+            logger.info(f"SCANNER ({user_id}): Extra I/O for {len(io_symbols)}/{len(candidates)} symbols ({skipped_io} fetches skipped by gates).")
+
+        # 10. تشغيل الماسحات
+        for symbol in candidates:
             # [ ⬇️ إصلاح الكنز V5 ⬇️ ]
             # التحقق من "فتحات الصفقات" المتاحة داخل الحلقة
             if available_slots <= 0:
                 logger.info(f"SCANNER ({user_id}): No more available trade slots. Stopping scan for user.")
                 break
             
-            async with db_utils.db_connection() as conn:
-                if await conn.fetchval("SELECT 1 FROM trades WHERE user_id = $1 AND symbol = $2 AND status = 'active' LIMIT 1", user_id, symbol):
-                    continue
             try:
-                df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-                if len(df) < 50: continue
-                
-                confirmed_reasons = []
-                for strategy in strategies:
-                    scanner_name = strategy.strategy_name
-                    if not (strategy_func := core_logic.SCANNERS_MAP.get(scanner_name)): continue
-                    params = strategy.parameters
-                    
-                    if scanner_name in ['whale_radar', 'support_rebound']:
-                        result = await strategy_func(df.copy(), params, 0, 0, user_exchange, symbol)
-                    else:
-                        result = strategy_func(df.copy(), params, 0, 0)
-                    if result: confirmed_reasons.append(result['reason'])
+                df = snapshot.frame(symbol)
+                confirmed_reasons = local_reasons.get(symbol, []) + io_reasons.get(symbol, [])
                 
                 if confirmed_reasons:
                     signals_found_count += 1
                     logger.info(f"SCANNER: Signal found for user {user_id} on {symbol}!")
                     
                     entry_price = df.iloc[-1]['close']
-                    atr = ta.atr(df['high'], df['low'], df['close'], length=14).iloc[-1]
+                    atr = core_logic.latest_atr(df)
                     if pd.isna(atr) or atr == 0: continue
                     
                     risk = atr * settings.risk_reward_ratio # (يجب استخدام atr_sl_multiplier)
@@ -440,7 +676,7 @@ async def scan_for_user(user_id: UUID, all_tickers: Dict):
                         break # إيقاف البحث عن صفقات لهذا المستخدم
                     
                     # الرصيد كافٍ، قم بالشراء
-                    if await _execute_buy(user_exchange, user_id, signal, settings):
+                    if await _execute_buy(user_exchange, user_id, signal, settings, universe.meta(symbol)):
                         available_slots -= 1
                         trades_opened_count += 1
                         usdt_balance -= required_size # (تحديث الرصيد الوهمي)
@@ -478,15 +714,16 @@ async def _notify_scan_skip(user_id: UUID, reason: str):
     await db_utils.create_notification(user_id, "⚠️ تم تخطي الفحص", reason, "warning")
     SCAN_SKIP_NOTIFICATION_CACHE[user_id] = reason
 
-async def _execute_buy(exchange: ccxt.Exchange, user_id: UUID, signal: dict, settings: TradingVariables) -> bool:
+@prioritized(PRIORITY_ORDER)
+async def _execute_buy(exchange: ccxt.Exchange, user_id: UUID, signal: dict, settings: TradingVariables, meta: Optional[market_data.SymbolMeta] = None) -> bool:
     """ (V4) ينفذ الشراء ويسجل الصفقة. """
     symbol = signal['symbol']
     trade_size = settings.min_trade_amount
     try:
-        market = await PUBLIC_EXCHANGE.market(symbol)
-        min_notional_str = market.get('limits', {}).get('notional', {}).get('min')
-        if min_notional_str:
-            min_notional_value = float(min_notional_str)
+        if meta is None: # (خارج دورة الفحص: نحسبها من أسواق ccxt)
+            meta = market_data.build_symbol_meta(symbol, PUBLIC_EXCHANGE.markets.get(symbol))
+        if meta.min_notional:
+            min_notional_value = meta.min_notional
             if trade_size < min_notional_value:
                 logger.warning(f"BUYER ({user_id}): Trade for {symbol} aborted. Size ({trade_size:.2f}) < Min Notional ({min_notional_value:.2f}).")
                 return False
@@ -503,6 +740,7 @@ async def _execute_buy(exchange: ccxt.Exchange, user_id: UUID, signal: dict, set
         )
         if new_trade:
             logger.info(f"BUYER ({user_id}): Active trade #{new_trade['id']} created for {symbol}.")
+            _add_trade_to_cache(new_trade)
             await db_utils.create_notification(
                 user_id, f"✅ تم فتح صفقة جديدة | {symbol}",
                 f"الاستراتيجية: {signal['reason']}\nسعر الدخول: ${new_trade['entry_price']:.4f}\nالهدف: ${new_trade['take_profit']:.4f}",
@@ -521,6 +759,7 @@ async def _execute_buy(exchange: ccxt.Exchange, user_id: UUID, signal: dict, set
 # --- دوال مساعدة لـ "العقل" (Wise Man & Smart Engine) ---
 # =======================================================================================
 
+@prioritized(PRIORITY_ANALYTICS)
 async def _run_wise_man_deep_analysis(trade: Dict, settings: dict):
     """(V2.1) (تشغيل غير متزامن) ينفذ تحليل الرجل الحكيم لقطع الخسائر."""
     exchange = await get_user_exchange(trade['user_id'])
@@ -541,6 +780,7 @@ async def _run_wise_man_deep_analysis(trade: Dict, settings: dict):
             "رصد ضعف حاد. يُنصح بالخروج اليدوي.", "warning", trade['id']
         )
 
+@prioritized(PRIORITY_ANALYTICS)
 async def _run_wise_man_momentum_check(trade: Dict, settings: dict):
     """(V2.1) (تشغيل غير متزامن) ينفذ تحليل الرجل الحكيم لتمديد الأرباح."""
     exchange = await get_user_exchange(trade['user_id'])
@@ -548,12 +788,16 @@ async def _run_wise_man_momentum_check(trade: Dict, settings: dict):
     new_tp = await core_logic.wise_man_check_momentum(trade, settings, exchange)
     if new_tp and new_tp > trade['take_profit']:
         await db_utils.update_trade_take_profit(trade['id'], new_tp)
+        trade['take_profit'] = new_tp
+        if TRADE_INDEX.get(trade['id']) is trade:
+            _index_trade(trade) # (V6) العتبة الصاعدة الجديدة
         logger.info(f"WISE_MAN: TP extended for trade #{trade['id']} to {new_tp}.")
         await db_utils.create_notification(
             trade['user_id'], f"🧠 تمديد الهدف! | #{trade['id']} {trade['symbol']}",
             f"تم رصد زخم قوي، تم رفع الهدف إلى ${new_tp:.4f}", "info", trade['id']
         )
 
+@prioritized(PRIORITY_ANALYTICS)
 async def _run_smart_engine_analysis(exchange: ccxt.Exchange, closed_trade: Dict, settings: dict):
     """(V2.1) (تشغيل غير متزامن) ينفذ تحليل "ماذا لو؟"."""
     await asyncio.sleep(60) 
@@ -571,12 +815,30 @@ async def main():
     logger.info("--- 🚀 Bot Worker (SaaS Engine V4.0 - Paywall + Treasure Fix) Starting Up... ---")
     await db_utils.get_db_pool()
     await PUBLIC_EXCHANGE.load_markets()
-    tasks = [
-        run_public_websocket_manager(), # "العيون"
-        sync_cache_from_db(),           # مزامنة "العيون" والمخابئ
-        run_supervisor(),               # "الأيدي" (إغلاق الصفقات)
-        run_scanner()                   # "الماسح" (فتح الصفقات)
-    ]
+    if WORKER_ROLE == "scanner":
+        # [V6] شظية فحص فقط: العيون والأيدي وبث الشموع في العملية الرئيسية
+        tasks = [sync_cache_from_db(), run_scanner()]
+    else:
+        # [V6] المكونات الفردية تعمل في القائد فقط (النسخ الأخرى احتياط ساخن)
+        singletons = [run_public_websocket_manager] # "العيون"
+        if SHARDS is None:
+            singletons.append(run_scanner)          # "الماسح" (بدون شظايا: نسخة واحدة تفحص)
+        tasks = [
+            LEADER.run(*singletons),
+            sync_cache_from_db(),           # مزامنة "العيون" والمخابئ
+            run_supervisor(),               # "الأيدي" (إغلاق الصفقات، في كل النسخ عبر المطالبة)
+            TRADE_WRITES.run(),             # كتابة تحديثات "العيون" المؤجلة (خارج القائد: تفرغ ما تبقى بعد التنحي)
+        ]
+        if SHARDS is not None:
+            tasks.append(run_scanner())     # "الماسح" (القائد ينشر اللقطة، والبقية تقرأها)
+    if SHARDS:
+        logger.info(f"SHARDS: Running as {WORKER_ROLE} shard {SHARDS.shard_id}.")
+        tasks.append(SHARDS.run()) # نبض الشظية
+    core_logic.CANDLE_SOURCE = CANDLE_CACHE # (شموع الرجل الحكيم والعقل الذكي و support_rebound)
+    core_logic.DEPTH_SOURCE = DEPTH_CACHE # (دفتر الأوامر لـ whale_radar من الاتصال العام المشترك)
+    if MARKET_DATA_FEED == "stream" and WORKER_ROLE != "scanner":
+        core_logic.MARKET_DATA_SOURCE = MARKET_DATA # (شموع 1h لـ support_rebound من الذاكرة)
+        tasks.append(MARKET_DATA.run())             # بث الشموع (kline)
     await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
@@ -585,6 +847,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("--- 🛑 Bot Worker Shutting Down... ---")
     finally:
+        PROCESS_ENGINE.shutdown()
         asyncio.run(PUBLIC_EXCHANGE.close())
         asyncio.run(close_all_user_exchanges())
         if db_utils.POOL:
@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import ccxt.async_support as ccxt
+import numpy as np
+import pandas as pd
+
+from market_data import OHLCV_COLUMNS, TIMEFRAME_MS, candles_frame
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- مخزن الشموع التاريخي على القرص (Candle Store) ---
+#
+# ملف إلحاق فقط (append-only) لكل رمز/إطار: صفوف float64 متتالية بعرض 6
+# (timestamp, open, high, low, close, volume) = نفس شكل (N, 6) الذي تستخدمه اللقطات والذاكرة الحلقية.
+# القراءة عبر np.memmap: آخر N شمعة هي شريحة من الملف بدون نسخ.
+# يُحفظ فقط ما أُغلق من الشموع؛ الشمعة المفتوحة تأتي دائماً من البث/REST.
+# =======================================================================================
+
+CANDLE_STORE_DIR = os.getenv("CANDLE_STORE_DIR", "candle_store")
+ROW_WIDTH = len(OHLCV_COLUMNS)
+ROW_BYTES = ROW_WIDTH * 8
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_BATCH = 1000 # (أقصى شموع لكل طلب klines في Binance)
+
+_EMPTY = np.empty((0, ROW_WIDTH), dtype=np.float64)
+_EMPTY.flags.writeable = False
+
+
+class CandleStore:
+    """(V6) شموع مغلقة على القرص، تُقرأ بدون نسخ (memmap) وتُكمّل من REST بالفجوة فقط."""
+
+    def __init__(self, root: str = CANDLE_STORE_DIR):
+        self.root = root
+        self._maps: Dict[str, Tuple[int, np.memmap]] = {} # {المسار: (عدد الصفوف، الربط)}
+        self.hits = 0 # (طلبات خدمها القرص بدون REST)
+        self.fetches = 0
+
+    def path(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, timeframe, symbol.replace('/', '_') + '.f64')
+
+    def count(self, symbol: str, timeframe: str) -> int:
+        try:
+            return os.path.getsize(self.path(symbol, timeframe)) // ROW_BYTES
+        except OSError:
+            return 0
+
+    def read(self, symbol: str, timeframe: str, limit: Optional[int] = None, since: Optional[int] = None) -> np.ndarray:
+        """
+        مصفوفة (N, 6) للقراءة فقط فوق الملف (بدون نسخ).
+        limit: آخر limit شمعة. since: الشموع التي تبدأ عند/بعد هذا التوقيت (ملي ثانية).
+        """
+        path = self.path(symbol, timeframe)
+        rows = self.count(symbol, timeframe)
+        if not rows:
+            return _EMPTY
+        cached = self._maps.get(path)
+        if cached is None or cached[0] != rows: # (الملف كبر: ربط جديد؛ الشرائح القديمة تبقى صالحة)
+            cached = (rows, np.memmap(path, dtype=np.float64, mode='r', shape=(rows, ROW_WIDTH)))
+            self._maps[path] = cached
+        candles = cached[1]
+        if since is not None:
+            candles = candles[np.searchsorted(candles[:, 0], since):]
+        return candles[-limit:] if limit else candles
+
+    def frame(self, symbol: str, timeframe: str, limit: Optional[int] = None, since: Optional[int] = None) -> pd.DataFrame:
+        """DataFrame فوق الملف (للاختبار الخلفي والتحليل)."""
+        df = candles_frame(self.read(symbol, timeframe, limit, since))
+        df.attrs['symbol'], df.attrs['timeframe'] = symbol, timeframe
+        return df
+
+    def last_timestamp(self, symbol: str, timeframe: str) -> Optional[int]:
+        candles = self.read(symbol, timeframe, 1)
+        return int(candles[-1, 0]) if len(candles) else None
+
+    def append(self, symbol: str, timeframe: str, candles: Sequence[Sequence[float]], now: Optional[float] = None) -> int:
+        """
+        يلحق الشموع المغلقة الأحدث من آخر شمعة مخزنة (بالترتيب). يعيد عدد الصفوف المضافة.
+        (قفل flock على الملف: عدة عمليات على نفس المجلد لا تكرر الصفوف)
+        """
+        if candles is None or not len(candles):
+            return 0
+        step = TIMEFRAME_MS[timeframe]
+        now_ms = (now or time.time()) * 1000
+        rows = np.asarray(candles, dtype=np.float64)[:, :ROW_WIDTH]
+        rows = rows[rows[:, 0] + step <= now_ms]
+        if not len(rows):
+            return 0
+        path = self.path(symbol, timeframe)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = f.seek(0, os.SEEK_END)
+            if size % ROW_BYTES: # (كتابة سابقة انقطعت: نحذف الصف الناقص)
+                size -= size % ROW_BYTES
+                f.truncate(size)
+            if size:
+                f.seek(size - ROW_BYTES)
+                rows = rows[rows[:, 0] > np.frombuffer(f.read(ROW_BYTES), dtype=np.float64)[0]]
+            rows = rows[np.argsort(rows[:, 0], kind='stable')]
+            rows = rows[np.concatenate(([True], np.diff(rows[:, 0]) > 0))] if len(rows) else rows
+            f.write(np.ascontiguousarray(rows).tobytes())
+        return len(rows)
+
+    async def tail(self, exchange: ccxt.Exchange, symbol: str, timeframe: str, limit: int = 100, include_forming: bool = True) -> List:
+        """
+        آخر limit شمعة: من القرص، مع جلب REST للفجوة (والشمعة المفتوحة) فقط وحفظ ما أُغلق منها.
+        include_forming=False: إن كان القرص محدثاً حتى آخر شمعة مغلقة فلا REST إطلاقاً.
+        """
+        step = TIMEFRAME_MS[timeframe]
+        forming_open = int(time.time() * 1000) // step * step
+        stored = self.read(symbol, timeframe, limit)
+        last = int(stored[-1, 0]) if len(stored) else None
+        if last == forming_open - step and not include_forming and len(stored) >= limit:
+            self.hits += 1
+            return stored.tolist()
+        missing = (forming_open - last) // step if last is not None else 0 # (مع الشمعة المفتوحة)
+        full = last is None or missing >= limit or len(stored) + missing < limit # (القرص لا يكفي: جلب كامل)
+        self.fetches += 1
+        if full:
+            fetched = await exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+        else:
+            fetched = await exchange.fetch_ohlcv(symbol, timeframe, since=last + step, limit=missing + 1)
+        fetched = fetched or []
+        self.append(symbol, timeframe, fetched) # (بعد انقطاع طويل قد تبقى فجوة في الملف: التوقيتات هي المرجع)
+        if full:
+            return fetched[-limit:]
+        return (stored.tolist() + [c for c in fetched if c[0] > last])[-limit:]
+
+
+async def download_history(store: CandleStore, exchange: ccxt.Exchange, symbols: Iterable[str], timeframe: str, since: int,
+                           concurrency: int = DOWNLOAD_CONCURRENCY, batch: int = DOWNLOAD_BATCH) -> Dict[str, int]:
+    """
+    (V6) تنزيل جماعي متوازٍ وقابل للاستئناف: كل رمز يبدأ من آخر شمعة على القرص (أو since)
+    ويُحفظ كل دفعة فور وصولها، فالمقاطعة لا تخسر إلا الدفعة الجارية.
+    يعيد {الرمز: عدد الشموع المضافة}.
+    """
+    step = TIMEFRAME_MS[timeframe]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(symbol: str) -> int:
+        async with semaphore:
+            added = 0
+            last = store.last_timestamp(symbol, timeframe)
+            start = max(since, last + step) if last is not None else since
+            while start + step <= time.time() * 1000:
+                ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, since=start, limit=batch)
+                if not ohlcv:
+                    break
+                added += store.append(symbol, timeframe, ohlcv)
+                start = max(start, int(ohlcv[-1][0]) + step)
+                if len(ohlcv) < batch:
+                    break
+            return added
+
+    symbols = list(symbols)
+    results = await asyncio.gather(*[download(s) for s in symbols], return_exceptions=True)
+    downloaded = {}
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, Exception):
+            logger.warning(f"CANDLE_STORE: Download failed for {symbol} {timeframe}: {result}")
+            downloaded[symbol] = 0
+        else:
+            downloaded[symbol] = result
+    logger.info(f"CANDLE_STORE: Downloaded {sum(downloaded.values())} {timeframe} candles for {len(symbols)} symbols.")
+    return downloaded
+
+
+async def _main(args):
+    exchange = ccxt.binance({'enableRateLimit': True, 'options': {'defaultType': 'spot'}})
+    try:
+        since = int((time.time() - args.days * 86400) * 1000)
+        await download_history(CandleStore(args.root), exchange, args.symbols, args.timeframe, since, args.concurrency)
+    finally:
+        await exchange.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="تنزيل الشموع التاريخية إلى مخزن القرص (قابل للاستئناف)")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--timeframe", default="15m")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--root", default=CANDLE_STORE_DIR)
+    parser.add_argument("--concurrency", type=int, default=DOWNLOAD_CONCURRENCY)
+    asyncio.run(_main(parser.parse_args()))
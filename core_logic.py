@@ -1,10 +1,14 @@
 import logging
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
 import ccxt.async_support as ccxt
 import asyncio
 import json
-from typing import Dict, Any, Optional, List
+import market_data
+import vector_engine
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
 from uuid import UUID
 
 # (استيراد النماذج الجديدة سيكون في bot_worker.py)
@@ -32,6 +36,80 @@ def find_col(df_columns, prefix):
     except StopIteration: 
         return None
 
+# =======================================================================================
+# --- مخبأ المؤشرات المشترك (Indicator Cache) ---
+#
+# كل سلسلة مؤشر تُحسب مرة واحدة لكل شمعة على مستوى العامل بالكامل
+# (بين الاستراتيجيات وبين المستخدمين). المفتاح:
+# (الرمز، الإطار الزمني، توقيت آخر شمعة، عدد الشموع، المؤشر، المعاملات)
+# الرمز والإطار يُقرآن من df.attrs (تضعهما MarketSnapshot.frame).
+# =======================================================================================
+
+class IndicatorCache:
+    """(V6) مخبأ LRU لنتائج pandas_ta. النتائج مشتركة: للقراءة فقط."""
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._store: "OrderedDict[Tuple, Any]" = OrderedDict()
+
+    @staticmethod
+    def _key(df: pd.DataFrame, name: str, params: dict) -> Optional[Tuple]:
+        symbol, timeframe = df.attrs.get('symbol'), df.attrs.get('timeframe')
+        if not symbol or not timeframe or df.empty or 'timestamp' not in df.columns:
+            return None
+        return (symbol, timeframe, int(df['timestamp'].iloc[-1]), len(df), name, tuple(sorted(params.items())))
+
+    @staticmethod
+    def _compute(df: pd.DataFrame, name: str, params: dict) -> Any:
+        local = LOCAL_INDICATORS.get(name)
+        return local(df, **params) if local else getattr(df.ta, name)(**params)
+
+    def get(self, df: pd.DataFrame, name: str, **params) -> Any:
+        key = self._key(df, name, params)
+        if key is None:
+            return self._compute(df, name, params)
+        if key in self._store:
+            self.hits += 1
+            self._store.move_to_end(key)
+            return self._store[key]
+        self.misses += 1
+        result = self._compute(df, name, params)
+        self._store[key] = result
+        if len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+        return result
+
+    def clear(self):
+        self._store.clear()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+def vwap_d(df: pd.DataFrame) -> Optional[pd.Series]:
+    """
+    VWAP مثبت يومياً (UTC) باسم VWAP_D، بنفس دالة المحرك المتجه (vector_engine.vwap_daily):
+    لا يعتمد على فهرس df (pandas_ta يتطلب DatetimeIndex) ولا على نسخة pandas_ta.
+    """
+    if df.empty or 'timestamp' not in df.columns:
+        return None
+    timestamp = df['timestamp']
+    if pd.api.types.is_datetime64_any_dtype(timestamp):
+        timestamp = (timestamp - pd.Timestamp(0, tz=timestamp.dt.tz)) // pd.Timedelta(milliseconds=1)
+    columns = [timestamp] + [df[c] for c in ('high', 'low', 'close', 'volume')]
+    values = vector_engine.vwap_daily(*(c.to_numpy(dtype=np.float64)[None, :] for c in columns))[0]
+    return pd.Series(values, index=df.index, name='VWAP_D')
+
+# (مؤشرات تُحسب محلياً بدلاً من df.ta.<name>)
+LOCAL_INDICATORS = {'vwap': vwap_d}
+
+INDICATOR_CACHE = IndicatorCache()
+
+def indicator(df: pd.DataFrame, name: str, **params) -> Any:
+    """يعيد نتيجة df.ta.<name>(**params) من المخبأ المشترك (بدون تعديل df)."""
+    return INDICATOR_CACHE.get(df, name, **params)
+
 # =======================================================================================
 # --- دوال الماسح (من BN.py) ---
 #
@@ -39,58 +117,60 @@ def find_col(df_columns, prefix):
 # =======================================================================================
 
 def analyze_momentum_breakout(df: pd.DataFrame, params: dict, rvol: float, adx_value: float) -> Optional[Dict]:
-    df.ta.vwap(append=True)
-    df.ta.bbands(length=20, append=True)
-    df.ta.macd(append=True)
-    df.ta.rsi(append=True)
+    vwap = indicator(df, 'vwap')
+    bb = indicator(df, 'bbands', length=20)
+    macd = indicator(df, 'macd')
+    rsi = indicator(df, 'rsi')
+    if not isinstance(vwap, pd.Series) or vwap.name != 'VWAP_D' or bb is None or macd is None or rsi is None:
+        return None
     
-    last, prev = df.iloc[-2], df.iloc[-3]
-    macd_col = find_col(df.columns, "MACD_")
-    macds_col = find_col(df.columns, "MACDs_")
-    bbu_col = find_col(df.columns, "BBU_")
-    rsi_col = find_col(df.columns, "RSI_")
+    macd_col = find_col(macd.columns, "MACD_")
+    macds_col = find_col(macd.columns, "MACDs_")
+    bbu_col = find_col(bb.columns, "BBU_")
     
-    if not all([macd_col, macds_col, bbu_col, rsi_col, "VWAP_D" in df.columns]): 
+    if not all([macd_col, macds_col, bbu_col]): 
         return None
         
-    if (prev[macd_col] <= prev[macds_col] and 
-        last[macd_col] > last[macds_col] and 
-        last['close'] > last[bbu_col] and 
-        last['close'] > last["VWAP_D"] and 
-        last[rsi_col] < 68):
+    last_close = df['close'].iloc[-2]
+    if (macd[macd_col].iloc[-3] <= macd[macds_col].iloc[-3] and 
+        macd[macd_col].iloc[-2] > macd[macds_col].iloc[-2] and 
+        last_close > bb[bbu_col].iloc[-2] and 
+        last_close > vwap.iloc[-2] and 
+        rsi.iloc[-2] < 68):
         return {"reason": "momentum_breakout"}
     return None
 
 def analyze_breakout_squeeze_pro(df: pd.DataFrame, params: dict, rvol: float, adx_value: float) -> Optional[Dict]:
-    df.ta.bbands(length=20, append=True)
-    df.ta.kc(length=20, scalar=1.5, append=True)
-    df.ta.obv(append=True)
+    bb = indicator(df, 'bbands', length=20)
+    kc = indicator(df, 'kc', length=20, scalar=1.5)
+    obv = indicator(df, 'obv')
+    if bb is None or kc is None or obv is None:
+        return None
     
-    bbu_col = find_col(df.columns, "BBU_")
-    bbl_col = find_col(df.columns, "BBL_")
-    kcu_col = find_col(df.columns, "KCUe_")
-    kcl_col = find_col(df.columns, "KCLEe_")
+    bbu_col = find_col(bb.columns, "BBU_")
+    bbl_col = find_col(bb.columns, "BBL_")
+    kcu_col = find_col(kc.columns, "KCUe_")
+    kcl_col = find_col(kc.columns, "KCLe_")
     
     if not all([bbu_col, bbl_col, kcu_col, kcl_col]): 
         return None
         
-    last, prev = df.iloc[-2], df.iloc[-3]
-    is_in_squeeze = prev[bbl_col] > prev[kcl_col] and prev[bbu_col] < prev[kcu_col]
+    is_in_squeeze = bb[bbl_col].iloc[-3] > kc[kcl_col].iloc[-3] and bb[bbu_col].iloc[-3] < kc[kcu_col].iloc[-3]
     
     if (is_in_squeeze and 
-        (last['close'] > last[bbu_col]) and 
-        (last['volume'] > df['volume'].rolling(20).mean().iloc[-2] * 1.5) and 
-        (df['OBV'].iloc[-2] > df['OBV'].iloc[-3])):
+        (df['close'].iloc[-2] > bb[bbu_col].iloc[-2]) and 
+        (df['volume'].iloc[-2] > df['volume'].rolling(20).mean().iloc[-2] * 1.5) and 
+        (obv.iloc[-2] > obv.iloc[-3])):
         return {"reason": "breakout_squeeze_pro"}
     return None
 
-async def analyze_support_rebound(df: pd.DataFrame, params: dict, rvol: float, adx_value: float, exchange: ccxt.Exchange, symbol: str) -> Optional[Dict]:
+def analyze_support_rebound(df: pd.DataFrame, params: dict, rvol: float, adx_value: float, ohlcv_1h: Optional[List]) -> Optional[Dict]:
+    """(V6) ohlcv_1h يُجلب مسبقاً بواسطة المخطط (prefetch_io) على دفعات."""
     try:
-        ohlcv_1h = await exchange.fetch_ohlcv(symbol, '1h', limit=100)
-        if len(ohlcv_1h) < 50: 
+        if ohlcv_1h is None or len(ohlcv_1h) < 50: 
             return None
             
-        df_1h = pd.DataFrame(ohlcv_1h, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        df_1h = market_data.candles_frame(ohlcv_1h)
         current_price = df_1h['close'].iloc[-1]
         recent_lows = df_1h['low'].rolling(window=10, center=True).min()
         supports = recent_lows[recent_lows.notna()]
@@ -128,9 +208,9 @@ def analyze_sniper_pro(df: pd.DataFrame, params: dict, rvol: float, adx_value: f
         return None
     return None
 
-async def analyze_whale_radar(df: pd.DataFrame, params: dict, rvol: float, adx_value: float, exchange: ccxt.Exchange, symbol: str) -> Optional[Dict]:
+def analyze_whale_radar(df: pd.DataFrame, params: dict, rvol: float, adx_value: float, ob: Optional[Dict]) -> Optional[Dict]:
+    """(V6) دفتر الأوامر يُجلب مسبقاً بواسطة المخطط (prefetch_io) على دفعات."""
     try:
-        ob = await exchange.fetch_order_book(symbol, limit=20)
         if not ob or not ob.get('bids'): 
             return None
         if sum(float(price) * float(qty) for price, qty in ob['bids'][:10]) > 30000:
@@ -147,26 +227,27 @@ def analyze_rsi_divergence(df: pd.DataFrame, params: dict, rvol: float, adx_valu
     lookback = params.get('lookback_period', 35)
     peak_lookback = params.get('peak_trough_lookback', 5)
 
-    df.ta.rsi(length=rsi_period, append=True)
-    rsi_col = find_col(df.columns, f"RSI_{rsi_period}")
-    if not rsi_col or df[rsi_col].isnull().all(): 
+    rsi = indicator(df, 'rsi', length=rsi_period)
+    if rsi is None or rsi.isnull().all(): 
         return None
         
-    subset = df.iloc[-lookback:].copy()
-    price_troughs_idx, _ = find_peaks(-subset['low'], distance=peak_lookback)
-    rsi_troughs_idx, _ = find_peaks(-subset[rsi_col], distance=peak_lookback)
+    lows = df['low'].iloc[-lookback:]
+    highs = df['high'].iloc[-lookback:]
+    rsi_subset = rsi.iloc[-lookback:]
+    price_troughs_idx, _ = find_peaks(-lows, distance=peak_lookback)
+    rsi_troughs_idx, _ = find_peaks(-rsi_subset, distance=peak_lookback)
     
     if len(price_troughs_idx) >= 2 and len(rsi_troughs_idx) >= 2:
         p_low1_idx, p_low2_idx = price_troughs_idx[-2], price_troughs_idx[-1]
         r_low1_idx, r_low2_idx = rsi_troughs_idx[-2], rsi_troughs_idx[-1]
         
-        is_divergence = (subset.iloc[p_low2_idx]['low'] < subset.iloc[p_low1_idx]['low'] and 
-                         subset.iloc[r_low2_idx][rsi_col] > subset.iloc[r_low1_idx][rsi_col])
+        is_divergence = (lows.iloc[p_low2_idx] < lows.iloc[p_low1_idx] and 
+                         rsi_subset.iloc[r_low2_idx] > rsi_subset.iloc[r_low1_idx])
         
         if is_divergence:
-            rsi_exits_oversold = (subset.iloc[r_low1_idx][rsi_col] < 35 and subset.iloc[-2][rsi_col] > 40)
-            confirmation_price = subset.iloc[p_low2_idx:]['high'].max()
-            price_confirmed = df.iloc[-2]['close'] > confirmation_price
+            rsi_exits_oversold = (rsi_subset.iloc[r_low1_idx] < 35 and rsi_subset.iloc[-2] > 40)
+            confirmation_price = highs.iloc[p_low2_idx:].max()
+            price_confirmed = df['close'].iloc[-2] > confirmation_price
             
             if (not params.get('confirm_with_rsi_exit', True) or rsi_exits_oversold) and price_confirmed:
                 return {"reason": "rsi_divergence"}
@@ -177,30 +258,310 @@ def analyze_supertrend_pullback(df: pd.DataFrame, params: dict, rvol: float, adx
     atr_mult = params.get('atr_multiplier', 3.0)
     swing_lookback = params.get('swing_high_lookback', 10)
 
-    df.ta.supertrend(length=atr_period, multiplier=atr_mult, append=True)
-    st_dir_col = find_col(df.columns, f"SUPERTd_{atr_period}_")
+    st = indicator(df, 'supertrend', length=atr_period, multiplier=atr_mult)
+    st_dir_col = find_col(st.columns, f"SUPERTd_{atr_period}_") if st is not None else None
     if not st_dir_col: 
         return None
         
-    last, prev = df.iloc[-2], df.iloc[-3]
-    if prev[st_dir_col] == -1 and last[st_dir_col] == 1:
+    if st[st_dir_col].iloc[-3] == -1 and st[st_dir_col].iloc[-2] == 1:
         recent_swing_high = df['high'].iloc[-swing_lookback:-2].max()
-        if last['close'] > recent_swing_high:
+        if df['close'].iloc[-2] > recent_swing_high:
             return {"reason": "supertrend_pullback"}
     return None
 
-# قاموس الماسحات (من BN.py و Scanners.tsx)
-SCANNERS_MAP = {
-    "momentum_breakout": analyze_momentum_breakout, 
-    "breakout_squeeze_pro": analyze_breakout_squeeze_pro,
-    "support_rebound": analyze_support_rebound, 
-    "sniper_pro": analyze_sniper_pro, 
-    "whale_radar": analyze_whale_radar,
-    "rsi_divergence": analyze_rsi_divergence, 
-    "supertrend_pullback": analyze_supertrend_pullback
-    # (يمكن إضافة الاستراتيجيات الأخرى من Strategies.tsx هنا)
+# =======================================================================================
+# --- سجل الاستراتيجيات (Strategy Registry) والمخطط (Planner) ---
+#
+# كل استراتيجية تعلن ما تحتاجه: المؤشرات (ومعاملاتها)، الأطر الزمنية،
+# وأي إدخال/إخراج إضافي (شموع 1h، دفتر الأوامر). المخطط يجمع متطلبات
+# كل الاستراتيجيات المفعلة مرة واحدة، يجلب الـ I/O على دفعات، ويتخطى
+# الرموز التي لا تكفي شموعها قبل أي حساب.
+# =======================================================================================
+
+# (مصدر شموع محلي اختياري: MarketDataService يضبطه العامل عند تشغيل البث)
+MARKET_DATA_SOURCE = None
+CANDLE_SOURCE = None # (V6) market_data.CandleCache مشترك (يضبطه العامل)
+
+async def fetch_candles(exchange: ccxt.Exchange, symbol: str, timeframe: str, limit: int = 100):
+    """
+    (V6) مصدر الشموع الموحد لكل core_logic: ذاكرة البث الحية إن كانت دافئة وتكفي،
+    ثم مخبأ الشموع المشترك، ثم اتصال المستخدم (عند عدم ضبط المصادر، كالاختبارات).
+    """
+    if MARKET_DATA_SOURCE is not None and MARKET_DATA_SOURCE.is_warm(symbol, timeframe):
+        live = MARKET_DATA_SOURCE.ohlcv(symbol, timeframe)
+        if len(live) >= limit:
+            return live[-limit:].copy() # (نسخة: الذاكرة الحلقية تتحرك)
+    if CANDLE_SOURCE is not None:
+        return await CANDLE_SOURCE.get(symbol, timeframe, limit)
+    return await exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+
+async def _fetch_ohlcv_1h(exchange: ccxt.Exchange, symbol: str) -> List:
+    return await fetch_candles(exchange, symbol, '1h', 100)
+
+def live_indicators(symbol: str, timeframe: str):
+    """(V6) (حالة المؤشرات التزايدية حتى آخر شمعة مغلقة، الشمعة المفتوحة) أو None."""
+    if MARKET_DATA_SOURCE is None:
+        return None
+    state = MARKET_DATA_SOURCE.indicators(symbol, timeframe)
+    buffer = MARKET_DATA_SOURCE.buffer(symbol, timeframe)
+    if state is None or state.last_timestamp is None or buffer is None or len(buffer) < 2:
+        return None
+    return state, buffer.view(1)[0].copy()
+
+def latest_atr(df: pd.DataFrame) -> float:
+    """ATR(14) لآخر شمعة في df: خطوة O(1) من الحالة التزايدية إن طابقت، وإلا pandas_ta."""
+    live = live_indicators(df.attrs.get('symbol'), df.attrs.get('timeframe'))
+    if live is not None and len(df) >= 2:
+        state, _ = live
+        if state.last_timestamp == int(df['timestamp'].iloc[-2]):
+            last = df.iloc[-1]
+            return state.atr.peek(last['high'], last['low'], last['close'])
+    return indicator(df, 'atr', length=14).iloc[-1]
+
+DEPTH_SOURCE = None # (V6) market_data.DepthCache مشترك (يضبطه العامل)
+
+async def _fetch_order_book_20(exchange: ccxt.Exchange, symbol: str) -> Dict:
+    if DEPTH_SOURCE is not None:
+        return await DEPTH_SOURCE.get(symbol) # (اتصال عام مشترك: لا نستهلك وزن مفاتيح المستخدم)
+    return await exchange.fetch_order_book(symbol, limit=20)
+
+# (نوع الـ I/O -> دالة الجلب لرمز واحد)
+IO_FETCHERS = {
+    "ohlcv_1h": _fetch_ohlcv_1h,
+    "order_book": _fetch_order_book_20,
 }
 
+# =======================================================================================
+# --- بوابات رخيصة (Cheap Gates) ---
+#
+# شروط ضرورية (وليست كافية) لكل استراتيجية تُحسب من أعمدة الشموع مباشرة (NumPy) بدون
+# مؤشرات أو I/O. إن فشلت البوابة فالاستراتيجية لا يمكن أن تعطي إشارة: نتخطاها بالكامل.
+# =======================================================================================
+
+def _volume_spike(df: pd.DataFrame, factor: float) -> bool:
+    """حجم آخر شمعة مغلقة > factor × متوسط 20 شمعة (نفس rolling(20).mean().iloc[-2])."""
+    volume = df['volume'].to_numpy()
+    return len(volume) >= 21 and volume[-2] > volume[-21:-1].mean() * factor
+
+def _gate_squeeze(df: pd.DataFrame, params: dict) -> bool:
+    return _volume_spike(df, 1.5)
+
+def _gate_support_rebound(df: pd.DataFrame, params: dict) -> bool:
+    return df['close'].iat[-2] > df['open'].iat[-2] and _volume_spike(df, 1.5)
+
+def _gate_sniper_pro(df: pd.DataFrame, params: dict) -> bool:
+    if len(df) < 26:
+        return False
+    high, low, volume = df['high'].to_numpy()[-25:-1], df['low'].to_numpy()[-25:-1], df['volume'].to_numpy()[-25:-1]
+    highest, lowest = high.max(), low.min()
+    return (lowest > 0 and (highest - lowest) / lowest * 100 < 12.0 and
+            df['close'].iat[-2] > highest and volume[-1] > volume.mean() * 2)
+
+def _gate_rsi_divergence(df: pd.DataFrame, params: dict) -> bool:
+    return SCIPY_AVAILABLE
+
+def _gate_supertrend_pullback(df: pd.DataFrame, params: dict) -> bool:
+    swing_lookback = params.get('swing_high_lookback', 10)
+    return df['close'].iat[-2] > df['high'].iloc[-swing_lookback:-2].max()
+
+REQUIRED_CONFIRMATIONS = 1 # (عدد الاستراتيجيات المؤكدة الكافي لإشارة: بعده يتوقف التقييم)
+
+class StrategySpec:
+    """(V6) تعريف استراتيجية: الدالة + متطلباتها المعلنة + تكلفتها التقديرية وبوابتها الرخيصة."""
+
+    def __init__(self, name: str, func, indicators=None, timeframes: Tuple[str, ...] = ('15m',), io: Optional[str] = None, min_candles: int = 50,
+                 cost: float = 1.0, gate=None):
+        self.name = name
+        self.func = func
+        self._indicators = indicators or (lambda params: [])
+        self.timeframes = timeframes
+        self.io = io
+        self.min_candles = min_candles
+        self.cost = cost # (وحدات نسبية: حساب مؤشرات < scipy < I/O شبكي)
+        self._gate = gate
+
+    def gate(self, df: pd.DataFrame, params: dict) -> bool:
+        """شرط ضروري رخيص: False = لا إشارة ممكنة (بدون مؤشرات ولا I/O)."""
+        return len(df) >= self.min_candles and (self._gate is None or bool(self._gate(df, params or {})))
+
+    def indicators(self, params: dict) -> List[Tuple[str, dict]]:
+        """يعيد [(اسم المؤشر، معاملاته)] لهذه الاستراتيجية بمعاملات المستخدم."""
+        return self._indicators(params or {})
+
+    def evaluate(self, df: pd.DataFrame, params: dict, io_data: Optional[Dict] = None) -> Optional[Dict]:
+        if self.io:
+            return self.func(df, params, 0, 0, (io_data or {}).get(self.io))
+        return self.func(df, params, 0, 0)
+
+    def evaluate_cached(self, df: pd.DataFrame, params: dict, io_data: Optional[Dict] = None) -> Optional[Dict]:
+        """مثل evaluate لكن عبر STRATEGY_RESULTS (نتيجة واحدة لكل شمعة مهما تكرر المستخدمون)."""
+        return STRATEGY_RESULTS.evaluate(self, df, params, io_data)
+
+# =======================================================================================
+# --- مخبأ نتائج الاستراتيجيات (Strategy Result Cache) ---
+#
+# المستخدمون على نفس الإعداد المسبق يشغلون نفس الاستراتيجية بنفس المعاملات على نفس الشموع.
+# المفتاح: (الاستراتيجية، المعاملات بصيغة قانونية، الرمز، الإطار، توقيت آخر شمعة مغلقة، عدد الشموع)
+# الاستراتيجيات ذات الـ I/O (دفتر أوامر، 1h) لا تُحفظ: مدخلاتها تتغير خارج الشموع.
+# =======================================================================================
+
+class StrategyResultCache:
+    """(V6) مخبأ LRU لنتائج StrategySpec.evaluate المشتركة بين المستخدمين."""
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._store: "OrderedDict[Tuple, Optional[Dict]]" = OrderedDict()
+
+    @staticmethod
+    def _key(spec: "StrategySpec", df: pd.DataFrame, params: dict) -> Optional[Tuple]:
+        symbol, timeframe = df.attrs.get('symbol'), df.attrs.get('timeframe')
+        if spec.io or not symbol or not timeframe or len(df) < 2 or 'timestamp' not in df.columns:
+            return None
+        canonical_params = json.dumps(params or {}, sort_keys=True, default=str)
+        return (spec.name, canonical_params, symbol, timeframe, int(df['timestamp'].iloc[-2]), len(df))
+
+    def evaluate(self, spec: "StrategySpec", df: pd.DataFrame, params: dict, io_data: Optional[Dict] = None) -> Optional[Dict]:
+        key = self._key(spec, df, params)
+        if key is None:
+            return spec.evaluate(df, params, io_data)
+        if key in self._store:
+            self.hits += 1
+            self._store.move_to_end(key)
+            return self._store[key]
+        self.misses += 1
+        result = spec.evaluate(df, params, io_data)
+        self._store[key] = result
+        if len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+        return result
+
+    def clear(self):
+        self._store.clear()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+STRATEGY_RESULTS = StrategyResultCache()
+
+STRATEGY_REGISTRY: Dict[str, StrategySpec] = {spec.name: spec for spec in [
+    StrategySpec("momentum_breakout", analyze_momentum_breakout, cost=4,
+                 indicators=lambda p: [('vwap', {}), ('bbands', {'length': 20}), ('macd', {}), ('rsi', {})]),
+    StrategySpec("breakout_squeeze_pro", analyze_breakout_squeeze_pro, cost=3, gate=_gate_squeeze,
+                 indicators=lambda p: [('bbands', {'length': 20}), ('kc', {'length': 20, 'scalar': 1.5}), ('obv', {})]),
+    StrategySpec("support_rebound", analyze_support_rebound, timeframes=('15m', '1h'), io="ohlcv_1h", cost=20, gate=_gate_support_rebound),
+    StrategySpec("sniper_pro", analyze_sniper_pro, cost=1, gate=_gate_sniper_pro),
+    StrategySpec("whale_radar", analyze_whale_radar, io="order_book", cost=30),
+    StrategySpec("rsi_divergence", analyze_rsi_divergence, cost=6, gate=_gate_rsi_divergence,
+                 indicators=lambda p: [('rsi', {'length': p.get('rsi_period', 14)})]),
+    StrategySpec("supertrend_pullback", analyze_supertrend_pullback, cost=3, gate=_gate_supertrend_pullback,
+                 indicators=lambda p: [('supertrend', {'length': p.get('atr_period', 10), 'multiplier': p.get('atr_multiplier', 3.0)})]),
+    # (يمكن إضافة الاستراتيجيات الأخرى من Strategies.tsx هنا)
+]}
+
+# قاموس الماسحات (من BN.py و Scanners.tsx) - للتوافق مع الكود القديم
+SCANNERS_MAP = {name: spec.func for name, spec in STRATEGY_REGISTRY.items()}
+
+class ScanPlan:
+    """(V6) اتحاد متطلبات الاستراتيجيات المفعلة لمستخدم واحد (يُحسب مرة واحدة لكل فحص)."""
+
+    def __init__(self, entries: List[Tuple[StrategySpec, dict]], required_confirmations: int = REQUIRED_CONFIRMATIONS):
+        self.entries = sorted(entries, key=lambda entry: entry[0].cost) # (الأرخص أولاً)
+        self.required_confirmations = required_confirmations
+        self.indicators: Dict[Tuple, Tuple[str, dict]] = {}
+        self.timeframes = set()
+        self.io = set()
+        for spec, params in entries:
+            for name, ind_params in spec.indicators(params):
+                self.indicators[(name, tuple(sorted(ind_params.items())))] = (name, ind_params)
+            self.timeframes.update(spec.timeframes)
+            if spec.io:
+                self.io.add(spec.io)
+        self.min_candles = min((spec.min_candles for spec, _ in entries), default=0)
+
+    def __bool__(self) -> bool:
+        return bool(self.entries)
+
+    def confirmations(self, df: pd.DataFrame, io_data: Optional[Dict] = None, stage: str = "all", evaluate=None) -> List[str]:
+        """
+        يقيّم الاستراتيجيات من الأرخص للأغلى ويتوقف عند اكتمال التأكيدات المطلوبة.
+        stage: "local" (بدون I/O) | "io" (ذات I/O فقط) | "all".
+        evaluate(spec, params, df, io_data): بديل اختياري للتقييم (مثل أقنعة المحرك المتجه).
+        """
+        if len(df) < self.min_candles:
+            return []
+        evaluate = evaluate or (lambda spec, params, df, io_data: spec.evaluate_cached(df, params, io_data))
+        confirmed_reasons = []
+        for spec, params in self.entries:
+            if (stage == "local" and spec.io) or (stage == "io" and not spec.io):
+                continue
+            try:
+                if not spec.gate(df, params):
+                    continue
+                result = evaluate(spec, params, df, io_data)
+            except Exception as e:
+                # (استراتيجية معطوبة لا تلغي ما تأكد قبلها ولا تمنع الأغلى بعدها)
+                logger.error(f"SCANNER: Strategy {spec.name} failed on {df.attrs.get('symbol')}: {e}")
+                continue
+            if result:
+                confirmed_reasons.append(result['reason'])
+                if len(confirmed_reasons) >= self.required_confirmations:
+                    break
+        return confirmed_reasons
+
+    def io_needed(self, df: pd.DataFrame, confirmed: int = 0) -> set:
+        """أنواع الـ I/O التي ما زالت لازمة لهذا الرمز (بعد البوابات وما تأكد محلياً)."""
+        if confirmed >= self.required_confirmations or len(df) < self.min_candles:
+            return set()
+        needed = set()
+        for spec, params in self.entries:
+            try:
+                if spec.io and spec.gate(df, params):
+                    needed.add(spec.io)
+            except Exception as e:
+                logger.error(f"SCANNER: Gate of {spec.name} failed on {df.attrs.get('symbol')}: {e}")
+        return needed
+
+def plan_scan(strategies: List[Any]) -> ScanPlan:
+    """يبني خطة الفحص من الاستراتيجيات المفعلة (ActiveStrategy أو ما يشبهها)."""
+    entries = []
+    for strategy in strategies:
+        spec = STRATEGY_REGISTRY.get(strategy.strategy_name)
+        if spec:
+            entries.append((spec, strategy.parameters or {}))
+    return ScanPlan(entries)
+
+def warm_indicators(plan: ScanPlan, df: pd.DataFrame):
+    """يحسب كل المؤشرات المطلوبة للرمز مرة واحدة (بدون تكرار بين الاستراتيجيات)."""
+    for name, params in plan.indicators.values():
+        indicator(df, name, **params)
+
+async def prefetch_io(plan: ScanPlan, exchange: ccxt.Exchange, symbols: List[str], needed: Optional[Dict[str, set]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    يجلب الـ I/O الإضافي للرموز المرشحة دفعة واحدة.
+    needed: {الرمز: أنواع الـ I/O} (من plan.io_needed) لجلب ما يلزم فقط؛ بدونها يُجلب كل plan.io.
+    يعيد {الرمز: {نوع الـ I/O: البيانات}} (البيانات None عند الفشل).
+    """
+    io_data: Dict[str, Dict[str, Any]] = {s: {} for s in symbols}
+    if needed is None:
+        jobs = [(io_name, s) for io_name in sorted(plan.io) for s in symbols]
+    else:
+        jobs = [(io_name, s) for s in symbols for io_name in sorted(needed.get(s, ()))]
+    if not jobs:
+        return io_data
+    results = await asyncio.gather(*[IO_FETCHERS[io_name](exchange, s) for io_name, s in jobs], return_exceptions=True)
+    for (io_name, s), result in zip(jobs, results):
+        io_data[s][io_name] = None if isinstance(result, Exception) else result
+    return io_data
+
+def evaluate_plan(plan: ScanPlan, df: pd.DataFrame, io_data: Optional[Dict] = None, stage: str = "all") -> List[str]:
+    """
+    يشغل الاستراتيجيات المخططة على رمز واحد (الأرخص أولاً، مع البوابات والتوقف المبكر)
+    ويعيد أسباب الإشارات المؤكدة. المؤشرات تُحسب عند الحاجة فقط (عبر المخبأ).
+    """
+    return plan.confirmations(df, io_data, stage)
+
 # =======================================================================================
 # --- دوال الرجل الحكيم (من wise_man.py) ---
 #
@@ -220,22 +581,22 @@ async def wise_man_deep_analysis(
     logger.info(f"🧠 Wise Man summoned for deep analysis of trade #{trade_id} [{symbol}]...")
 
     try:
-        ohlcv_task = exchange.fetch_ohlcv(symbol, '15m', limit=100)
-        btc_ohlcv_task = exchange.fetch_ohlcv('BTC/USDT', '1h', limit=100)
+        ohlcv_task = fetch_candles(exchange, symbol, '15m', 100)
+        btc_ohlcv_task = fetch_candles(exchange, 'BTC/USDT', '1h', 100)
         ohlcv, btc_ohlcv = await asyncio.gather(ohlcv_task, btc_ohlcv_task)
 
-        if not ohlcv:
+        if ohlcv is None or not len(ohlcv):
             logger.warning(f"Wise Man Analysis Canceled: Could not fetch OHLCV for {symbol}.")
             return None
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        df = market_data.candles_frame(ohlcv)
         df['ema_fast'] = ta.ema(df['close'], length=10)
         df['ema_slow'] = ta.ema(df['close'], length=30)
         is_weak = df['close'].iloc[-1] < df['ema_fast'].iloc[-1] and df['close'].iloc[-1] < df['ema_slow'].iloc[-1]
 
         btc_is_bearish = False
-        if btc_ohlcv:
-            btc_df = pd.DataFrame(btc_ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        if btc_ohlcv is not None and len(btc_ohlcv):
+            btc_df = market_data.candles_frame(btc_ohlcv)
             btc_df['btc_momentum'] = ta.mom(btc_df['close'], length=10)
             if not btc_df.empty:
                 btc_is_bearish = btc_df['btc_momentum'].iloc[-1] < 0
@@ -243,7 +604,7 @@ async def wise_man_deep_analysis(
         logger.info(f"Analysis for {symbol}: is_weak={is_weak}, btc_is_bearish={btc_is_bearish}")
 
         if is_weak and btc_is_bearish:
-            [cite_start]if settings.get("wise_man_auto_close", True): # [cite: 399]
+            if settings.get("wise_man_auto_close", True):
                 logger.info(f"Wise Man: Recommending FORCE_EXIT for trade #{trade_id}.")
                 return "force_exit" # إشارة للعامل بالإغلاق
             else:
@@ -271,11 +632,27 @@ async def wise_man_check_momentum(
     logger.info(f"🧠 Wise Man checking strong momentum for trade #{trade_id} [{symbol}]...")
 
     try:
-        ohlcv = await exchange.fetch_ohlcv(symbol, '15m', limit=50)
-        if not ohlcv: 
+        live = live_indicators(symbol, '15m')
+        if live is not None:
+            # (V6) مسار O(1): المؤشرات محدثة عند كل إغلاق، نضيف الشمعة المفتوحة فقط
+            state, forming = live
+            _, _, high, low, close, _ = forming
+            current_adx = state.adx.peek(high, low, close)
+            if current_adx > 30:
+                atr = state.atr.peek(high, low, close)
+                if not atr or atr != atr:
+                    return None
+                new_tp = close + (atr * settings.get('risk_reward_ratio', 2.0))
+                if new_tp > trade['take_profit']:
+                    logger.info(f"Wise Man: Recommending TP extension for trade #{trade_id} to {new_tp}.")
+                    return new_tp
+            return None
+
+        ohlcv = await fetch_candles(exchange, symbol, '15m', 50)
+        if ohlcv is None or not len(ohlcv): 
             return None
 
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        df = market_data.candles_frame(ohlcv)
         adx_data = df.ta.adx()
 
         if adx_data is None or adx_data.empty: 
@@ -316,8 +693,8 @@ async def wise_man_check_momentum(
 async def smart_engine_capture_snapshot(exchange: ccxt.Exchange, symbol: str) -> dict:
     """يلتقط صورة لحالة المؤشرات الفنية للسوق في لحظة معينة."""
     try:
-        ohlcv = await exchange.fetch_ohlcv(symbol, '15m', limit=100)
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        ohlcv = await fetch_candles(exchange, symbol, '15m', 100)
+        df = market_data.candles_frame(ohlcv)
         rsi = ta.rsi(df['close'], length=14).iloc[-1]
         adx_data = ta.adx(df['high'], df['low'], df['close'])
         adx = adx_data['ADX_14'].iloc[-1] if adx_data is not None else None
@@ -346,8 +723,8 @@ async def smart_engine_what_if_analysis(
     try:
         await asyncio.sleep(60) #
         
-        future_ohlcv = await exchange.fetch_ohlcv(symbol, '15m', limit=analysis_period_candles)
-        df_future = pd.DataFrame(future_ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        future_ohlcv = await fetch_candles(exchange, symbol, '15m', analysis_period_candles)
+        df_future = market_data.candles_frame(future_ohlcv)
         highest_price_after = df_future['high'].max()
         lowest_price_after = df_future['low'].min()
         
@@ -98,7 +98,7 @@ CREATE TABLE IF NOT EXISTS trades (
     id BIGSERIAL PRIMARY KEY,
     user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
     symbol TEXT NOT NULL,
-    status TEXT NOT NULL, -- 'active', 'closing_tp', 'closing_sl', 'closed'
+    status TEXT NOT NULL, -- 'active', 'closing_tp', 'closing_sl', 'closing_inflight' (V6: البيع جارٍ), 'closed'
     reason TEXT, 
     entry_price REAL,
     exit_price REAL,
@@ -111,8 +111,13 @@ CREATE TABLE IF NOT EXISTS trades (
     pnl_usdt REAL,
     order_id TEXT,
     opened_at TIMESTAMPTZ DEFAULT now(),
-    closed_at TIMESTAMPTZ
+    closed_at TIMESTAMPTZ,
+    claimed_by TEXT, -- [V6] (العامل الذي يغلق الصفقة الآن: FOR UPDATE SKIP LOCKED)
+    claimed_at TIMESTAMPTZ
 );
+-- [V6] (للقواعد الموجودة)
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS claimed_by TEXT;
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
 
 -- 7. جدول الإشعارات (كما هو)
 CREATE TABLE IF NOT EXISTS notifications (
@@ -140,8 +145,27 @@ CREATE TABLE IF NOT EXISTS manual_payments (
     admin_notes TEXT -- (ملاحظات لك)
 );
 
+-- 9. [V6] شظايا الماسح: نبض كل عملية ماسح (لتوزيع المستخدمين بالتجزئة المتسقة)
+CREATE TABLE IF NOT EXISTS scanner_shards (
+    shard_id TEXT PRIMARY KEY, -- (المضيف:العملية أو SCANNER_SHARD_ID)
+    started_at TIMESTAMPTZ DEFAULT now(),
+    heartbeat_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- 10. [V6] لقطة السوق لكل دورة فحص (تنشرها العملية الرئيسية وتقرأها الشظايا بدلاً من إعادة الجلب)
+CREATE TABLE IF NOT EXISTS market_snapshots (
+    timeframe TEXT NOT NULL,
+    candle_close BIGINT NOT NULL, -- (توقيت إغلاق الشمعة بالملي ثانية)
+    universe JSONB NOT NULL, -- (بيانات الرموز المرتبة SymbolMeta)
+    candles BYTEA NOT NULL, -- (مصفوفات OHLCV بصيغة npz)
+    shard_ids TEXT[] NOT NULL, -- (أعضاء حلقة التجزئة لهذه الدورة: نفس التوزيع لكل الشظايا)
+    created_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (timeframe, candle_close)
+);
+
 -- إنشاء فهارس
 CREATE INDEX IF NOT EXISTS idx_trades_user_status ON trades (user_id, status);
+CREATE INDEX IF NOT EXISTS idx_trades_closing ON trades (id) WHERE status LIKE 'closing_%'; -- [V6] (مطالبات الأيدي)
 CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications (user_id, is_read);
 CREATE INDEX IF NOT EXISTS idx_payments_user_status ON manual_payments (user_id, status);
 CREATE INDEX IF NOT EXISTS idx_user_settings_status ON user_settings (subscription_status, subscription_expires_at);
@@ -61,6 +61,14 @@ class UserKeys(BaseModel):
     api_secret: str
     passphrase: Optional[str] = None
 
+class WorkerUserContext(BaseModel):
+    """(V6) كل ما يحتاجه العامل لمستخدم واحد (يُحمّل لدفعة مستخدمين في استعلام واحد)."""
+    user_id: UUID
+    settings: Optional[TradingVariables] = None
+    strategies: List[ActiveStrategy] = []
+    keys: Optional[UserKeys] = None
+    open_trades: Dict[int, str] = {} # {trade_id: symbol}
+
 # --- (إدارة مجمع الاتصالات كما هي) ---
 async def get_db_pool():
     global POOL
@@ -109,12 +117,15 @@ async def get_user_api_keys(user_id: UUID) -> Optional[UserKeys]:
         if not record:
             logger.warning(f"No valid API keys found for user {user_id}.")
             return None
-        def decrypt_key(key): return key.replace("_encrypted", "") # محاكاة
-        return UserKeys(
-            api_key=decrypt_key(record['api_key_encrypted']),
-            api_secret=decrypt_key(record['api_secret_encrypted']),
-            passphrase=decrypt_key(record['passphrase_encrypted']) if record['passphrase_encrypted'] else None
-        )
+        return _decrypt_user_keys(record)
+
+def _decrypt_user_keys(record) -> UserKeys:
+    def decrypt_key(key): return key.replace("_encrypted", "") # محاكاة
+    return UserKeys(
+        api_key=decrypt_key(record['api_key_encrypted']),
+        api_secret=decrypt_key(record['api_secret_encrypted']),
+        passphrase=decrypt_key(record['passphrase_encrypted']) if record['passphrase_encrypted'] else None
+    )
 
 async def get_user_trading_variables(user_id: UUID) -> Optional[TradingVariables]:
     """(للعامل) يجلب إعدادات التداول المتقدمة للمستخدم."""
@@ -133,6 +144,44 @@ async def get_user_enabled_strategies(user_id: UUID) -> List[ActiveStrategy]:
         records = await conn.fetch("SELECT strategy_name, parameters FROM strategies WHERE user_id = $1 AND is_enabled = true", user_id)
         return [ActiveStrategy(strategy_name=r['strategy_name'], parameters=json.loads(r['parameters'] or '{}')) for r in records]
 
+async def get_worker_user_contexts(user_ids: List[UUID]) -> Dict[UUID, WorkerUserContext]:
+    """
+    (V6) (للعامل) الإعدادات + الاستراتيجيات المفعلة + المفاتيح + الصفقات المفتوحة
+    لكل المستخدمين في رحلة واحدة (ANY($1) + تجميع JSON) بدلاً من 4 استعلامات لكل مستخدم.
+    """
+    if not user_ids:
+        return {}
+    async with db_connection() as conn:
+        records = await conn.fetch(
+            """
+            SELECT u.user_id,
+                (SELECT row_to_json(av) FROM advanced_variables av WHERE av.user_id = u.user_id) AS settings,
+                (SELECT COALESCE(json_agg(json_build_object('strategy_name', s.strategy_name, 'parameters', s.parameters)), '[]')
+                   FROM strategies s WHERE s.user_id = u.user_id AND s.is_enabled = true) AS strategies,
+                (SELECT row_to_json(k) FROM (
+                    SELECT api_key_encrypted, api_secret_encrypted, passphrase_encrypted
+                    FROM user_api_keys WHERE user_id = u.user_id AND is_valid = true LIMIT 1) k) AS keys,
+                (SELECT COALESCE(json_object_agg(t.id, t.symbol), '{}')
+                   FROM trades t WHERE t.user_id = u.user_id AND t.status = 'active') AS open_trades
+            FROM unnest($1::uuid[]) AS u(user_id)
+            """,
+            list(user_ids)
+        )
+    contexts = {}
+    for r in records:
+        settings = json.loads(r['settings']) if r['settings'] else None
+        if settings:
+            settings.pop('id', None); settings.pop('updated_at', None)
+        keys = json.loads(r['keys']) if r['keys'] else None
+        contexts[r['user_id']] = WorkerUserContext(
+            user_id=r['user_id'],
+            settings=TradingVariables(**settings) if settings else None,
+            strategies=[ActiveStrategy(strategy_name=s['strategy_name'], parameters=s['parameters'] or {}) for s in json.loads(r['strategies'])],
+            keys=_decrypt_user_keys(keys) if keys else None,
+            open_trades={int(trade_id): symbol for trade_id, symbol in json.loads(r['open_trades']).items()}
+        )
+    return contexts
+
 async def create_trade(user_id: UUID, symbol: str, reason: str, entry_price: float, qty: float, tp: float, sl: float, order_id: str) -> Optional[Dict]:
     """(للعامل) يسجل صفقة جديدة في قاعدة البيانات (V4 - مع حقول TSL)."""
     try:
@@ -182,15 +231,115 @@ async def create_notification(user_id: UUID, title: str, message: str, type: str
     except Exception as e:
         logger.error(f"Failed to create notification for user {user_id}: {e}")
 
+# =================================================================
+# --- [V6] دوال شظايا الماسح (Scanner Shards) ---
+# =================================================================
+
+async def heartbeat_scanner_shard(shard_id: str):
+    """(للعامل) يسجل/يجدد نبض شظية الماسح."""
+    async with db_connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO scanner_shards (shard_id) VALUES ($1)
+            ON CONFLICT (shard_id) DO UPDATE SET heartbeat_at = now()
+            """,
+            shard_id
+        )
+
+async def get_live_scanner_shards(max_age_seconds: float) -> List[str]:
+    """(للعامل) الشظايا التي نبضت خلال max_age_seconds."""
+    async with db_connection() as conn:
+        records = await conn.fetch(
+            "SELECT shard_id FROM scanner_shards WHERE heartbeat_at > now() - make_interval(secs => $1) ORDER BY shard_id",
+            float(max_age_seconds)
+        )
+        return [r['shard_id'] for r in records]
+
+async def remove_scanner_shard(shard_id: str):
+    async with db_connection() as conn:
+        await conn.execute("DELETE FROM scanner_shards WHERE shard_id = $1", shard_id)
+
+async def save_market_snapshot(timeframe: str, candle_close: int, universe: List[Dict], candles: bytes, shard_ids: List[str], keep_seconds: float = 3600):
+    """(للعامل) ينشر لقطة الدورة لكل الشظايا، ويحذف اللقطات الأقدم من keep_seconds."""
+    async with db_connection() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO market_snapshots (timeframe, candle_close, universe, candles, shard_ids)
+                VALUES ($1, $2, $3::jsonb, $4, $5)
+                ON CONFLICT (timeframe, candle_close) DO UPDATE
+                SET universe = EXCLUDED.universe, candles = EXCLUDED.candles, shard_ids = EXCLUDED.shard_ids, created_at = now()
+                """,
+                timeframe, candle_close, json.dumps(universe), candles, shard_ids
+            )
+            await conn.execute("DELETE FROM market_snapshots WHERE created_at < now() - make_interval(secs => $1)", float(keep_seconds))
+
+async def get_market_snapshot(timeframe: str, candle_close: int) -> Optional[Dict]:
+    """(للعامل) لقطة الدورة المنشورة: {'universe', 'candles', 'shard_ids'} أو None إن لم تُنشر بعد."""
+    async with db_connection() as conn:
+        record = await conn.fetchrow(
+            "SELECT universe, candles, shard_ids FROM market_snapshots WHERE timeframe = $1 AND candle_close = $2",
+            timeframe, candle_close
+        )
+        if not record:
+            return None
+        return {"universe": json.loads(record['universe']), "candles": bytes(record['candles']), "shard_ids": list(record['shard_ids'])}
+
+async def open_dedicated_connection() -> asyncpg.Connection:
+    """(V6) اتصال خارج المجمع لأقفال الجلسة (advisory locks) التي تبقى طوال عمر العملية."""
+    return await asyncpg.connect(DATABASE_URL)
+
+async def try_advisory_lock(conn: asyncpg.Connection, key: int) -> bool:
+    """(V6) قفل جلسة غير حاجز: True = هذا الاتصال يملك القفل حتى يُغلق."""
+    return await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+
 # =================================================================
 # --- [تم الإصلاح] - دوال إدارة الصفقات المفقودة (V2.1) ---
 # --- (هذه هي دوال "كل فسفوسة") ---
 # =================================================================
 
 async def set_trade_status(trade_id: int, status: str):
-    """يغير حالة الصفقة (مثل 'closing_tp' أو 'active')."""
+    """يغير حالة الصفقة (مثل 'closing_tp' أو 'active') ويحرر أي مطالبة عليها (V6)."""
+    async with db_connection() as conn:
+        await conn.execute("UPDATE trades SET status = $1, claimed_by = NULL, claimed_at = NULL WHERE id = $2", status, trade_id)
+
+async def claim_trades_for_closure(worker_id: str, limit: int = 20, claim_timeout_seconds: float = 120) -> List[Dict]:
+    """
+    (V6) (للأيدي) يطالب بصفقات 'closing_%' غير المطالب بها (أو التي انتهت مطالبتها) لهذا العامل.
+    FOR UPDATE SKIP LOCKED: النسخ المتوازية تأخذ صفقات مختلفة ولا تنتظر بعضها، فلا بيع مزدوج.
+    """
+    async with db_connection() as conn:
+        records = await conn.fetch(
+            """
+            UPDATE trades SET claimed_by = $1, claimed_at = now()
+            WHERE id IN (
+                SELECT id FROM trades
+                WHERE status LIKE 'closing_%' AND status <> 'closing_inflight'
+                  AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => $3))
+                ORDER BY id
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            worker_id, limit, float(claim_timeout_seconds)
+        )
+        return [dict(r) for r in records]
+
+async def start_trade_closure(trade_id: int, worker_id: str) -> bool:
+    """
+    (V6) (للأيدي) يسلّم الصفقة للبيع ذرياً قبل أمر البيع: True فقط إن كانت المطالبة ما زالت لهذا العامل.
+    'closing_inflight' لا يُطالب بها مجدداً حتى لو انتهت المهلة (لا بيع مزدوج؛ سقوط العامل هنا يتطلب مراجعة يدوية).
+    """
     async with db_connection() as conn:
-        await conn.execute("UPDATE trades SET status = $1 WHERE id = $2", status, trade_id)
+        return await conn.fetchval(
+            """
+            UPDATE trades SET status = 'closing_inflight', claimed_at = now()
+            WHERE id = $1 AND claimed_by = $2 AND status LIKE 'closing_%' AND status <> 'closing_inflight'
+            RETURNING id
+            """,
+            trade_id, worker_id
+        ) is not None
 
 async def update_trade_highest_price(trade_id: int, new_highest_price: float):
     """(لـ "العيون") يحدّث أعلى سعر وصلت له الصفقة."""
@@ -217,6 +366,35 @@ async def update_trade_take_profit(trade_id: int, new_take_profit: float):
     async with db_connection() as conn:
         await conn.execute("UPDATE trades SET take_profit = $1 WHERE id = $2 AND take_profit < $1", new_take_profit, trade_id)
 
+async def flush_trade_updates(updates: Dict[int, Dict[str, Any]]) -> int:
+    """
+    (V6) (لـ "العيون" عبر الكتابة المؤجلة) يكتب أعلى سعر/الوقف/تفعيله/آخر إشعار لعدة صفقات في UPDATE واحد.
+    الحقول الغائبة (NULL) لا تغير شيئاً، والسعر الأعلى والوقف لا ينزلان أبداً (نفس شروط الدوال أعلاه).
+    """
+    if not updates:
+        return 0
+    trade_ids = list(updates)
+    rows = [updates[trade_id] for trade_id in trade_ids]
+    async with db_connection() as conn:
+        result = await conn.execute(
+            """
+            UPDATE trades AS t SET
+                highest_price = GREATEST(t.highest_price, u.highest_price),
+                stop_loss = GREATEST(t.stop_loss, u.stop_loss),
+                trailing_sl_active = COALESCE(t.trailing_sl_active, false) OR COALESCE(u.trailing_sl_active, false),
+                last_profit_notification_price = COALESCE(u.last_profit_notification_price, t.last_profit_notification_price)
+            FROM unnest($1::bigint[], $2::real[], $3::real[], $4::boolean[], $5::real[])
+                AS u(id, highest_price, stop_loss, trailing_sl_active, last_profit_notification_price)
+            WHERE t.id = u.id AND t.status <> 'closed'
+            """,
+            trade_ids,
+            [row.get('highest_price') for row in rows],
+            [row.get('stop_loss') for row in rows],
+            [row.get('trailing_sl_active') for row in rows],
+            [row.get('last_profit_notification_price') for row in rows],
+        )
+    return int(result.split()[-1])
+
 
 # =================================================================
 # --- دوال للخادم (API Server) ---
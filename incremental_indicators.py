@@ -0,0 +1,264 @@
+import copy
+from typing import Iterable, Optional, Sequence
+
+# =======================================================================================
+# --- مؤشرات تزايدية O(1) (Incremental Indicators) ---
+#
+# كل حالة تتقدم بشمعة مغلقة واحدة (update) بدلاً من إعادة حساب نافذة الـ 100 شمعة.
+# الصيغ: بذرة SMA للـ EMA، و RMA = ewm(alpha=1/length, adjust=True, min_periods=length) للـ RSI/ATR/ADX
+# (تعريف pandas_ta 0.3.x). نسخ pandas_ta الأحدث تبذر RMA بشكل مختلف فتختلف القيم قليلاً
+# في أول الشموع (يتلاشى الفرق مع طول التاريخ)؛ الاختبار يقارن بصيغ مرجعية صريحة لا بالنسخة المثبتة.
+# peek() يعطي القيمة مع الشمعة المفتوحة الحالية بدون تثبيتها.
+# =======================================================================================
+
+NAN = float('nan')
+
+def _isnan(x: Optional[float]) -> bool:
+    return x is None or x != x
+
+
+class _State:
+    __slots__ = ()
+
+    def peek(self, *args) -> Optional[float]:
+        """القيمة لو أُضيفت هذه الشمعة (المفتوحة) دون تغيير الحالة."""
+        return copy.deepcopy(self).update(*args)
+
+
+class EWMState(_State):
+    """نفس خوارزمية pandas ewm().mean() مع ignore_na=False."""
+
+    __slots__ = ('alpha', 'adjust', 'min_periods', 'value', '_old_wt', 'nobs', '_weighted')
+
+    def __init__(self, alpha: float, adjust: bool = True, min_periods: int = 0):
+        self.alpha, self.adjust, self.min_periods = alpha, adjust, max(min_periods, 1)
+        self._weighted = NAN
+        self._old_wt = 1.0
+        self.nobs = 0
+        self.value = NAN
+
+    def update(self, x: float) -> float:
+        is_obs = not _isnan(x)
+        self.nobs += is_obs
+        if not _isnan(self._weighted):
+            self._old_wt *= 1.0 - self.alpha
+            if is_obs:
+                new_wt = 1.0 if self.adjust else self.alpha
+                self._weighted = (self._old_wt * self._weighted + new_wt * x) / (self._old_wt + new_wt)
+                self._old_wt = self._old_wt + new_wt if self.adjust else 1.0
+        elif is_obs:
+            self._weighted = x
+        self.value = self._weighted if self.nobs >= self.min_periods else NAN
+        return self.value
+
+
+class RMAState(EWMState):
+    """pandas_ta.rma: ewm(alpha=1/length, min_periods=length)."""
+
+    __slots__ = ()
+
+    def __init__(self, length: int):
+        super().__init__(1.0 / length, adjust=True, min_periods=length)
+
+
+class EMAState(_State):
+    """pandas_ta.ema (sma=True): أول قيمة = متوسط أول length قيمة، ثم EWM غير معدّل."""
+
+    __slots__ = ('length', '_seed', '_ewm', 'value')
+
+    def __init__(self, length: int):
+        self.length = length
+        self._seed = []
+        self._ewm = EWMState(2.0 / (length + 1), adjust=False)
+        self.value = NAN
+
+    def update(self, x: float) -> float:
+        if self._seed is not None:
+            self._seed.append(x)
+            if len(self._seed) < self.length:
+                return self.value
+            valid = [v for v in self._seed if not _isnan(v)]
+            x = sum(valid) / len(valid) if valid else NAN
+            self._seed = None
+        self.value = self._ewm.update(x)
+        return self.value
+
+
+class TrueRangeState(_State):
+    __slots__ = ('_prev_close', 'value')
+
+    def __init__(self):
+        self._prev_close = None
+        self.value = NAN
+
+    def update(self, high: float, low: float, close: float) -> float:
+        if self._prev_close is None:
+            self.value = NAN
+        else:
+            pc = self._prev_close
+            self.value = max(abs(high - low), abs(high - pc), abs(pc - low))
+        self._prev_close = close
+        return self.value
+
+
+class ATRState(_State):
+    """ATRr_<length> (RMA للمدى الحقيقي)."""
+
+    __slots__ = ('_tr', '_rma', 'value')
+
+    def __init__(self, length: int = 14):
+        self._tr = TrueRangeState()
+        self._rma = RMAState(length)
+        self.value = NAN
+
+    def update(self, high: float, low: float, close: float) -> float:
+        self.value = self._rma.update(self._tr.update(high, low, close))
+        return self.value
+
+
+class RSIState(_State):
+    __slots__ = ('_prev_close', '_pos', '_neg', 'value')
+
+    def __init__(self, length: int = 14):
+        self._prev_close = None
+        self._pos, self._neg = RMAState(length), RMAState(length)
+        self.value = NAN
+
+    def update(self, close: float) -> float:
+        change = NAN if self._prev_close is None else close - self._prev_close
+        self._prev_close = close
+        pos = self._pos.update(NAN if _isnan(change) else max(change, 0.0))
+        neg = self._neg.update(NAN if _isnan(change) else min(change, 0.0))
+        denominator = pos + abs(neg)
+        self.value = 100.0 * pos / denominator if denominator else NAN
+        return self.value
+
+
+class OBVState(_State):
+    __slots__ = ('_prev_close', 'value')
+
+    def __init__(self):
+        self._prev_close = None
+        self.value = 0.0
+
+    def update(self, close: float, volume: float) -> float:
+        close, volume = float(close), float(volume)
+        if self._prev_close is None:
+            sign = 1.0
+        else:
+            sign = float((close > self._prev_close) - (close < self._prev_close))
+        self._prev_close = close
+        self.value += sign * volume
+        return self.value
+
+
+class MACDState(_State):
+    """يعيد (macd, histogram, signal) مثل pandas_ta.macd."""
+
+    __slots__ = ('_fast', '_slow', '_signal', 'value')
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self._fast, self._slow, self._signal = EMAState(fast), EMAState(slow), EMAState(signal)
+        self.value = (NAN, NAN, NAN)
+
+    def update(self, close: float):
+        macd = self._fast.update(close) - self._slow.update(close)
+        signal = self._signal.update(macd) if not _isnan(macd) else NAN
+        self.value = (macd, macd - signal, signal)
+        return self.value
+
+
+class ADXState(_State):
+    """ADX_<length> مثل pandas_ta.adx (RMA للـ DM والـ DX)."""
+
+    __slots__ = ('_atr', '_prev_high', '_prev_low', '_pos', '_neg', '_adx', 'value')
+
+    def __init__(self, length: int = 14):
+        self._atr = ATRState(length)
+        self._prev_high = self._prev_low = None
+        self._pos, self._neg, self._adx = RMAState(length), RMAState(length), RMAState(length)
+        self.value = NAN
+
+    def update(self, high: float, low: float, close: float) -> float:
+        atr = self._atr.update(high, low, close)
+        if self._prev_high is None:
+            pos = neg = NAN
+        else:
+            up, dn = high - self._prev_high, self._prev_low - low
+            pos = up if (up > dn and up > 0) else 0.0
+            neg = dn if (dn > up and dn > 0) else 0.0
+        self._prev_high, self._prev_low = high, low
+        k = 100.0 / atr if atr else NAN
+        dmp, dmn = k * self._pos.update(pos), k * self._neg.update(neg)
+        dx = 100.0 * abs(dmp - dmn) / (dmp + dmn) if (dmp + dmn) else NAN
+        self.value = self._adx.update(dx)
+        return self.value
+
+
+class SupertrendState(_State):
+    """يعيد (trend, direction) بنفس منطق pandas_ta.supertrend."""
+
+    __slots__ = ('_atr', 'multiplier', '_upper', '_lower', 'direction', 'value')
+
+    def __init__(self, length: int = 7, multiplier: float = 3.0):
+        self._atr = ATRState(length)
+        self.multiplier = multiplier
+        self._upper = self._lower = None
+        self.direction = 1
+        self.value = (NAN, 1)
+
+    def update(self, high: float, low: float, close: float):
+        matr = self.multiplier * self._atr.update(high, low, close)
+        hl2 = 0.5 * (high + low)
+        upper, lower = hl2 + matr, hl2 - matr
+        if self._upper is None:
+            self._upper, self._lower = upper, lower
+            self.value = (NAN, self.direction)
+            return self.value
+        if close > self._upper:
+            self.direction = 1
+        elif close < self._lower:
+            self.direction = -1
+        else:
+            if self.direction > 0 and lower < self._lower:
+                lower = self._lower
+            if self.direction < 0 and upper > self._upper:
+                upper = self._upper
+        self._upper, self._lower = upper, lower
+        self.value = (lower if self.direction > 0 else upper, self.direction)
+        return self.value
+
+
+class CandleIndicators(_State):
+    """(V6) حزمة المؤشرات التزايدية لرمز/إطار واحد، تتقدم عند إغلاق كل شمعة."""
+
+    __slots__ = ('last_timestamp', 'ema_fast', 'ema_slow', 'rsi', 'atr', 'adx', 'obv', 'macd', 'supertrend')
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.ema_fast, self.ema_slow = EMAState(10), EMAState(30)
+        self.rsi = RSIState(14)
+        self.atr = ATRState(14)
+        self.adx = ADXState(14)
+        self.obv = OBVState()
+        self.macd = MACDState()
+        self.supertrend = SupertrendState(10, 3.0)
+
+    def update(self, candle: Sequence[float]) -> "CandleIndicators":
+        ts, _, high, low, close, volume = candle[:6]
+        self.last_timestamp = int(ts)
+        self.ema_fast.update(close); self.ema_slow.update(close)
+        self.rsi.update(close)
+        self.atr.update(high, low, close)
+        self.adx.update(high, low, close)
+        self.obv.update(close, volume)
+        self.macd.update(close)
+        self.supertrend.update(high, low, close)
+        return self
+
+    @classmethod
+    def from_candles(cls, candles: Iterable[Sequence[float]]) -> "CandleIndicators":
+        state = cls()
+        for candle in candles:
+            state.update(candle)
+        return state
@@ -0,0 +1,784 @@
+import asyncio
+import io
+import json
+import logging
+import re
+import time
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Tuple, Sequence
+
+import ccxt.async_support as ccxt
+import numpy as np
+import pandas as pd
+import websockets
+from pydantic import BaseModel, ConfigDict
+
+from incremental_indicators import CandleIndicators
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.warning("Library 'orjson' not found. Stream messages will be decoded with the standard json module.")
+
+loads = orjson.loads if ORJSON_AVAILABLE else json.loads # (V6) فك رسائل البث (bytes أو str)
+
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+TIMEFRAME_MS = {'1m': 60_000, '5m': 300_000, '15m': 900_000, '1h': 3_600_000, '4h': 14_400_000, '1d': 86_400_000}
+KLINE_STREAM_URI = "wss://stream.binance.com:9443/stream"
+
+UNIVERSE_SIZE = 100
+UNIVERSE_MIN_QUOTE_VOLUME = 1_000_000
+
+def next_candle_close(timeframe: str, now: Optional[float] = None) -> float:
+    """(V6) توقيت (ثوانٍ epoch) إغلاق الشمعة الحالية للإطار الزمني (حدود UTC مثل Binance)."""
+    step = TIMEFRAME_MS[timeframe] / 1000
+    now = time.time() if now is None else now
+    return (now // step + 1) * step
+
+def is_fresh(ohlcv, timeframe: str, candle_close: int) -> bool:
+    """(V6) آخر شمعة مغلقة (التي تقرأها الاستراتيجيات: iloc[-2]) هي التي أُغلقت عند candle_close (ms)."""
+    return ohlcv is not None and len(ohlcv) >= 2 and int(ohlcv[-2][0]) == candle_close - TIMEFRAME_MS[timeframe]
+
+# =======================================================================================
+# --- ذاكرة الشموع الحلقية (Candle Ring Buffer) ---
+#
+# مصفوفة float64 محجوزة مسبقاً لكل (رمز، إطار زمني) بسعة ثابتة. كل شمعة تُكتب
+# مرتين (i و i+capacity) حتى تكون آخر N شمعة دائماً شريحة متصلة: view() بدون نسخ.
+# =======================================================================================
+
+class CandleRingBuffer:
+    """(V6) ذاكرة حلقية لشموع OHLCV (timestamp, open, high, low, close, volume)."""
+
+    __slots__ = ('capacity', '_data', '_start', '_size')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.full((2 * capacity, len(OHLCV_COLUMNS)), np.nan, dtype=np.float64)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _write(self, idx: int, candle):
+        self._data[idx] = candle
+        self._data[idx + self.capacity] = candle
+
+    def append(self, candle: Sequence[float]):
+        if self._size < self.capacity:
+            idx = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            idx = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._write(idx, candle)
+
+    def extend(self, candles: Iterable[Sequence[float]]):
+        for candle in candles:
+            self.append(candle)
+
+    def update_last(self, candle: Sequence[float]):
+        """يستبدل الشمعة الأخيرة (الشمعة المفتوحة التي تتحدث)."""
+        if not self._size:
+            self.append(candle); return
+        self._write((self._start + self._size - 1) % self.capacity, candle)
+
+    def clear(self):
+        self._start = self._size = 0
+
+    @property
+    def last_timestamp(self) -> Optional[int]:
+        return int(self._data[(self._start + self._size - 1) % self.capacity, 0]) if self._size else None
+
+    def view(self, n: Optional[int] = None) -> np.ndarray:
+        """آخر n شمعة كـ view بدون نسخ (للقراءة فقط، تتغير مع وصول شموع جديدة)."""
+        n = self._size if n is None else min(n, self._size)
+        end = self._start + self._size
+        view = self._data[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def column(self, name: str, n: Optional[int] = None) -> np.ndarray:
+        return self.view(n)[:, OHLCV_COLUMNS.index(name)]
+
+    def frame(self, n: Optional[int] = None) -> pd.DataFrame:
+        """DataFrame رخيص فوق نفس الذاكرة (بدون نسخ)."""
+        return candles_frame(self.view(n))
+
+
+def candles_frame(ohlcv) -> pd.DataFrame:
+    """
+    (V6) DataFrame موحد من مصفوفة NumPy (بدون نسخ) أو من قائمة ccxt.
+    الفهرس DatetimeIndex (UTC) من عمود timestamp: مؤشرات pandas_ta الزمنية (مثل VWAP) تتطلبه.
+    """
+    if isinstance(ohlcv, np.ndarray):
+        df = pd.DataFrame(ohlcv, columns=OHLCV_COLUMNS, copy=False)
+    else:
+        df = pd.DataFrame(ohlcv, columns=OHLCV_COLUMNS)
+    df.index = pd.to_datetime(df['timestamp'].to_numpy(), unit='ms', utc=True)
+    return df
+
+
+# =======================================================================================
+# --- عالم الفحص (Market Universe) ---
+#
+# يُحسب مرة واحدة في كل دورة: ترتيب الأسواق + بيانات كل رمز (الحد الأدنى، الدقة).
+# مهام المستخدمين تطبق فقط فلاترها الخاصة فوقه.
+# =======================================================================================
+
+class SymbolMeta(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    symbol: str
+    exchange_id: Optional[str] = None
+    quote_volume: float = 0.0
+    min_notional: Optional[float] = None
+    min_amount: Optional[float] = None
+    amount_precision: Optional[float] = None
+    price_precision: Optional[float] = None
+
+
+def _market_min_notional(market: Dict) -> Optional[float]:
+    limits = market.get('limits') or {}
+    value = (limits.get('notional') or {}).get('min') or (limits.get('cost') or {}).get('min')
+    return float(value) if value else None
+
+
+def build_symbol_meta(symbol: str, market: Optional[Dict], quote_volume: float = 0.0) -> SymbolMeta:
+    """يبني بيانات الرمز من قاموس السوق في ccxt (exchange.markets[symbol])."""
+    market = market or {}
+    precision = market.get('precision') or {}
+    return SymbolMeta(
+        symbol=symbol,
+        exchange_id=market.get('id'),
+        quote_volume=quote_volume or 0.0,
+        min_notional=_market_min_notional(market),
+        min_amount=((market.get('limits') or {}).get('amount') or {}).get('min'),
+        amount_precision=precision.get('amount'),
+        price_precision=precision.get('price'),
+    )
+
+
+class MarketUniverse:
+    """(V6) قائمة الرموز المرتبة لدورة الفحص مع بياناتها المحسوبة مسبقاً."""
+
+    def __init__(self, ranked: List[SymbolMeta]):
+        self._meta = MappingProxyType({m.symbol: m for m in ranked})
+
+    @property
+    def symbols(self) -> Tuple[str, ...]:
+        return tuple(self._meta.keys())
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._meta
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def meta(self, symbol: str) -> Optional[SymbolMeta]:
+        return self._meta.get(symbol)
+
+    def symbols_for_user(self, trade_size: float, excluded: Optional[set] = None) -> List[str]:
+        """
+        فلاتر المستخدم فوق العالم المشترك: يستبعد رموز الصفقات المفتوحة
+        والأسواق التي حدها الأدنى أكبر من حجم صفقة المستخدم.
+        """
+        excluded = excluded or set()
+        return [
+            s for s, m in self._meta.items()
+            if s not in excluded and not (m.min_notional and trade_size < m.min_notional)
+        ]
+
+    def records(self) -> List[Dict]:
+        """(V6) بصيغة JSON (للنشر إلى شظايا الماسح) بنفس الترتيب."""
+        return [m.model_dump() for m in self._meta.values()]
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "MarketUniverse":
+        return cls([SymbolMeta(**r) for r in records])
+
+
+def build_market_universe(all_tickers: Dict, markets: Optional[Dict] = None, size: int = UNIVERSE_SIZE, min_quote_volume: float = UNIVERSE_MIN_QUOTE_VOLUME) -> MarketUniverse:
+    """(V6) يختار أعلى أسواق USDT من حيث حجم التداول (مرة واحدة لكل دورة)."""
+    markets = markets or {}
+    valid_markets = [
+        t for t in all_tickers.values()
+        if 'USDT' in t['symbol']
+        and (t.get('quoteVolume') or 0) > min_quote_volume
+        and t.get('active', True)
+    ]
+    valid_markets.sort(key=lambda m: m.get('quoteVolume') or 0, reverse=True)
+    return MarketUniverse([
+        build_symbol_meta(t['symbol'], markets.get(t['symbol']), t.get('quoteVolume') or 0)
+        for t in valid_markets[:size]
+    ])
+
+# =======================================================================================
+# --- لقطة السوق (Market Snapshot) ---
+#
+# تُبنى مرة واحدة في كل دورة فحص وتُمرر لجميع مهام scan_for_user،
+# حتى يبقى عدد طلبات REST ثابتاً مهما زاد عدد المستخدمين.
+# =======================================================================================
+
+class MarketSnapshot:
+    """(V6) لقطة OHLCV ثابتة (للقراءة فقط) لدورة فحص واحدة، مفهرسة بالرمز وتوقيت آخر شمعة."""
+
+    def __init__(self, timeframe: str, candles: Dict[str, Sequence[Sequence[float]]]):
+        self._timeframe = timeframe
+        self._created_at = time.time()
+        frozen = {}
+        for symbol, ohlcv in candles.items():
+            if ohlcv is None or not len(ohlcv):
+                continue
+            array = np.array(ohlcv, dtype=np.float64) # (نسخة واحدة لكل دورة، ثم للقراءة فقط)
+            array.flags.writeable = False
+            frozen[symbol] = array
+        self._candles = MappingProxyType(frozen)
+        self._frames: Dict[str, pd.DataFrame] = {}
+
+    @property
+    def timeframe(self) -> str:
+        return self._timeframe
+
+    @property
+    def created_at(self) -> float:
+        return self._created_at
+
+    @property
+    def symbols(self) -> Tuple[str, ...]:
+        return tuple(self._candles.keys())
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._candles
+
+    def __len__(self) -> int:
+        return len(self._candles)
+
+    def ohlcv(self, symbol: str) -> np.ndarray:
+        """مصفوفة (N, 6) للقراءة فقط."""
+        return self._candles.get(symbol, np.empty((0, len(OHLCV_COLUMNS))))
+
+    def last_timestamp(self, symbol: str) -> Optional[int]:
+        candles = self._candles.get(symbol)
+        return int(candles[-1, 0]) if candles is not None else None
+
+    def key(self, symbol: str) -> Tuple[str, str, Optional[int]]:
+        """مفتاح اللقطة لهذا الرمز: (الرمز، الإطار الزمني، توقيت آخر شمعة)."""
+        return symbol, self._timeframe, self.last_timestamp(symbol)
+
+    def frame(self, symbol: str) -> pd.DataFrame:
+        """
+        يعيد DataFrame مبنياً مرة واحدة لكل رمز في هذه الدورة.
+        (مشترك بين المستخدمين: لا تعدّل عليه مباشرة، استخدم .copy() عند الحاجة)
+        """
+        if symbol not in self._frames:
+            df = candles_frame(self.ohlcv(symbol))
+            df.attrs['symbol'], df.attrs['timeframe'] = symbol, self._timeframe # (مفتاح مخبأ المؤشرات)
+            self._frames[symbol] = df
+        return self._frames[symbol]
+
+    def to_bytes(self) -> bytes:
+        """(V6) كل الشموع في مصفوفة واحدة (npz) لنشرها إلى شظايا الماسح."""
+        symbols = self.symbols
+        buffer = io.BytesIO()
+        np.savez(
+            buffer, timeframe=np.array(self._timeframe), symbols=np.array(symbols, dtype=str),
+            lengths=np.array([len(self._candles[s]) for s in symbols], dtype=np.int64),
+            candles=np.concatenate([self._candles[s] for s in symbols]) if symbols else np.empty((0, len(OHLCV_COLUMNS))),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MarketSnapshot":
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            offsets = np.concatenate(([0], np.cumsum(npz['lengths'])))
+            candles = npz['candles']
+            return cls(str(npz['timeframe']), {
+                str(s): candles[offsets[i]:offsets[i + 1]] for i, s in enumerate(npz['symbols'])
+            })
+
+
+async def build_market_snapshot(exchange: ccxt.Exchange, symbols: List[str], timeframe: str = '15m', limit: int = 100, candle_close: Optional[int] = None) -> MarketSnapshot:
+    """
+    (V6) يجلب OHLCV لكل الرموز مرة واحدة (طلب واحد لكل رمز) ويعيد لقطة ثابتة.
+    مع candle_close (ms): الرموز التي لم تُرجع شمعة الإغلاق بعد تُستبعد من اللقطة.
+    """
+    tasks = [exchange.fetch_ohlcv(s, timeframe, limit=limit) for s in symbols]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    candles = {}
+    failed = stale = 0
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, Exception) or not result:
+            failed += 1
+            continue
+        if candle_close is not None and not is_fresh(result, timeframe, candle_close):
+            stale += 1
+            continue
+        candles[symbol] = result
+    if failed:
+        logger.warning(f"SNAPSHOT: Failed to fetch {timeframe} OHLCV for {failed}/{len(symbols)} symbols.")
+    if stale:
+        logger.warning(f"SNAPSHOT: Dropped {stale}/{len(symbols)} symbols whose {timeframe} candle close has not arrived yet.")
+    snapshot = MarketSnapshot(timeframe, candles)
+    logger.info(f"SNAPSHOT: Built {timeframe} snapshot for {len(snapshot)} symbols.")
+    return snapshot
+
+# =======================================================================================
+# --- مخبأ الشموع متعدد الأطر (Candle Cache) ---
+#
+# سلسلة (الرمز، الإطار) تبقى صالحة ما دامت الشمعة المفتوحة نفسها لم تُغلق وعمرها <= ttl.
+# الطلبات المتزامنة لنفس السلسلة تنتظر جلباً واحداً (request coalescing).
+# =======================================================================================
+
+class CandleCache:
+    """(V6) مخبأ TTL واعٍ بحدود الشموع لسلاسل OHLCV العامة (عبر اتصال عام واحد)."""
+
+    def __init__(self, exchange: ccxt.Exchange, ttl: float = 30.0, max_entries: int = 2000, store=None):
+        self.exchange = exchange
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store # (V6) candle_store.CandleStore اختياري: التاريخ من القرص والفجوة فقط من REST
+        self._entries: Dict[Tuple[str, str], Tuple[float, List]] = {} # {(الرمز، الإطار): (وقت الجلب، الشموع)}
+        self._inflight: Dict[Tuple[str, str], Tuple[int, asyncio.Task]] = {}
+        self.hits = 0
+        self.fetches = 0
+
+    def _is_fresh(self, timeframe: str, fetched_at: float, now: float) -> bool:
+        step = TIMEFRAME_MS[timeframe] / 1000
+        return now - fetched_at <= self.ttl and now // step == fetched_at // step
+
+    async def _fetch(self, symbol: str, timeframe: str, limit: int) -> List:
+        key = (symbol, timeframe)
+        try:
+            self.fetches += 1
+            if self.store is not None:
+                ohlcv = await self.store.tail(self.exchange, symbol, timeframe, limit)
+            else:
+                ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+            if ohlcv:
+                self._entries.pop(key, None)
+                self._entries[key] = (time.time(), ohlcv)
+                while len(self._entries) > self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            return ohlcv
+        finally:
+            if key in self._inflight and self._inflight[key][1] is asyncio.current_task():
+                del self._inflight[key]
+
+    async def get(self, symbol: str, timeframe: str, limit: int = 100) -> List:
+        """آخر limit شمعة: من المخبأ إن كانت صالحة، وإلا جلب واحد مشترك بين كل المنتظرين."""
+        key = (symbol, timeframe)
+        entry = self._entries.get(key)
+        if entry and len(entry[1]) >= limit and self._is_fresh(timeframe, entry[0], time.time()):
+            self.hits += 1
+            return entry[1][-limit:]
+        inflight = self._inflight.get(key)
+        if inflight is None or inflight[0] < limit:
+            inflight = (limit, asyncio.create_task(self._fetch(symbol, timeframe, limit)))
+            self._inflight[key] = inflight
+        ohlcv = await asyncio.shield(inflight[1])
+        return ohlcv[-limit:] if ohlcv else ohlcv
+
+
+# =======================================================================================
+# --- مخبأ عمق دفتر الأوامر المشترك (Depth Cache) ---
+#
+# دفتر الأوامر بيانات عامة: يُجلب عبر الاتصال العام (وزن IP الخاص بالعامل) مرة واحدة
+# لكل رمز ضمن مهلة صلاحية، ويُشارك بين كل المستخدمين. وزن مفاتيح المستخدمين يبقى للأوامر.
+# =======================================================================================
+
+DEPTH_LIMIT = 20
+
+class DepthCache:
+    """(V6) آخر دفتر أوامر (20 مستوى) لكل رمز مع مهلة صلاحية قابلة للضبط لكل رمز."""
+
+    def __init__(self, exchange: ccxt.Exchange, max_age: float = 30.0, max_age_overrides: Optional[Dict[str, float]] = None, limit: int = DEPTH_LIMIT):
+        self.exchange = exchange
+        self.max_age = max_age
+        self.max_age_overrides: Dict[str, float] = dict(max_age_overrides or {})
+        self.limit = limit
+        self._books: Dict[str, Tuple[float, Dict]] = {} # {الرمز: (وقت الجلب، الدفتر)}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.fetches = 0
+
+    def max_age_for(self, symbol: str) -> float:
+        return self.max_age_overrides.get(symbol, self.max_age)
+
+    def peek(self, symbol: str) -> Optional[Dict]:
+        """الدفتر المخزن إن كان ما زال صالحاً (بدون أي طلب)."""
+        entry = self._books.get(symbol)
+        if entry and time.time() - entry[0] <= self.max_age_for(symbol):
+            return entry[1]
+        return None
+
+    async def _fetch(self, symbol: str) -> Dict:
+        try:
+            self.fetches += 1
+            book = await self.exchange.fetch_order_book(symbol, limit=self.limit)
+            self._books[symbol] = (time.time(), book)
+            return book
+        finally:
+            self._inflight.pop(symbol, None)
+
+    async def get(self, symbol: str) -> Dict:
+        """دفتر صالح من المخبأ، أو جلب عام واحد (الطلبات المتزامنة لنفس الرمز تنتظر نفس الجلب)."""
+        book = self.peek(symbol)
+        if book is not None:
+            self.hits += 1
+            return book
+        if symbol not in self._inflight:
+            self._inflight[symbol] = asyncio.create_task(self._fetch(symbol))
+        return await asyncio.shield(self._inflight[symbol])
+
+
+# =======================================================================================
+# --- خدمة بيانات السوق (Kline WebSocket) ---
+#
+# تشترك في @kline_<tf> لرموز عالم الفحص وتحتفظ بذاكرة شموع متدحرجة لكل
+# (رمز، إطار زمني). REST يُستخدم فقط للتعبئة الأولية أو بعد فجوة في البث.
+# =======================================================================================
+
+class MarketDataService:
+    """(V6) ذاكرة شموع حية من بث Binance (بدلاً من سحب 100 شمعة REST في كل دورة)."""
+
+    def __init__(self, exchange: ccxt.Exchange, timeframes: Iterable[str] = ('15m', '1h'), limit: int = 100, store=None):
+        self.exchange = exchange
+        self.timeframes = tuple(timeframes)
+        self.limit = limit # (سعة كل ذاكرة حلقية)
+        self.store = store # (V6) candle_store.CandleStore اختياري: بدء دافئ من القرص وحفظ كل شمعة تُغلق
+        self._buffers: Dict[Tuple[str, str], CandleRingBuffer] = {}
+        self._symbols: set = set()
+        self._subscribed: set = set()
+        self._id_to_symbol: Dict[str, str] = {}
+        self._gaps: set = set()
+        self._backfilling: Dict[Tuple[str, str], asyncio.Task] = {}
+        # (حالة المؤشرات التزايدية حتى آخر شمعة مغلقة لكل رمز/إطار)
+        self._indicators: Dict[Tuple[str, str], CandleIndicators] = {}
+        self._request_id = 0
+        self.connected = False
+
+    # --- الاشتراكات ---
+
+    def _stream_name(self, symbol: str, timeframe: str) -> Optional[str]:
+        market = (self.exchange.markets or {}).get(symbol)
+        if not market:
+            return None
+        self._id_to_symbol[market['id']] = symbol
+        return f"{market['id'].lower()}@kline_{timeframe}"
+
+    def _wanted_streams(self) -> set:
+        streams = {self._stream_name(s, tf) for s in self._symbols for tf in self.timeframes}
+        streams.discard(None)
+        return streams
+
+    def set_universe(self, symbols: Iterable[str]):
+        """
+        يحدّث الرموز المتابعة. التغيير يُطبق على نفس الاتصال (SUBSCRIBE/UNSUBSCRIBE)،
+        والرموز الجديدة تُعبأ عبر REST في الخلفية (لكل الأطر الزمنية).
+        """
+        self._symbols = set(symbols)
+        for key in [k for k in self._buffers if k[0] not in self._symbols]:
+            del self._buffers[key]
+            self._indicators.pop(key, None)
+        for symbol in self._symbols:
+            for timeframe in self.timeframes:
+                if (symbol, timeframe) not in self._buffers:
+                    self._schedule_backfill(symbol, timeframe)
+
+    # --- الذاكرة ---
+
+    def is_warm(self, symbol: str, timeframe: str) -> bool:
+        key = (symbol, timeframe)
+        return key in self._buffers and key not in self._gaps and len(self._buffers[key]) > 0
+
+    def buffer(self, symbol: str, timeframe: str) -> Optional[CandleRingBuffer]:
+        """الذاكرة الحلقية نفسها (للقراءة بدون نسخ عبر view()/frame())."""
+        return self._buffers.get((symbol, timeframe))
+
+    def ohlcv(self, symbol: str, timeframe: str) -> Optional[np.ndarray]:
+        """view بدون نسخ لآخر الشموع (None إن لم تكن الذاكرة جاهزة)."""
+        buffer = self._buffers.get((symbol, timeframe))
+        return buffer.view() if buffer else None
+
+    def indicators(self, symbol: str, timeframe: str) -> Optional[CandleIndicators]:
+        """المؤشرات التزايدية حتى آخر شمعة مغلقة (الشمعة المفتوحة تُقرأ عبر peek())."""
+        if not self.is_warm(symbol, timeframe):
+            return None
+        return self._indicators.get((symbol, timeframe))
+
+    def _on_kline(self, symbol: str, timeframe: str, kline: Dict):
+        key = (symbol, timeframe)
+        buffer = self._buffers.get(key)
+        if buffer is None or key in self._gaps:
+            return # (بانتظار التعبئة عبر REST)
+        candle = (int(kline['t']), float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']), float(kline['v']))
+        last_ts = buffer.last_timestamp
+        step = TIMEFRAME_MS[timeframe]
+        if last_ts is None or candle[0] == last_ts + step:
+            state = self._indicators.get(key)
+            if state is not None and last_ts is not None:
+                state.update(buffer.view(1)[0]) # (الشمعة السابقة أُغلقت: خطوة O(1))
+            if self.store is not None and last_ts is not None:
+                try:
+                    self.store.append(symbol, timeframe, buffer.view(1))
+                except OSError as e:
+                    logger.warning(f"MARKET_DATA: Failed to persist {symbol} {timeframe} candle: {e}")
+            buffer.append(candle)
+        elif candle[0] == last_ts:
+            buffer.update_last(candle)
+        elif candle[0] > last_ts + step:
+            logger.warning(f"MARKET_DATA: Gap detected for {symbol} {timeframe}. Scheduling REST backfill.")
+            self._gaps.add(key)
+            self._schedule_backfill(symbol, timeframe)
+
+    async def backfill(self, symbol: str, timeframe: str):
+        """تعبئة لرمز/إطار واحد (عند البدء أو بعد فجوة): من القرص إن كان محدثاً، وإلا REST."""
+        key = (symbol, timeframe)
+        try:
+            if self.store is not None:
+                # (بدء دافئ: الشمعة المفتوحة تصل من البث، والآخر في الذاكرة شمعة مغلقة)
+                ohlcv = await self.store.tail(self.exchange, symbol, timeframe, self.limit, include_forming=False)
+            else:
+                ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe, limit=self.limit)
+            if ohlcv:
+                buffer = self._buffers.get(key) or CandleRingBuffer(self.limit)
+                buffer.clear()
+                buffer.extend(ohlcv)
+                self._buffers[key] = buffer
+                self._indicators[key] = CandleIndicators.from_candles(buffer.view()[:-1])
+                self._gaps.discard(key)
+        except Exception as e:
+            logger.warning(f"MARKET_DATA: Backfill failed for {symbol} {timeframe}: {e}")
+        finally:
+            self._backfilling.pop(key, None)
+
+    def _schedule_backfill(self, symbol: str, timeframe: str) -> asyncio.Task:
+        key = (symbol, timeframe)
+        if key not in self._backfilling:
+            self._backfilling[key] = asyncio.create_task(self.backfill(symbol, timeframe))
+        return self._backfilling[key]
+
+    async def ensure_warm(self, symbols: Iterable[str], timeframe: str):
+        """يعبئ (مرة واحدة) أي رمز لم تصله بيانات بعد."""
+        tasks = [self._schedule_backfill(s, timeframe) for s in symbols if not self.is_warm(s, timeframe)]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def snapshot(self, symbols: Iterable[str], timeframe: str, candle_close: Optional[int] = None) -> MarketSnapshot:
+        """
+        لقطة الدورة من الذاكرة المحلية (REST فقط للرموز الباردة).
+        مع candle_close (ms): الرموز التي لم تصلها شمعة الإغلاق بعد (بث متأخر/إعادة اتصال/تعبئة فجوة)
+        تُجلب عبر REST، وما بقي منها متأخراً يُستبعد من الدورة بدلاً من فحصه على شمعة سابقة.
+        """
+        symbols = list(symbols)
+        await self.ensure_warm(symbols, timeframe)
+        candles = {s: self.ohlcv(s, timeframe) for s in symbols if self.is_warm(s, timeframe)}
+        if candle_close is not None:
+            stale = [s for s, ohlcv in candles.items() if not is_fresh(ohlcv, timeframe, candle_close)]
+            if stale:
+                results = await asyncio.gather(*(self.exchange.fetch_ohlcv(s, timeframe, limit=self.limit) for s in stale), return_exceptions=True)
+                dropped = 0
+                for symbol, result in zip(stale, results):
+                    if not isinstance(result, Exception) and is_fresh(result, timeframe, candle_close):
+                        candles[symbol] = result
+                    else:
+                        del candles[symbol]
+                        dropped += 1
+                logger.warning(f"MARKET_DATA: {len(stale)} {timeframe} buffers behind candle close, refetched via REST ({dropped} dropped this cycle).")
+        return MarketSnapshot(timeframe, candles)
+
+    # --- البث ---
+
+    async def _sync_subscriptions(self, ws):
+        wanted = self._wanted_streams()
+        to_add, to_remove = sorted(wanted - self._subscribed), sorted(self._subscribed - wanted)
+        for method, streams in (("UNSUBSCRIBE", to_remove), ("SUBSCRIBE", to_add)):
+            for i in range(0, len(streams), 200):
+                self._request_id += 1
+                await ws.send(json.dumps({"method": method, "params": streams[i:i + 200], "id": self._request_id}))
+        self._subscribed = wanted
+
+    async def run(self):
+        """حلقة البث الرئيسية (مع إعادة الاتصال)."""
+        while True:
+            try:
+                logger.info("MARKET_DATA: Connecting to Binance kline stream...")
+                async with websockets.connect(KLINE_STREAM_URI, ping_interval=180, ping_timeout=60) as ws:
+                    self.connected = True
+                    self._subscribed = set()
+                    # (بعد إعادة الاتصال: أي شمعة فاتتنا ستظهر كفجوة وتُعبأ تلقائياً)
+                    while True:
+                        if self._wanted_streams() != self._subscribed:
+                            await self._sync_subscriptions(ws)
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), timeout=1.0)
+                        except asyncio.TimeoutError:
+                            continue
+                        payload = loads(message)
+                        data = payload.get('data')
+                        if not data or data.get('e') != 'kline':
+                            continue
+                        symbol = self._id_to_symbol.get(data['s'])
+                        if symbol in self._symbols:
+                            self._on_kline(symbol, data['k']['i'], data['k'])
+            except Exception as e:
+                logger.warning(f"MARKET_DATA: Stream lost: {e}. Reconnecting in 5s...")
+            finally:
+                self.connected = False
+            await asyncio.sleep(5)
+
+
+# =======================================================================================
+# --- بث أسعار "العيون" (Ticker Streams) ---
+#
+# - !miniTicker@arr (كل السوق): التصفية بالرمز الخام (id) قبل أي فك JSON أو float، ثم فك
+#   العناصر المطلوبة فقط (orjson إن وُجدت) مع خريطة id→رمز مسبقة من الأسواق.
+# - أو بث <id>@miniTicker (أو @bookTicker) لرموز الصفقات المفتوحة فقط على اتصال مجمّع واحد،
+#   وتُضاف/تُزال الرموز على نفس الاتصال.
+# =======================================================================================
+
+ALL_TICKERS_STREAM_URI = "wss://stream.binance.com:9443/ws/!miniTicker@arr"
+TICKER_STREAM_URI = KLINE_STREAM_URI # (نفس نقطة البث المجمّع: {"stream": ..., "data": ...})
+TICKER_PRICE_FIELDS = {'miniTicker': 'c', 'bookTicker': 'b'} # (bookTicker: أفضل سعر شراء = سعر الخروج الفعلي)
+SUBSCRIBE_BATCH = 200
+
+def exchange_symbol_map(markets: Optional[Dict]) -> Dict[str, str]:
+    """{id البورصة: الرمز الموحد} لأسواق spot (مثل 'BTCUSDT' -> 'BTC/USDT'، بدلاً من استبدال 'USDT' نصياً)."""
+    return {m['id']: symbol for symbol, m in (markets or {}).items() if m.get('spot', True) and m.get('id')}
+
+_TICKER_ID = re.compile(r'"s":\s*"([^"]+)"')
+_TICKER_ID_BYTES = re.compile(rb'"s":\s*"([^"]+)"')
+
+class TickerDecoder:
+    """
+    (V6) (الرمز، السعر) للرموز المطلوبة فقط من رسالة !miniTicker@arr.
+    يبحث عن "s":"<id>" في النص الخام ويفك فقط عناصر الرموز المطلوبة (عنصر miniTicker مسطح:
+    ما بين أقرب '{' قبله وأول '}' بعده)، فبقية السوق لا تمر بفك JSON ولا float.
+    """
+
+    def __init__(self, markets: Optional[Dict]):
+        self.id_to_symbol = exchange_symbol_map(markets)
+        self.symbol_to_id = {symbol: market_id for market_id, symbol in self.id_to_symbol.items()}
+
+    def prices(self, message, symbols: Iterable[str]) -> List[Tuple[str, float]]:
+        if isinstance(message, bytes):
+            pattern, open_, close = _TICKER_ID_BYTES, b'{', b'}'
+            wanted = {self.symbol_to_id[s].encode() for s in symbols if s in self.symbol_to_id}
+        else:
+            pattern, open_, close = _TICKER_ID, '{', '}'
+            wanted = {self.symbol_to_id[s] for s in symbols if s in self.symbol_to_id}
+        ticks = []
+        if not wanted:
+            return ticks
+        for match in pattern.finditer(message):
+            if match.group(1) in wanted:
+                start, end = message.rfind(open_, 0, match.start()), message.find(close, match.end())
+                data = loads(message[start:end + 1])
+                ticks.append((self.id_to_symbol[data['s']], float(data['c'])))
+        return ticks
+
+class TickerSubscriptions:
+    """(V6) {اسم البث: الرمز} المشترك به الآن، وأوامر SUBSCRIBE/UNSUBSCRIBE لمطابقة رموز مطلوبة."""
+
+    def __init__(self, exchange: ccxt.Exchange, channel: str = 'miniTicker'):
+        self.exchange = exchange
+        self.channel = channel
+        self.price_field = TICKER_PRICE_FIELDS[channel]
+        self._symbols: frozenset = frozenset()
+        self._streams: Dict[str, str] = {}
+        self._request_id = 0
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def symbol(self, stream: Optional[str]) -> Optional[str]:
+        return self._streams.get(stream)
+
+    def reset(self):
+        """اتصال جديد: لا اشتراكات بعد."""
+        self._symbols, self._streams = frozenset(), {}
+
+    def sync(self, symbols: Iterable[str]) -> List[str]:
+        """رسائل JSON (UNSUBSCRIBE ثم SUBSCRIBE) لجعل الاشتراكات = symbols. قائمة فارغة إن لم يتغير شيء."""
+        symbols = frozenset(symbols)
+        if symbols == self._symbols:
+            return []
+        markets = self.exchange.markets or {}
+        wanted = {f"{markets[s]['id'].lower()}@{self.channel}": s for s in symbols if s in markets}
+        to_add, to_remove = sorted(wanted.keys() - self._streams.keys()), sorted(self._streams.keys() - wanted.keys())
+        messages = []
+        for method, streams in (("UNSUBSCRIBE", to_remove), ("SUBSCRIBE", to_add)):
+            for i in range(0, len(streams), SUBSCRIBE_BATCH):
+                self._request_id += 1
+                messages.append(json.dumps({"method": method, "params": streams[i:i + SUBSCRIBE_BATCH], "id": self._request_id}))
+        self._symbols, self._streams = symbols, wanted
+        return messages
+
+    def price(self, payload: Dict) -> Optional[Tuple[str, float]]:
+        """(الرمز، السعر) من رسالة البث المجمّع، أو None (رد اشتراك أو بث لم يعد مطلوباً)."""
+        symbol = self._streams.get(payload.get('stream'))
+        data = payload.get('data')
+        if symbol is None or not data:
+            return None
+        return symbol, float(data[self.price_field])
+
+
+# =======================================================================================
+# --- طابور آخر سعر لكل رمز (Latest-Price Conflation) ---
+#
+# قارئ البث يكتب آخر سعر لكل رمز فقط (بدون انتظار)، ومجموعة مقيّمين تأخذ الرموز الجاهزة
+# بأحدث سعر. سعر وصل قبل معالجة السابق يحل محله (تيك وسيط مُسقط)، ونفس الرمز لا يُقيّم
+# مرتين في نفس الوقت (صفقاته تُعدل أثناء التقييم): سعره الجديد ينتظر انتهاء التقييم الجاري.
+# =======================================================================================
+
+class LatestPriceQueue:
+    """(V6) {الرمز: آخر سعر لم يُقيّم} + طابور الرموز الجاهزة، مع عدادات العمق والتيكات المُسقطة."""
+
+    def __init__(self):
+        self._latest: Dict[str, float] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._busy: set = set() # (رموز يقيّمها مقيّم الآن)
+        self.received = 0
+        self.dropped = 0 # (أسعار وسيطة استُبدلت قبل تقييمها)
+        self.processed = 0
+
+    def __len__(self) -> int:
+        """العمق: رموز لها سعر ينتظر التقييم."""
+        return len(self._latest)
+
+    def put(self, symbol: str, price: float):
+        """(القارئ) لا ينتظر أبداً."""
+        self.received += 1
+        if symbol in self._latest:
+            self.dropped += 1
+        elif symbol not in self._busy:
+            self._ready.put_nowait(symbol)
+        self._latest[symbol] = price
+
+    async def get(self) -> Tuple[str, float]:
+        """(المقيّم) الرمز التالي بأحدث سعر له. يجب استدعاء done(symbol) بعد التقييم."""
+        symbol = await self._ready.get()
+        self._busy.add(symbol)
+        return symbol, self._latest.pop(symbol)
+
+    def done(self, symbol: str):
+        self.processed += 1
+        self._busy.discard(symbol)
+        if symbol in self._latest: # (وصل سعر أحدث أثناء التقييم)
+            self._ready.put_nowait(symbol)
+
+    def clear(self):
+        """(بداية تشغيل جديد للعيون) لا أسعار قديمة من الجلسة السابقة."""
+        self._latest.clear()
+        self._busy.clear()
+        self._ready = asyncio.Queue()
+
+    def metrics(self) -> Dict[str, int]:
+        return {"depth": len(self._latest), "in_flight": len(self._busy), "received": self.received,
+                "dropped": self.dropped, "processed": self.processed}
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import core_logic
+import market_data
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- محرك الفحص متعدد العمليات (Process Pool Engine) ---
+#
+# لقطة الدورة تُنسخ مرة واحدة إلى ذاكرة مشتركة (shared_memory) بشكل (الرموز، الشموع، 6)،
+# وتقييم الاستراتيجيات (pandas_ta / scipy) يعمل في ProcessPoolExecutor على كل الأنوية.
+# العمليات لا تستقبل إلا "مقبض" اللقطة وأسماء الاستراتيجيات: الحلقة الرئيسية تبقى للـ I/O فقط
+# (العيون والأيدي لا تنتظر انتهاء الفحص).
+# =======================================================================================
+
+PanelHandle = Tuple[str, str, Tuple[str, ...], Tuple[int, ...], int] # (اسم الذاكرة، الإطار، الرموز، الأطوال، أقصى طول)
+
+
+class SharedCandlePanel:
+    """(V6) نسخة من MarketSnapshot في ذاكرة مشتركة. المالك (الحلقة الرئيسية) هو من يحررها."""
+
+    def __init__(self, snapshot: market_data.MarketSnapshot):
+        symbols = snapshot.symbols
+        lengths = tuple(len(snapshot.ohlcv(s)) for s in symbols)
+        width = max(lengths, default=0)
+        shape = (len(symbols), width, len(market_data.OHLCV_COLUMNS))
+        self._shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        candles = np.ndarray(shape, dtype=np.float64, buffer=self._shm.buf)
+        for i, s in enumerate(symbols):
+            candles[i, :lengths[i]] = snapshot.ohlcv(s)
+        del candles # (لا نحتفظ بمراجع للذاكرة قبل close())
+        self.handle: PanelHandle = (self._shm.name, snapshot.timeframe, symbols, lengths, width)
+
+    def release(self):
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# --- جانب العملية الفرعية ---
+
+_ATTACHED: Dict[str, Tuple] = {} # (لوحة واحدة حية لكل عملية: آخر دورة فقط)
+
+def _attach(handle: PanelHandle) -> Tuple:
+    name, timeframe, symbols, lengths, width = handle
+    if name not in _ATTACHED:
+        for old_name in list(_ATTACHED):
+            _ATTACHED.pop(old_name)[0].close()
+        shm = shared_memory.SharedMemory(name=name) # (نفس resource_tracker الخاص بالمالك: لا تحرير من هنا)
+        candles = np.ndarray((len(symbols), width, len(market_data.OHLCV_COLUMNS)), dtype=np.float64, buffer=shm.buf)
+        candles.flags.writeable = False
+        rows = {s: i for i, s in enumerate(symbols)}
+        _ATTACHED[name] = (shm, candles, rows, lengths, timeframe, {})
+    return _ATTACHED[name]
+
+def _frame(handle: PanelHandle, symbol: str):
+    _, candles, rows, lengths, timeframe, frames = _attach(handle)
+    if symbol not in frames:
+        row = rows[symbol]
+        df = market_data.candles_frame(candles[row, :lengths[row]])
+        df.attrs['symbol'], df.attrs['timeframe'] = symbol, timeframe # (مخبأ المؤشرات داخل العملية)
+        frames[symbol] = df
+    return frames[symbol]
+
+def _evaluate_chunk(handle: PanelHandle, strategies: List[Tuple[str, dict]], jobs: List[Tuple[str, Optional[Dict]]], stage: str = "all") -> Tuple[Dict[str, List[str]], int, int]:
+    """تقييم نقي لمجموعة رموز: يعيد ({الرمز: أسباب الإشارات المؤكدة}، إصابات، إخفاقات مخبأ النتائج)."""
+    cache = core_logic.STRATEGY_RESULTS
+    hits, misses = cache.hits, cache.misses
+    plan = core_logic.ScanPlan([(core_logic.STRATEGY_REGISTRY[name], params) for name, params in strategies])
+    results = {}
+    for symbol, io_data in jobs:
+        try:
+            results[symbol] = core_logic.evaluate_plan(plan, _frame(handle, symbol), io_data, stage)
+        except Exception as e:
+            logger.error(f"SCANNER: Worker failed to evaluate {symbol}: {e}")
+            results[symbol] = []
+    return results, cache.hits - hits, cache.misses - misses
+
+
+class ProcessScanEngine:
+    """(V6) يوزع تقييم خطة الفحص على ProcessPoolExecutor فوق لوحة الدورة المشتركة."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._panel: Optional[SharedCandlePanel] = None
+        self._snapshot: Optional[market_data.MarketSnapshot] = None
+        self.hits = 0 # (مجموع إحصاءات STRATEGY_RESULTS داخل العمليات الفرعية)
+        self.misses = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # (forkserver: لا نرث حالة الحلقة/الاتصالات من العامل الرئيسي)
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("forkserver"))
+        return self._pool
+
+    def publish(self, snapshot: market_data.MarketSnapshot):
+        """ينشر لقطة الدورة في الذاكرة المشتركة (مرة واحدة لكل دورة)، ويحرر السابقة."""
+        if snapshot is self._snapshot:
+            return
+        previous = self._panel
+        self._panel, self._snapshot = SharedCandlePanel(snapshot), snapshot
+        if previous:
+            previous.release() # (العمليات التي ما زالت تقرأها تحتفظ بالربط حتى الدورة التالية)
+
+    async def evaluate(self, plan: core_logic.ScanPlan, symbols: List[str], io_data: Optional[Dict[str, Dict]] = None, stage: str = "all") -> Dict[str, List[str]]:
+        """يقيّم الخطة على الرموز في العمليات الفرعية دون حجز الحلقة (stage كما في ScanPlan.confirmations)."""
+        if not plan or not symbols or self._panel is None:
+            return {}
+        io_data = io_data or {}
+        strategies = [(spec.name, params) for spec, params in plan.entries]
+        jobs = [(s, io_data.get(s)) for s in symbols if s in self._snapshot]
+        size = -(-len(jobs) // self.max_workers) if jobs else 1
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(self._executor(), _evaluate_chunk, self._panel.handle, strategies, jobs[i:i + size], stage)
+            for i in range(0, len(jobs), size)
+        ]
+        results: Dict[str, List[str]] = {}
+        for chunk, hits, misses in await asyncio.gather(*futures):
+            results.update(chunk)
+            self.hits += hits
+            self.misses += misses
+        return results
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._panel is not None:
+            self._panel.release()
+            self._panel = self._snapshot = None
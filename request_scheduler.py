@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import ccxt.async_support as ccxt
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- جدولة طلبات المنصة المركزية (Request Scheduler) ---
+#
+# كل اتصالات ccxt في العامل (العام + اتصالات المستخدمين) تخرج من نفس الـ IP، بينما
+# enableRateLimit في ccxt يحد كل اتصال على حدة فقط. هنا:
+#   - دلو رموز (token bucket) واحد لوزن الـ IP المشترك (حد Binance بالدقيقة).
+#   - دلو لكل مفتاح API لمعدل الأوامر (حد Binance لكل 10 ثوانٍ).
+#   - أولويات: الإغلاق > الأوامر > الفحص > التحليلات، مع احتياطي لا يلمسه الفحص والتحليلات.
+# =======================================================================================
+
+PRIORITY_CLOSE = 0
+PRIORITY_ORDER = 1
+PRIORITY_SCAN = 2
+PRIORITY_ANALYTICS = 3
+PRIORITY_NAMES = {PRIORITY_CLOSE: "close", PRIORITY_ORDER: "order", PRIORITY_SCAN: "scan", PRIORITY_ANALYTICS: "analytics"}
+
+IP_WEIGHT_PER_MINUTE = int(os.getenv("BINANCE_IP_WEIGHT_PER_MINUTE", "6000"))
+IP_WEIGHT_BUDGET_FRACTION = float(os.getenv("BINANCE_IP_WEIGHT_BUDGET_FRACTION", "0.8")) # (هامش أمان تحت حد المنصة)
+ORDERS_PER_10S = int(os.getenv("BINANCE_ORDERS_PER_10S", "50"))
+LOW_PRIORITY_RESERVE = 0.2 # (نسبة من الدلو محجوزة للإغلاق والأوامر)
+WEIGHT_PER_CCXT_COST = 5 # (تكاليف ccxt لـ Binance بوحدة rateLimit=50ms: التكلفة 1 = وزن 5)
+PENALTY_SECONDS = 60 # (تجميد بعد 429/418 من المنصة)
+
+_PRIORITY: contextvars.ContextVar = contextvars.ContextVar("request_priority", default=PRIORITY_SCAN)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """يحدد أولوية كل طلبات ccxt داخل هذا السياق (وفي المهام التي تُنشأ منه)."""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+def prioritized(priority: int):
+    """مزخرف لدوال async: كل طلباتها (والمهام المتفرعة منها) بهذه الأولوية."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with request_priority(priority):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    """دلو رموز بسيط: السعة = الحد، ويمتلئ بمعدل ثابت بالثانية."""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated_at', 'frozen_until')
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.frozen_until = 0.0
+
+    def _refill(self, now: float):
+        if now >= self.frozen_until:
+            start = max(self.updated_at, self.frozen_until)
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated_at = now
+
+    def delay_for(self, amount: float, floor: float = 0.0) -> float:
+        """الثواني المتبقية حتى يتوفر amount مع بقاء floor في الدلو (0 = متاح الآن)."""
+        now = time.monotonic()
+        self._refill(now)
+        missing = amount + floor - self.tokens
+        wait = max(0.0, self.frozen_until - now)
+        return max(wait, missing / self.rate) if missing > 0 else wait
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+    def freeze(self, seconds: float):
+        self.tokens = 0.0
+        self.frozen_until = time.monotonic() + seconds
+
+
+class RequestScheduler:
+    """(V6) يمنح الطلبات من دلو وزن الـ IP بترتيب الأولوية، ومن دلو المفتاح للأوامر."""
+
+    def __init__(self, ip_weight_per_minute: float = IP_WEIGHT_PER_MINUTE * IP_WEIGHT_BUDGET_FRACTION, orders_per_10s: int = ORDERS_PER_10S):
+        self.ip = TokenBucket(ip_weight_per_minute, ip_weight_per_minute / 60.0)
+        self.ip_weight_per_minute = ip_weight_per_minute # (ميزانية الـ IP كاملة قبل التقسيم)
+        self.shares = 1
+        self.orders_per_10s = orders_per_10s
+        self._keys: Dict[str, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self.granted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.waited_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.weight_used = 0.0
+        self.rate_limit_hits = 0
+
+    def _key_bucket(self, api_key: str) -> TokenBucket:
+        if api_key not in self._keys:
+            self._keys[api_key] = TokenBucket(self.orders_per_10s, self.orders_per_10s / 10.0)
+        return self._keys[api_key]
+
+    async def acquire(self, weight: float, api_key: Optional[str] = None, is_order: bool = False, priority: Optional[int] = None):
+        priority = _PRIORITY.get() if priority is None else priority
+        started = time.monotonic()
+        floor = self.ip.capacity * LOW_PRIORITY_RESERVE if priority >= PRIORITY_SCAN else 0.0
+        weight = min(weight, self.ip.capacity - floor)
+        if is_order and api_key:
+            bucket = self._key_bucket(api_key)
+            while (delay := bucket.delay_for(1)) > 0:
+                await asyncio.sleep(delay)
+            bucket.consume(1)
+        entry = (priority, next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                delay = self.ip.delay_for(weight, floor) if self._waiters[0] == entry else None
+                if delay == 0:
+                    break
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            self.ip.consume(weight)
+            self.weight_used += weight
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._changed.set()
+        name = PRIORITY_NAMES.get(priority, "scan")
+        self.granted[name] += 1
+        self.waited_seconds[name] += time.monotonic() - started
+
+    def set_share(self, shares: int):
+        """(V6) عدة عمليات على نفس الـ IP (شظايا الماسح): لكل عملية 1/shares من ميزانية الوزن."""
+        shares = max(1, int(shares))
+        if shares == self.shares:
+            return
+        self.ip.delay_for(0) # (تعبئة حتى الآن بالمعدل القديم)
+        capacity = self.ip_weight_per_minute / shares
+        self.ip.capacity, self.ip.rate = capacity, capacity / 60.0
+        self.ip.tokens = min(self.ip.tokens, capacity)
+        self.shares = shares
+        self._changed.set()
+        logger.info(f"SCHEDULER: IP weight budget split across {shares} workers ({capacity:.0f}/min each).")
+
+    def penalize(self, seconds: float = PENALTY_SECONDS):
+        """المنصة ردت 429/418: نوقف كل الطلبات (كل الأولويات) لفترة."""
+        self.rate_limit_hits += 1
+        self.ip.freeze(seconds)
+        logger.warning(f"SCHEDULER: Exchange rate limit hit. Pausing all requests for {seconds}s.")
+
+    def metrics(self) -> Dict:
+        """لقطة لاستهلاك الميزانية (للسجلات/المراقبة)."""
+        self.ip.delay_for(0)
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _ in self._waiters:
+            queued[PRIORITY_NAMES.get(priority, "scan")] += 1
+        return {
+            "ip_weight_available": round(self.ip.tokens, 1),
+            "ip_weight_capacity": self.ip.capacity,
+            "ip_budget_shares": self.shares,
+            "ip_budget_used_pct": round(100 * (1 - max(self.ip.tokens, 0) / self.ip.capacity), 1),
+            "weight_used_total": round(self.weight_used, 1),
+            "queued": queued,
+            "granted": dict(self.granted),
+            "waited_seconds": {name: round(v, 2) for name, v in self.waited_seconds.items()},
+            "rate_limit_hits": self.rate_limit_hits,
+            "api_keys_tracked": len(self._keys),
+        }
+
+
+SCHEDULER = RequestScheduler()
+
+
+class ScheduledBinance(ccxt.binance):
+    """
+    (V6) اتصال Binance تمر كل طلباته REST عبر SCHEDULER (بدلاً من محدد ccxt لكل اتصال).
+    الأولوية تُقرأ من request_priority() في سياق المستدعي.
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        super().__init__(config or {})
+        self.enableRateLimit = False # (SCHEDULER هو المحدد الوحيد والمشترك)
+
+    async def fetch2(self, path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+        cost = self.calculate_rate_limiter_cost(api, method, path, params, config)
+        is_order = method == 'POST' and str(path).startswith(('order', 'sor/order', 'orderList'))
+        await SCHEDULER.acquire(cost * WEIGHT_PER_CCXT_COST, self.apiKey or None, is_order)
+        try:
+            return await super().fetch2(path, api, method, params, headers, body, config)
+        except (ccxt.RateLimitExceeded, ccxt.DDoSProtection):
+            SCHEDULER.penalize()
+            raise
@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import db_utils
+import market_data
+import request_scheduler
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- تنسيق نسخ العامل عبر Postgres (Shards + Leader Election) ---
+#
+# عدة عمليات ماسح تعمل معاً، كل منها تملك مستخدمين حسب تجزئة متسقة لـ user_id.
+# التنسيق عبر Postgres:
+#   - scanner_shards: نبض كل شظية (الأعضاء الأحياء).
+#   - market_snapshots: العملية الرئيسية تنشر عالم الرموز + لقطة الشموع + أعضاء الحلقة
+#     لكل دورة، والشظايا تقرأها (لا إعادة جلب للبيانات العامة، ونفس التوزيع للجميع).
+#   - pg_try_advisory_lock: المكونات الفردية (العيون، نشر اللقطة) تعمل في القائد فقط،
+#     والنسخ الأخرى احتياط ساخن يتولى فور سقوط اتصال القائد.
+#
+# الشظايا تخرج من نفس الـ IP: ميزانية وزن الـ IP تُقسم على أعضاء الحلقة الأحياء (SHARD_SPLIT_IP_BUDGET).
+# شموع الأطر الأخرى (1h لـ support_rebound) ودفاتر الأوامر (whale_radar) لا تُنشر مع اللقطة: كل شظية
+# تجلبها في مخابئها المحلية للرموز التي تجتاز بوابات مستخدميها فقط، فقد يتكرر الرمز نفسه حتى N مرة
+# لكل دورة. هذا التكرار محدود بالميزانية المقسومة: مجموع الشظايا لا يتجاوز حد الـ IP.
+# =======================================================================================
+
+SHARD_VIRTUAL_NODES = 64 # (نقاط لكل شظية على الحلقة: توزيع متوازن)
+SHARD_HEARTBEAT_SECONDS = 10
+SHARD_TIMEOUT_SECONDS = 30 # (شظية بلا نبض لهذه المدة تخرج من الحلقة)
+SNAPSHOT_POLL_SECONDS = 0.5
+LEADER_RETRY_SECONDS = 5 # (محاولة الاحتياط أخذ القفل)
+LEADER_CHECK_SECONDS = 5 # (فحص بقاء اتصال القفل لدى القائد)
+SHARD_SPLIT_IP_BUDGET = os.getenv("SHARD_SPLIT_IP_BUDGET", "1") == "1" # (0 = كل شظية على IP مختلف)
+
+
+def _hash(key: str, signed: bool = False) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=signed)
+
+
+class HashRing:
+    """(V6) تجزئة متسقة: إضافة/إزالة شظية تنقل ~1/N من المستخدمين فقط."""
+
+    def __init__(self, shard_ids: Iterable[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.shard_ids = tuple(sorted(set(shard_ids)))
+        points = sorted((_hash(f"{shard_id}#{i}"), shard_id) for shard_id in self.shard_ids for i in range(virtual_nodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [shard_id for _, shard_id in points]
+
+    def owner(self, key) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[i]
+
+
+class ShardCoordinator:
+    """(V6) نبض الشظية + نشر/انتظار لقطة الدورة + ملكية المستخدمين لهذه الدورة."""
+
+    def __init__(self, shard_id: str, timeout: float = SHARD_TIMEOUT_SECONDS):
+        self.shard_id = shard_id
+        self.timeout = timeout
+        self.ring = HashRing([shard_id])
+
+    async def run(self):
+        """يجدد النبض حتى الإيقاف، ثم يخرج من الحلقة فوراً (بدلاً من انتظار انتهاء المهلة)."""
+        try:
+            while True:
+                try:
+                    await db_utils.heartbeat_scanner_shard(self.shard_id)
+                except Exception as e:
+                    logger.error(f"SHARDS: Heartbeat failed for shard {self.shard_id}: {e}")
+                await asyncio.sleep(SHARD_HEARTBEAT_SECONDS)
+        finally:
+            try:
+                await db_utils.remove_scanner_shard(self.shard_id)
+            except Exception:
+                pass
+
+    def _adopt(self, ring: HashRing):
+        """يعتمد أعضاء الدورة ويقسم ميزانية الـ IP عليهم."""
+        self.ring = ring
+        if SHARD_SPLIT_IP_BUDGET:
+            request_scheduler.SCHEDULER.set_share(len(ring.shard_ids))
+
+    def owns(self, user_id) -> bool:
+        return self.ring.owner(user_id) == self.shard_id
+
+    async def publish_snapshot(self, candle_close: int, universe: market_data.MarketUniverse, snapshot: market_data.MarketSnapshot):
+        """(العملية الرئيسية) ينشر لقطة الدورة مع أعضاء الحلقة الأحياء لهذه الدورة."""
+        try:
+            shard_ids = set(await db_utils.get_live_scanner_shards(self.timeout)) | {self.shard_id}
+            ring = HashRing(shard_ids)
+            await db_utils.save_market_snapshot(snapshot.timeframe, candle_close, universe.records(), snapshot.to_bytes(), list(ring.shard_ids))
+            self._adopt(ring)
+            logger.info(f"SHARDS: Published {snapshot.timeframe} snapshot ({len(snapshot)} symbols) for {len(ring.shard_ids)} shards.")
+        except Exception as e:
+            # (الشظايا لن تجد لقطة لهذه الدورة فتتخطاها: العملية الرئيسية تفحص كل المستخدمين، بنفس حصتها من الميزانية)
+            self.ring = HashRing([self.shard_id])
+            logger.error(f"SHARDS: Failed to publish snapshot, scanning all users locally this cycle: {e}")
+
+    async def wait_for_snapshot(self, timeframe: str, candle_close: int, timeout: float) -> Optional[Tuple[market_data.MarketUniverse, market_data.MarketSnapshot]]:
+        """(الشظايا) ينتظر لقطة الدورة المنشورة ويضبط الحلقة على أعضائها. None عند انتهاء المهلة."""
+        deadline = time.time() + timeout
+        while True:
+            cycle = await db_utils.get_market_snapshot(timeframe, candle_close)
+            if cycle is not None:
+                self._adopt(HashRing(cycle['shard_ids']))
+                return market_data.MarketUniverse.from_records(cycle['universe']), market_data.MarketSnapshot.from_bytes(cycle['candles'])
+            if time.time() >= deadline:
+                return None
+            await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+
+    def owned(self, users: List) -> List:
+        return [user for user in users if self.owns(user.user_id)]
+
+
+class LeaderElection:
+    """
+    (V6) قائد واحد لكل اسم عبر قفل جلسة (pg_try_advisory_lock) على اتصال مخصص.
+    المكونات تعمل فقط أثناء القيادة وتُلغى فور انقطاع الاتصال (القفل يتحرر مع الجلسة)،
+    والعمل الخاص بالقائد خارجها يتحقق بـ confirm() قبل التنفيذ.
+    """
+
+    def __init__(self, name: str, worker_id: str):
+        self.name = name
+        self.worker_id = worker_id
+        self.key = _hash(f"leader:{name}", signed=True) # (bigint للقفل)
+        self.is_leader = False
+        self._conn = None
+        self._lost = asyncio.Event()
+        self._ping_lock = asyncio.Lock() # (استعلام واحد في كل مرة على اتصال القفل)
+
+    def _lose(self, reason: str):
+        """يتخلى عن القيادة فوراً (قبل أن يلاحظ الفحص الدوري)."""
+        if self.is_leader:
+            logger.warning(f"LEADER: {self.worker_id} lost the lock for '{self.name}': {reason}")
+        self.is_leader = False
+        self._lost.set()
+
+    async def _ping(self) -> bool:
+        conn = self._conn
+        if conn is None or conn.is_closed():
+            self._lose("lock connection closed")
+            return False
+        try:
+            async with self._ping_lock:
+                await asyncio.wait_for(conn.fetchval("SELECT 1"), LEADER_CHECK_SECONDS)
+            return True
+        except Exception as e:
+            self._lose(str(e) or type(e).__name__)
+            return False
+
+    async def confirm(self) -> bool:
+        """يتحقق الآن من أن اتصال القفل حي قبل أي عمل خاص بالقائد."""
+        return self.is_leader and await self._ping()
+
+    async def _hold(self, components: List[asyncio.Task]):
+        """يبقى ما دام اتصال القفل حياً وما دامت المكونات تعمل."""
+        lost = asyncio.create_task(self._lost.wait())
+        try:
+            while True:
+                done, _ = await asyncio.wait([*components, lost], timeout=LEADER_CHECK_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                if done or not await self._ping():
+                    return
+        finally:
+            lost.cancel()
+
+    async def run(self, *components: Callable[[], Awaitable]):
+        """يحاول القيادة باستمرار؛ عند نيلها يشغّل components() حتى فقدانها."""
+        while True:
+            conn, tasks = None, []
+            try:
+                conn = await db_utils.open_dedicated_connection()
+                while not await db_utils.try_advisory_lock(conn, self.key):
+                    await asyncio.sleep(LEADER_RETRY_SECONDS)
+                self._conn, self._lost = conn, asyncio.Event()
+                conn.add_termination_listener(lambda _conn: self._lose("lock connection terminated"))
+                self.is_leader = True
+                logger.info(f"LEADER: {self.worker_id} is now the leader for '{self.name}'.")
+                tasks = [asyncio.create_task(component()) for component in components]
+                await self._hold(tasks)
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception():
+                        logger.error(f"LEADER: Component of '{self.name}' failed: {task.exception()}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"LEADER: Lost or failed to acquire leadership for '{self.name}': {e}")
+            finally:
+                if self.is_leader:
+                    logger.info(f"LEADER: {self.worker_id} stepped down for '{self.name}'.")
+                self.is_leader, self._conn = False, None
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close() # (يحرر القفل)
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
@@ -81,10 +81,21 @@ def expired_user_settings(active_user_settings) -> BotSettings:
     settings.subscription_expires_at = datetime.now(datetime.timezone.utc) - timedelta(days=1)
     return settings
 
+# شموع ثابتة مشتركة بين الاختبارات
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+def make_candles(count, start=1_700_000_000_000, step=900_000, close=1.5, trend=0, volume=10):
+    """يبني count شمعة [timestamp, 1, 2, 0.5, close + trend*i, volume] بفاصل step."""
+    return [[start + i * step, 1, 2, 0.5, close + trend * i, volume] for i in range(count)]
+
+def candles_frame(candles):
+    """DataFrame بأعمدة OHLCV من قائمة شموع."""
+    return pd.DataFrame(candles, columns=OHLCV_COLUMNS)
+
 # =======================================================================================
 # --- 1. اختبار المنطق النقي (core_logic.py) ---
 # =======================================================================================
-# (هذا الاختبار لم يتغير وهو صالح)
+# (حُدّث: المؤشرات تأتي من المخبأ المشترك لا من أعمدة df)
 @pytest.mark.asyncio
 async def test_analyze_momentum_breakout():
     """
@@ -92,21 +103,115 @@ async def test_analyze_momentum_breakout():
     """
     data = {'timestamp': pd.to_datetime(pd.date_range(start='1/1/2024', periods=100, freq='15min')),
             'open': [100]*100, 'high': [105]*100, 'low': [95]*100,
-            'close': [100]*100, 'volume': [10]*100, 'VWAP_D': [99]*100}
-    df = pd.DataFrame(data)
+            'close': [100]*100, 'volume': [10]*100}
+    df = pd.DataFrame(data).set_index('timestamp', drop=False) # (مثل candles_frame: فهرس زمني لـ VWAP)
     df.loc[df.index[-3], 'close'] = 100; df.loc[df.index[-2], 'close'] = 105
-    df.ta.bbands(length=20, append=True); df.ta.macd(append=True); df.ta.rsi(append=True)
-    macd_col = core_logic.find_col(df.columns, "MACD_")
-    macds_col = core_logic.find_col(df.columns, "MACDs_")
-    bbu_col = core_logic.find_col(df.columns, "BBU_")
-    df.loc[df.index[-3], macd_col] = 0.5; df.loc[df.index[-3], macds_col] = 0.6
-    df.loc[df.index[-2], macd_col] = 0.7; df.loc[df.index[-2], macds_col] = 0.6
-    df.loc[df.index[-2], bbu_col] = 104
-    
-    result = core_logic.analyze_momentum_breakout(df, {}, 0, 0)
-    assert result is not None
+    # (المؤشرات من المخبأ المشترك لا من أعمدة df: نتحكم بها عبر indicator، و VWAP_D يُحسب فعلاً من الفهرس الزمني ≈ 100)
+    macd = pd.DataFrame({'MACD_12_26_9': [0.0]*100, 'MACDs_12_26_9': [0.0]*100})
+    macd.loc[97, 'MACD_12_26_9'] = 0.5; macd.loc[97, 'MACDs_12_26_9'] = 0.6
+    macd.loc[98, 'MACD_12_26_9'] = 0.7; macd.loc[98, 'MACDs_12_26_9'] = 0.6
+    controlled = {'bbands': pd.DataFrame({'BBU_20_2.0': [104.0]*100}), 'macd': macd, 'rsi': pd.Series([50.0]*100)}
+    real_indicator = core_logic.indicator
+    fake = lambda df, name, **params: controlled[name] if name in controlled else real_indicator(df, name, **params)
+    with patch.object(core_logic, 'indicator', side_effect=fake):
+        result = core_logic.analyze_momentum_breakout(df, {}, 0, 0)
+        assert result is not None
     assert result['reason'] == "momentum_breakout"
 
+    # (pandas_ta على فهرس غير زمني يعيد DataFrame بدلاً من VWAP: لا إشارة ولا استثناء)
+    controlled['vwap'] = pd.DataFrame({'timestamp': data['timestamp']})
+    with patch.object(core_logic, 'indicator', side_effect=fake):
+        assert core_logic.analyze_momentum_breakout(df, {}, 0, 0) is None
+
+def test_indicator_cache_computes_once_per_candle():
+    """نفس المؤشر لنفس الرمز والشمعة يُحسب مرة واحدة ولا يعدّل df."""
+    cache = core_logic.IndicatorCache()
+    df = pd.DataFrame({'timestamp': [i * 900_000 for i in range(60)],
+                       'open': [100.0]*60, 'high': [101.0]*60, 'low': [99.0]*60,
+                       'close': [100.0 + (i % 5) for i in range(60)], 'volume': [10.0]*60})
+    df.attrs['symbol'], df.attrs['timeframe'] = "BTC/USDT", '15m'
+    columns_before = list(df.columns)
+
+    first = cache.get(df, 'bbands', length=20)
+    second = cache.get(df, 'bbands', length=20)
+
+    assert first is second
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert list(df.columns) == columns_before
+
+def test_strategy_results_shared_between_identical_configs():
+    """نفس الاستراتيجية بنفس المعاملات على نفس الشمعة تُقيّم مرة واحدة لكل المستخدمين."""
+    core_logic.STRATEGY_RESULTS.clear()
+    hits, misses = core_logic.STRATEGY_RESULTS.hits, core_logic.STRATEGY_RESULTS.misses
+    df = candles_frame(make_candles(60))
+    df.attrs['symbol'], df.attrs['timeframe'] = 'BTC/USDT', '15m'
+    user_a = [db_utils.ActiveStrategy(strategy_name='momentum_breakout', parameters={'a': 1, 'b': 2})]
+    user_b = [db_utils.ActiveStrategy(strategy_name='momentum_breakout', parameters={'b': 2, 'a': 1})]
+
+    with patch.object(core_logic.STRATEGY_REGISTRY['momentum_breakout'], 'func', wraps=core_logic.analyze_momentum_breakout) as func:
+        core_logic.evaluate_plan(core_logic.plan_scan(user_a), df)
+        core_logic.evaluate_plan(core_logic.plan_scan(user_b), df)
+
+    assert func.call_count == 1
+    assert core_logic.STRATEGY_RESULTS.misses - misses == 1
+    assert core_logic.STRATEGY_RESULTS.hits - hits == 1
+
+@pytest.mark.asyncio
+async def test_plan_runs_cheapest_first_and_gates_io():
+    """الأرخص أولاً مع توقف عند أول تأكيد، والبوابات تمنع الحساب والـ I/O غير اللازم."""
+    core_logic.STRATEGY_RESULTS.clear()
+    df = candles_frame(make_candles(60))
+    plan = core_logic.plan_scan([db_utils.ActiveStrategy(strategy_name=name, parameters={})
+                                 for name in ['whale_radar', 'support_rebound', 'momentum_breakout', 'breakout_squeeze_pro']])
+    assert [spec.name for spec, _ in plan.entries] == ['breakout_squeeze_pro', 'momentum_breakout', 'support_rebound', 'whale_radar']
+
+    # (حجم ثابت: بوابة الحجم تفشل → لا حساب لـ squeeze ولا شموع 1h لـ support_rebound)
+    assert plan.io_needed(df) == {'order_book'}
+    exchange = MagicMock(fetch_ohlcv=AsyncMock(), fetch_order_book=AsyncMock(return_value={'bids': [], 'asks': []}))
+    with patch.object(core_logic, 'CANDLE_SOURCE', None), patch.object(core_logic, 'DEPTH_SOURCE', None):
+        io_data = await core_logic.prefetch_io(plan, exchange, ['BTC/USDT'], {'BTC/USDT': plan.io_needed(df)})
+    exchange.fetch_ohlcv.assert_not_called()
+    assert set(io_data['BTC/USDT']) == {'order_book'}
+
+    with patch.object(core_logic.STRATEGY_REGISTRY['breakout_squeeze_pro'], 'func') as squeeze, \
+         patch.object(core_logic.STRATEGY_REGISTRY['momentum_breakout'], 'func', return_value={'reason': 'momentum_breakout'}), \
+         patch.object(core_logic.STRATEGY_REGISTRY['whale_radar'], 'func') as whale:
+        assert core_logic.evaluate_plan(plan, df, io_data['BTC/USDT']) == ['momentum_breakout']
+    squeeze.assert_not_called()
+    whale.assert_not_called() # (تأكيد واحد يكفي: لا تقييم للأغلى)
+    assert plan.io_needed(df, confirmed=1) == set()
+
+    # (استراتيجية ترمي استثناء تُتخطى: الأغلى بعدها ما زالت تُقيّم)
+    core_logic.STRATEGY_RESULTS.clear()
+    with patch.object(core_logic.STRATEGY_REGISTRY['momentum_breakout'], 'func', side_effect=TypeError("bad vwap")), \
+         patch.object(core_logic.STRATEGY_REGISTRY['whale_radar'], 'func', return_value={'reason': 'whale_radar'}):
+        assert core_logic.evaluate_plan(plan, df, io_data['BTC/USDT']) == ['whale_radar']
+
+def test_vector_engine_matches_per_symbol_strategies():
+    """إشارات المحرك المتجه تطابق الدوال الفردية على نفس الشموع."""
+    import numpy as np
+    import market_data, vector_engine
+    rng = np.random.default_rng(7)
+    candles = {}
+    for i in range(30):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 100)))
+        high, low = close * (1 + rng.uniform(0, 0.02, 100)), close * (1 - rng.uniform(0, 0.02, 100))
+        volume = rng.uniform(1, 100, 100)
+        candles[f"C{i}/USDT"] = [[t * 900_000, close[t], high[t], low[t], close[t], volume[t]] for t in range(100)]
+    snapshot = market_data.MarketSnapshot('15m', candles)
+    scanner = vector_engine.VectorScanner(vector_engine.OHLCVPanel.from_snapshot(snapshot))
+
+    for name in ["momentum_breakout", "breakout_squeeze_pro", "sniper_pro", "supertrend_pullback"]:
+        spec = core_logic.STRATEGY_REGISTRY[name]
+        mask = scanner.mask(name, {})
+        for symbol in snapshot.symbols:
+            expected = spec.evaluate(snapshot.frame(symbol), {}) is not None
+            assert bool(mask[scanner.panel.index[symbol]]) == expected, (name, symbol)
+
+    # (معاملات غير قابلة للتجزئة لا تُسقط المرور المتجه، ونفس القناع يُعاد لنفس المعاملات)
+    mask = scanner.mask("supertrend_pullback", {'atr_period': 10, 'sessions': ['london', 'ny']})
+    assert scanner.mask("supertrend_pullback", {'sessions': ['london', 'ny'], 'atr_period': 10}) is mask
+
 # =======================================================================================
 # --- 2. اختبار خادم الـ API (main.py V4) ---
 # =======================================================================================
@@ -196,3 +301,533 @@ async def test_api_link_telegram_account(client, mock_db_utils):
     
     # 4. التحقق من استدعاء DB
     db_utils.update_user_telegram_id.assert_called_once_with(SAMPLE_USER_ID, 123456789)
+
+# =======================================================================================
+# --- 3. اختبار بيانات السوق المشتركة (market_data.py) ---
+# =======================================================================================
+
+@pytest.mark.asyncio
+async def test_market_snapshot_fetches_each_symbol_once():
+    """لقطة الدورة تجلب كل رمز مرة واحدة وتتجاهل الرموز الفاشلة."""
+    import market_data
+    ohlcv = make_candles(60)
+    exchange = MagicMock()
+    exchange.fetch_ohlcv = AsyncMock(side_effect=[ohlcv, Exception("boom")])
+
+    snapshot = await market_data.build_market_snapshot(exchange, ["BTC/USDT", "ETH/USDT"], '15m', limit=100)
+
+    assert exchange.fetch_ohlcv.await_count == 2
+    assert snapshot.symbols == ("BTC/USDT",)
+    assert snapshot.key("BTC/USDT") == ("BTC/USDT", '15m', ohlcv[-1][0])
+    assert snapshot.frame("BTC/USDT") is snapshot.frame("BTC/USDT")
+    assert len(snapshot.frame("BTC/USDT")) == 60
+
+    # (مع candle_close: الرمز الذي لم تُرجع له شمعة الإغلاق بعد يُستبعد)
+    exchange.fetch_ohlcv = AsyncMock(side_effect=[ohlcv, ohlcv[:-1]])
+    snapshot = await market_data.build_market_snapshot(exchange, ["BTC/USDT", "ETH/USDT"], '15m', limit=100, candle_close=ohlcv[-1][0])
+    assert snapshot.symbols == ("BTC/USDT",)
+
+def test_next_candle_close_aligns_to_timeframe_boundaries():
+    """الماسح يستيقظ على حدود إغلاق الشموع (UTC) وليس بعد نوم ثابت."""
+    import market_data
+    close = 1_700_000_100.0 // 900 * 900 + 900
+    assert market_data.next_candle_close('15m', close - 0.5) == close
+    assert market_data.next_candle_close('15m', close) == close + 900
+    assert market_data.next_candle_close('1h', close) % 3600 == 0
+
+@pytest.mark.asyncio
+async def test_stream_snapshot_refetches_buffers_behind_candle_close():
+    """بث متأخر: الرمز الذي لم تصله شمعة الإغلاق يُجلب عبر REST، وما بقي متأخراً يُستبعد من الدورة."""
+    import market_data
+    candle_close = 1_700_000_000_000 + 60 * 900_000
+    fresh, behind = make_candles(61), make_candles(60) # (behind: آخر صف ما زال الشمعة التي أُغلقت للتو)
+    exchange = MagicMock(fetch_ohlcv=AsyncMock(side_effect=lambda symbol, timeframe, limit: fresh if symbol == 'ETH/USDT' else behind))
+    service = market_data.MarketDataService(exchange, timeframes=('15m',), limit=100)
+    for symbol, candles in (('BTC/USDT', fresh), ('ETH/USDT', behind), ('SOL/USDT', behind)):
+        service._buffers[(symbol, '15m')] = buffer = market_data.CandleRingBuffer(100)
+        buffer.extend(candles)
+
+    snapshot = await service.snapshot(['BTC/USDT', 'ETH/USDT', 'SOL/USDT'], '15m', candle_close)
+
+    assert snapshot.symbols == ('BTC/USDT', 'ETH/USDT') # (SOL ما زال متأخراً حتى عبر REST)
+    assert [call.args[0] for call in exchange.fetch_ohlcv.await_args_list] == ['ETH/USDT', 'SOL/USDT']
+    assert all(market_data.is_fresh(snapshot.ohlcv(s), '15m', candle_close) for s in snapshot.symbols)
+    assert len(await service.snapshot(['BTC/USDT', 'ETH/USDT', 'SOL/USDT'], '15m')) == 3 # (بدون candle_close: بلا فحص)
+
+def test_candle_ring_buffer_wraps_without_copy():
+    """الذاكرة الحلقية تحتفظ بآخر capacity شمعة كشريحة متصلة بدون نسخ."""
+    import numpy as np
+    import market_data
+    buffer = market_data.CandleRingBuffer(5)
+    for candle in make_candles(13, start=0):
+        buffer.append(tuple(candle))
+    buffer.update_last((12 * 900_000, 1, 3, 0.5, 2.5, 11))
+
+    view = buffer.view()
+    assert list(view[:, 0] // 900_000) == [8, 9, 10, 11, 12]
+    assert view[-1, 4] == 2.5
+    assert buffer.last_timestamp == 12 * 900_000
+    assert np.shares_memory(view, buffer.frame().values)
+
+def test_incremental_indicators_match_full_recompute():
+    """تقدّم المؤشرات شمعة بشمعة يطابق إعادة الحساب الكاملة بصيغ مرجعية صريحة (RMA = ewm(alpha=1/n))."""
+    import incremental_indicators
+    candles = [[1_700_000_000_000 + i * 900_000, 100 + i % 7, 102 + i % 5, 98 - i % 3, 100 + (i * 37) % 11, 10 + i] for i in range(80)]
+    df = candles_frame(candles)
+
+    # (مرجع مستقل عن نسخة pandas_ta المثبتة: كل نسخة تبذر RMA بطريقة مختلفة)
+    rma = lambda s: s.ewm(alpha=1 / 14, min_periods=14).mean()
+    def rsi(d):
+        change = d['close'].diff()
+        pos, neg = rma(change.clip(lower=0)), rma(change.clip(upper=0))
+        return 100 * pos / (pos + neg.abs())
+    def true_range(d):
+        prev_close = d['close'].shift()
+        return pd.concat([d['high'] - d['low'], (d['high'] - prev_close).abs(), (prev_close - d['low']).abs()], axis=1).max(axis=1, skipna=False)
+    atr = lambda d: rma(true_range(d))
+    def adx(d):
+        up, dn = d['high'].diff(), -d['low'].diff()
+        pos = up.where((up > dn) & (up > 0), 0.0).where(up.notna())
+        neg = dn.where((dn > up) & (dn > 0), 0.0).where(dn.notna())
+        k = 100 / atr(d)
+        dmp, dmn = k * rma(pos), k * rma(neg)
+        return rma(100 * (dmp - dmn).abs() / (dmp + dmn))
+
+    state = incremental_indicators.CandleIndicators.from_candles(candles[:-1])
+
+    assert state.last_timestamp == candles[-2][0]
+    assert state.rsi.value == pytest.approx(rsi(df.iloc[:-1]).iloc[-1])
+    assert state.atr.value == pytest.approx(atr(df.iloc[:-1]).iloc[-1])
+    assert state.atr.peek(*candles[-1][2:5]) == pytest.approx(atr(df).iloc[-1])
+    assert state.adx.peek(*candles[-1][2:5]) == pytest.approx(adx(df).iloc[-1])
+    assert state.atr.value == pytest.approx(atr(df.iloc[:-1]).iloc[-1]) # (peek لا يغير الحالة)
+
+def test_shared_candle_panel_round_trips_snapshot():
+    """لوحة الذاكرة المشتركة تعيد نفس شموع اللقطة للعمليات الفرعية (أطوال مختلفة)."""
+    import market_data
+    import process_engine
+    candles = {
+        "BTC/USDT": make_candles(60, start=0, trend=1),
+        "ETH/USDT": make_candles(40, start=0, close=2.5, trend=1, volume=20),
+    }
+    snapshot = market_data.MarketSnapshot('15m', candles)
+    panel = process_engine.SharedCandlePanel(snapshot)
+    try:
+        for symbol in candles:
+            df = process_engine._frame(panel.handle, symbol)
+            pd.testing.assert_frame_equal(df, snapshot.frame(symbol))
+            assert df.attrs['timeframe'] == '15m'
+    finally:
+        process_engine._ATTACHED.pop(panel.handle[0])[0].close()
+        panel.release()
+
+@pytest.mark.asyncio
+async def test_candle_cache_coalesces_and_expires_on_candle_close():
+    """الطلبات المتزامنة تنتظر جلباً واحداً، والسلسلة تنتهي صلاحيتها عند إغلاق الشمعة."""
+    import market_data
+    ohlcv = make_candles(100, start=0, step=3_600_000)
+    exchange = MagicMock()
+    exchange.fetch_ohlcv = AsyncMock(return_value=ohlcv)
+    cache = market_data.CandleCache(exchange, ttl=60)
+
+    with patch('market_data.time.time', return_value=7_200.0):
+        results = await asyncio.gather(*[cache.get("BTC/USDT", '1h', 100) for _ in range(5)])
+        assert len(await cache.get("BTC/USDT", '1h', 50)) == 50
+    with patch('market_data.time.time', return_value=7_250.0):
+        await cache.get("BTC/USDT", '1h', 100) # (ما زالت نفس الشمعة وضمن ttl)
+    with patch('market_data.time.time', return_value=10_800.0):
+        await cache.get("BTC/USDT", '1h', 100) # (شمعة 1h جديدة: جلب جديد)
+
+    assert all(r == ohlcv for r in results)
+    assert exchange.fetch_ohlcv.await_count == 2
+    assert cache.hits == 2
+
+@pytest.mark.asyncio
+async def test_depth_cache_shares_one_public_fetch():
+    """دفتر الأوامر يُجلب مرة واحدة عبر الاتصال العام ويُشارك حتى تنتهي صلاحيته."""
+    import market_data
+    exchange = MagicMock()
+    exchange.fetch_order_book = AsyncMock(return_value={'bids': [[1.0, 2.0]], 'asks': []})
+    depth = market_data.DepthCache(exchange, max_age=30, max_age_overrides={"ETH/USDT": 0})
+
+    books = await asyncio.gather(*[depth.get("BTC/USDT") for _ in range(5)])
+    await depth.get("BTC/USDT")
+    await depth.get("ETH/USDT")
+    await asyncio.sleep(0.01)
+    await depth.get("ETH/USDT")
+
+    assert all(book is books[0] for book in books)
+    assert exchange.fetch_order_book.await_count == 3 # (BTC مرة واحدة، ETH مرتان لأن صلاحيته 0)
+    assert depth.hits == 1
+
+@pytest.mark.asyncio
+async def test_candle_store_reads_from_disk_and_fetches_only_the_gap(tmp_path):
+    """الشموع المغلقة تُحفظ وتُقرأ بدون نسخ، والاستئناف يجلب الفجوة فقط."""
+    import time as time_module
+    import candle_store
+    store = candle_store.CandleStore(str(tmp_path))
+    step = 900_000
+    forming = int(time_module.time() * 1000) // step * step
+    candles = make_candles(121, start=forming - 120 * step, step=step) # (آخرها مفتوحة)
+
+    assert store.append('BTC/USDT', '15m', candles[:100]) == 100
+    assert store.append('BTC/USDT', '15m', candles[90:]) == 20 # (بدون تكرار، وبدون الشمعة المفتوحة)
+    view = store.read('BTC/USDT', '15m', limit=50)
+    assert view.shape == (50, 6) and view[-1, 0] == forming - step
+    assert not view.flags.owndata and not view.flags.writeable # (شريحة من memmap للقراءة فقط)
+
+    exchange = MagicMock(fetch_ohlcv=AsyncMock(return_value=[candles[-1]]))
+    ohlcv = await store.tail(exchange, 'BTC/USDT', '15m', 100)
+    exchange.fetch_ohlcv.assert_awaited_once_with('BTC/USDT', '15m', since=forming, limit=2)
+    assert len(ohlcv) == 100 and ohlcv[-1][0] == forming
+    warm = await store.tail(exchange, 'BTC/USDT', '15m', 100, include_forming=False)
+    assert len(warm) == 100 and warm[-1][0] == forming - step
+    assert exchange.fetch_ohlcv.await_count == 1 # (بدء دافئ: لا REST)
+
+    downloaded = await candle_store.download_history(store, exchange, ['BTC/USDT'], '15m', since=forming - 200 * step)
+    assert downloaded == {'BTC/USDT': 0} # (المخزن محدث: الاستئناف من آخر شمعة)
+
+def test_ticker_subscriptions_follow_open_trade_symbols():
+    """العيون تشترك فقط برموز الصفقات المفتوحة وتضيف/تزيل البث على نفس الاتصال."""
+    import json, market_data
+    exchange = MagicMock()
+    exchange.markets = {'BTC/USDT': {'id': 'BTCUSDT'}, 'ETH/USDT': {'id': 'ETHUSDT'}, '1000SATS/USDT': {'id': '1000SATSUSDT'}}
+    subscriptions = market_data.TickerSubscriptions(exchange, 'miniTicker')
+
+    sent = [json.loads(m) for m in subscriptions.sync(['BTC/USDT', 'ETH/USDT', 'NOPE/USDT'])]
+    assert [(m['method'], m['params']) for m in sent] == [("SUBSCRIBE", ['btcusdt@miniTicker', 'ethusdt@miniTicker'])]
+    assert subscriptions.sync({'ETH/USDT', 'BTC/USDT', 'NOPE/USDT'}) == [] # (نفس الرموز: لا رسائل)
+
+    sent = [json.loads(m) for m in subscriptions.sync(['ETH/USDT', '1000SATS/USDT'])]
+    assert [(m['method'], m['params']) for m in sent] == [("UNSUBSCRIBE", ['btcusdt@miniTicker']), ("SUBSCRIBE", ['1000satsusdt@miniTicker'])]
+    assert len(subscriptions) == 2
+
+    assert subscriptions.price({'stream': '1000satsusdt@miniTicker', 'data': {'s': '1000SATSUSDT', 'c': '0.00031'}}) == ('1000SATS/USDT', 0.00031)
+    assert subscriptions.price({'stream': 'btcusdt@miniTicker', 'data': {'c': '1'}}) is None # (أُلغي الاشتراك)
+    assert subscriptions.price({'result': None, 'id': 2}) is None
+
+    book = market_data.TickerSubscriptions(exchange, 'bookTicker')
+    book.sync(['ETH/USDT'])
+    assert book.price({'stream': 'ethusdt@bookTicker', 'data': {'b': '2500.5', 'a': '2500.6'}}) == ('ETH/USDT', 2500.5)
+
+def test_ticker_decoder_maps_ids_and_parses_only_watched_symbols():
+    """خريطة id→رمز من الأسواق (لا استبدال 'USDT' نصياً)، وفك العناصر المطلوبة فقط (نص أو bytes)."""
+    import json, market_data
+    markets = {'BTC/USDT': {'id': 'BTCUSDT', 'spot': True}, 'USDT/TRY': {'id': 'USDTTRY', 'spot': True},
+               'BTC/USDT:USDT': {'id': 'BTCUSDT', 'spot': False}, 'ETH/USDT': {'id': 'ETHUSDT', 'spot': True}}
+    decoder = market_data.TickerDecoder(markets)
+    assert decoder.id_to_symbol == {'BTCUSDT': 'BTC/USDT', 'USDTTRY': 'USDT/TRY', 'ETHUSDT': 'ETH/USDT'}
+
+    message = json.dumps([
+        {"e": "24hrMiniTicker", "E": 1, "s": "BTCUSDT", "c": "65000.10", "o": "1", "h": "2", "l": "0.5", "v": "1", "q": "1"},
+        {"e": "24hrMiniTicker", "E": 1, "s": "ETHUSDT", "c": "not-a-number"}, # (غير مراقب: لا يُحوّل أبداً)
+        {"e": "24hrMiniTicker", "E": 1, "s": "USDTTRY", "c": "34.2"},
+        {"e": "24hrMiniTicker", "E": 1, "s": "NEWCOINUSDT", "c": "1"},
+    ])
+    wanted = {'BTC/USDT', 'USDT/TRY', 'SOL/USDT'}
+    assert decoder.prices(message, wanted) == [('BTC/USDT', 65000.1), ('USDT/TRY', 34.2)]
+    assert decoder.prices(message.encode(), wanted) == [('BTC/USDT', 65000.1), ('USDT/TRY', 34.2)]
+    assert decoder.prices(message, set()) == []
+
+@pytest.mark.asyncio
+async def test_latest_price_queue_conflates_ticks_behind_slow_evaluators():
+    """القارئ لا ينتظر، والمقيّم البطيء يعمل دائماً بأحدث سعر (الوسيطة تُسقط وتُعد)، ونفس الرمز لا يُقيّم مرتين معاً."""
+    import market_data
+    queue = market_data.LatestPriceQueue()
+    evaluated, running, release = [], set(), asyncio.Event()
+
+    async def evaluator():
+        while True:
+            symbol, price = await queue.get()
+            assert symbol not in running
+            running.add(symbol)
+            evaluated.append((symbol, price))
+            await release.wait() # (إدارة بطيئة: await db_utils...)
+            running.discard(symbol)
+            queue.done(symbol)
+
+    workers = [asyncio.create_task(evaluator()) for _ in range(2)]
+    queue.put('BTC/USDT', 100.0)
+    await asyncio.sleep(0)
+    for price in (101.0, 102.0, 103.0): # (وصلت أثناء تقييم BTC: تبقى آخرها فقط)
+        queue.put('BTC/USDT', price)
+    queue.put('ETH/USDT', 10.0)
+    await asyncio.sleep(0)
+    assert evaluated == [('BTC/USDT', 100.0), ('ETH/USDT', 10.0)]
+    assert queue.metrics() == {"depth": 1, "in_flight": 2, "received": 5, "dropped": 2, "processed": 0}
+
+    release.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert evaluated[2:] == [('BTC/USDT', 103.0)]
+    assert queue.metrics() == {"depth": 0, "in_flight": 0, "received": 5, "dropped": 2, "processed": 3}
+    for worker in workers:
+        worker.cancel()
+
+# =======================================================================================
+# --- 4. اختبار أدوات قاعدة البيانات للعامل (db_utils.py) ---
+# =======================================================================================
+
+@pytest.mark.asyncio
+async def test_worker_user_contexts_single_round_trip(mocker):
+    """سياق كل المستخدمين يُحمّل في استعلام واحد ويُحوّل للنماذج الصحيحة."""
+    import json
+    from contextlib import asynccontextmanager
+    settings = {field: 1 for field in TradingVariables.model_fields}
+    settings.update(user_id=str(SAMPLE_USER_ID), signal_sensitivity="medium", base_currency="USDT",
+                    pattern_sensitivity="medium", market_sessions=["Asian"], id=7, updated_at="2024-01-01")
+    conn = MagicMock()
+    conn.fetch = AsyncMock(return_value=[{
+        'user_id': SAMPLE_USER_ID,
+        'settings': json.dumps(settings),
+        'strategies': json.dumps([{'strategy_name': 'sniper_pro', 'parameters': None}]),
+        'keys': json.dumps({'api_key_encrypted': 'k_encrypted', 'api_secret_encrypted': 's_encrypted', 'passphrase_encrypted': None}),
+        'open_trades': json.dumps({'42': 'BTC/USDT'}),
+    }])
+
+    @asynccontextmanager
+    async def fake_connection():
+        yield conn
+    mocker.patch('db_utils.db_connection', fake_connection)
+
+    contexts = await db_utils.get_worker_user_contexts([SAMPLE_USER_ID])
+
+    assert conn.fetch.await_count == 1
+    context = contexts[SAMPLE_USER_ID]
+    assert context.settings.market_sessions == ["Asian"]
+    assert context.strategies[0].strategy_name == 'sniper_pro' and context.strategies[0].parameters == {}
+    assert context.keys.api_key == 'k'
+    assert context.open_trades == {42: 'BTC/USDT'}
+
+# =======================================================================================
+# --- 5. اختبار جدولة طلبات المنصة (request_scheduler.py) ---
+# =======================================================================================
+
+@pytest.mark.asyncio
+async def test_scheduler_keeps_reserve_for_closes():
+    """الفحص لا يستهلك الاحتياطي: طلب الإغلاق يمر بينما ينتظر الفحص امتلاء الدلو."""
+    import request_scheduler as rs
+    scheduler = rs.RequestScheduler(ip_weight_per_minute=60)
+    granted = []
+
+    async def request(name, priority, weight):
+        await scheduler.acquire(weight, priority=priority)
+        granted.append(name)
+
+    scans = [asyncio.create_task(request(f"scan{i}", rs.PRIORITY_SCAN, 20)) for i in range(3)]
+    await asyncio.sleep(0.01)
+    close = asyncio.create_task(request("close", rs.PRIORITY_CLOSE, 5))
+    await asyncio.wait_for(close, timeout=1)
+
+    assert granted == ["scan0", "scan1", "close"]
+    metrics = scheduler.metrics()
+    assert metrics["queued"]["scan"] == 1 and metrics["granted"]["close"] == 1
+    for task in scans:
+        task.cancel()
+
+# =======================================================================================
+# --- 6. اختبار شظايا الماسح (sharding.py) ---
+# =======================================================================================
+
+@pytest.mark.asyncio
+async def test_scanner_shards_split_users_and_share_snapshot(mocker):
+    """كل مستخدم لشظية واحدة، إضافة شظية تنقل جزءاً فقط، واللقطة المنشورة تُقرأ كما هي."""
+    import sharding, market_data
+    users = [uuid4() for _ in range(2000)]
+    two = sharding.HashRing(["a", "b"])
+    three = sharding.HashRing(["a", "b", "c"])
+    owners = {u: two.owner(u) for u in users}
+    assert set(owners.values()) == {"a", "b"}
+    moved = [u for u in users if three.owner(u) != owners[u]]
+    assert all(three.owner(u) == "c" for u in moved) # (لا تنقلات بين الشظايا القديمة)
+    assert len(moved) < len(users) / 2
+
+    universe = market_data.MarketUniverse([market_data.SymbolMeta(symbol="BTC/USDT", min_notional=5.0)])
+    snapshot = market_data.MarketSnapshot('15m', {"BTC/USDT": make_candles(60, start=0)})
+    published = {}
+
+    async def save(timeframe, candle_close, universe_records, candles, shard_ids):
+        published[(timeframe, candle_close)] = {"universe": universe_records, "candles": candles, "shard_ids": shard_ids}
+    mocker.patch('db_utils.get_live_scanner_shards', AsyncMock(return_value=["b"]))
+    mocker.patch('db_utils.save_market_snapshot', side_effect=save)
+    mocker.patch('db_utils.get_market_snapshot', AsyncMock(side_effect=lambda tf, close: published.get((tf, close))))
+
+    primary, shard = sharding.ShardCoordinator("a"), sharding.ShardCoordinator("b")
+    await primary.publish_snapshot(900_000, universe, snapshot)
+    shared_universe, shared_snapshot = await shard.wait_for_snapshot('15m', 900_000, timeout=1)
+
+    assert shared_universe.meta("BTC/USDT").min_notional == 5.0
+    assert (shared_snapshot.ohlcv("BTC/USDT") == snapshot.ohlcv("BTC/USDT")).all()
+    assert all(primary.owns(u) != shard.owns(u) for u in users)
+
+    # (الشظايا على نفس الـ IP: كل واحدة تأخذ نصف ميزانية الوزن)
+    import request_scheduler
+    scheduler = request_scheduler.RequestScheduler(ip_weight_per_minute=6000)
+    mocker.patch.object(request_scheduler, 'SCHEDULER', scheduler)
+    await shard.wait_for_snapshot('15m', 900_000, timeout=1)
+    assert scheduler.shares == 2 and scheduler.ip.capacity == 3000 and scheduler.ip.tokens <= 3000
+
+@pytest.mark.asyncio
+async def test_leader_runs_singletons_only_while_holding_lock(mocker):
+    """العيون تعمل في القائد فقط وتُلغى فور سقوط اتصال القفل (لتتولاها نسخة أخرى)."""
+    import sharding
+    mocker.patch.object(sharding, 'LEADER_CHECK_SECONDS', 0.01)
+    mocker.patch.object(sharding, 'LEADER_RETRY_SECONDS', 0.01)
+    conn = MagicMock(fetchval=AsyncMock(side_effect=[1, ConnectionError("lock connection lost")]), close=AsyncMock())
+    conn.is_closed.return_value = False
+    mocker.patch('db_utils.open_dedicated_connection', AsyncMock(return_value=conn))
+    lock = mocker.patch('db_utils.try_advisory_lock', AsyncMock(side_effect=[False, True] + [False] * 100))
+    leader = sharding.LeaderElection("eyes", "worker-a")
+    running, stopped = asyncio.Event(), asyncio.Event()
+
+    async def eyes():
+        running.set()
+        try:
+            await asyncio.sleep(10)
+        finally:
+            stopped.set()
+
+    election = asyncio.create_task(leader.run(eyes))
+    await asyncio.wait_for(running.wait(), timeout=1)
+    assert leader.is_leader
+    await asyncio.wait_for(stopped.wait(), timeout=1)
+    await asyncio.sleep(0.05)
+    assert not leader.is_leader # (فقد القفل: احتياط حتى يناله مجدداً)
+    assert lock.await_count >= 3
+    election.cancel()
+
+@pytest.mark.asyncio
+async def test_leader_steps_down_as_soon_as_lock_connection_drops(mocker):
+    """انقطاع اتصال القفل يلغي المكونات فوراً دون انتظار الفحص الدوري، و confirm() يرفض بعده."""
+    import sharding
+    mocker.patch.object(sharding, 'LEADER_CHECK_SECONDS', 10)
+    mocker.patch.object(sharding, 'LEADER_RETRY_SECONDS', 10)
+    listeners = []
+    conn = MagicMock(fetchval=AsyncMock(return_value=1), close=AsyncMock())
+    conn.is_closed.return_value = False
+    conn.add_termination_listener.side_effect = listeners.append
+    mocker.patch('db_utils.open_dedicated_connection', AsyncMock(return_value=conn))
+    mocker.patch('db_utils.try_advisory_lock', AsyncMock(return_value=True))
+    leader = sharding.LeaderElection("eyes", "worker-a")
+    running, stopped = asyncio.Event(), asyncio.Event()
+
+    async def eyes():
+        running.set()
+        try:
+            await asyncio.sleep(60)
+        finally:
+            stopped.set()
+
+    election = asyncio.create_task(leader.run(eyes))
+    await asyncio.wait_for(running.wait(), timeout=1)
+    assert await leader.confirm()
+
+    conn.is_closed.return_value = True
+    listeners[0](conn)
+    assert not leader.is_leader
+    assert not await leader.confirm()
+    await asyncio.wait_for(stopped.wait(), timeout=1) # (قبل LEADER_CHECK_SECONDS بكثير)
+    election.cancel()
+
+# =======================================================================================
+# --- 7. اختبار فهرس عتبات العيون (trade_index.py) ---
+# =======================================================================================
+
+def test_threshold_index_touches_only_crossed_trades():
+    """التيك يعيد فقط الصفقات التي عُبرت عتباتها، وتحديث الوقف المتحرك يُبقي الفهرس متسقاً."""
+    import trade_index
+    index = trade_index.ThresholdIndex()
+    trades = [{'id': i, 'symbol': 'BTC/USDT', 'take_profit': 100 + i, 'stop_loss': 90 - i} for i in range(100)]
+    for trade in trades:
+        index.set(trade, trade['take_profit'], trade['stop_loss'])
+
+    assert index.crossed('BTC/USDT', 95) == []
+    assert [t['id'] for t in index.crossed('BTC/USDT', 102)] == [0, 1, 2]
+    assert [t['id'] for t in index.crossed('BTC/USDT', 88)] == [2, 1, 0]
+    assert index.crossed('ETH/USDT', 1) == []
+
+    trades[50]['stop_loss'] = 97 # (وقف متحرك رُفع)
+    index.set(trades[50], trades[50]['take_profit'], trades[50]['stop_loss'])
+    assert [t['id'] for t in index.crossed('BTC/USDT', 96)] == [50]
+    assert index.levels(50) == (150, 97) and len(index) == 100
+
+    for trade in trades:
+        index.discard(trade['id'])
+    assert 'BTC/USDT' not in index and len(index) == 0
+
+@pytest.mark.asyncio
+async def test_write_behind_merges_ticks_into_one_batched_update(mocker):
+    """عدة تيكات لنفس الصفقة = صف واحد بآخر القيم في UPDATE واحد، والفشل لا يضيع شيئاً."""
+    import write_behind
+    flush = mocker.patch('db_utils.flush_trade_updates', new_callable=AsyncMock, side_effect=[Exception("db down"), 2])
+    writes = write_behind.TradeWriteBehind()
+    writes.set(1, highest_price=101.0)
+    writes.set(1, highest_price=103.0, stop_loss=99.0)
+    writes.set(1, highest_price=102.0, stop_loss=98.0) # (لا ينزلان)
+    writes.set(2, trailing_sl_active=True, stop_loss=50.5)
+
+    assert await writes.flush() == 0 # (فشل: يبقى معلقاً)
+    writes.set(1, last_profit_notification_price=104.0)
+    trade = writes.apply({'id': 1, 'highest_price': 100.0, 'stop_loss': 95.0, 'last_profit_notification_price': None})
+    assert trade['highest_price'] == 103.0 and trade['stop_loss'] == 99.0 and trade['last_profit_notification_price'] == 104.0
+
+    assert await writes.flush() == 2
+    assert flush.await_count == 2
+    assert flush.await_args.args[0] == {
+        1: {'highest_price': 103.0, 'stop_loss': 99.0, 'last_profit_notification_price': 104.0},
+        2: {'trailing_sl_active': True, 'stop_loss': 50.5},
+    }
+    assert len(writes) == 0 and await writes.flush() == 0 and flush.await_count == 2
+
+    # (المزامنة قرأت الصف قبل تيك أحدث كُتب بالفعل: القيم الحية في الذاكرة لا تُفقد)
+    reloaded = write_behind.merge_live({'id': 1, 'highest_price': 100.0, 'stop_loss': 95.0, 'trailing_sl_active': False},
+                                       {'id': 1, 'highest_price': 110.0, 'stop_loss': 104.5, 'trailing_sl_active': True})
+    assert (reloaded['highest_price'], reloaded['stop_loss'], reloaded['trailing_sl_active']) == (110.0, 104.5, True)
+
+# =======================================================================================
+# --- 8. اختبار الأيدي (bot_worker.py) ---
+# =======================================================================================
+
+@pytest.mark.asyncio
+async def test_hands_skip_trades_whose_claim_expired_mid_batch(mocker):
+    """مطالبة انتهت أثناء إغلاق بطيء وأخذتها نسخة أخرى: لا تُباع مرتين."""
+    mocker.patch.object(db_utils, 'UserSettings', BotSettings, create=True) # (اسم قديم يستورده bot_worker)
+    import bot_worker
+    # (جدول صفقات في الذاكرة بنفس شروط claim_trades_for_closure / start_trade_closure)
+    trades = {i: {'id': i, 'user_id': SAMPLE_USER_ID, 'symbol': 'BTC/USDT', 'status': 'closing_tp', 'quantity': 1.0,
+                  'entry_price': 100.0, 'claimed_by': None, 'expired': False} for i in (1, 2, 3)}
+
+    async def claim(worker_id, limit, timeout):
+        rows = [t for t in trades.values() if t['status'].startswith('closing_') and t['status'] != 'closing_inflight'
+                and (t['claimed_by'] is None or t['expired'])][:limit]
+        for t in rows:
+            t['claimed_by'], t['expired'] = worker_id, False
+        return [dict(t) for t in rows]
+
+    async def start(trade_id, worker_id):
+        t = trades[trade_id]
+        if t['claimed_by'] != worker_id or t['status'] == 'closing_inflight':
+            return False
+        t['status'] = 'closing_inflight'
+        return True
+
+    async def slow_sell(symbol, quantity):
+        # (البيع الأول بطيء: انتهت مطالبات بقية الدفعة، ونسخة أخرى طالبت بها)
+        if not trades[2]['expired'] and trades[2]['claimed_by'] == 'worker-a':
+            for t in trades.values():
+                t['expired'] = True
+            assert [t['id'] for t in await claim('worker-b', 20, 120)] == [2, 3] # (1 قيد البيع: لا تُطالب)
+
+    exchange = MagicMock(create_market_sell_order=AsyncMock(side_effect=slow_sell))
+    mocker.patch.object(bot_worker, 'WORKER_ID', 'worker-a')
+    mocker.patch.object(bot_worker, 'get_user_exchange', AsyncMock(return_value=exchange))
+    mocker.patch.object(bot_worker, 'get_user_settings', AsyncMock(return_value=None))
+    mocker.patch.object(bot_worker, 'PUBLIC_EXCHANGE', MagicMock(fetch_ticker=AsyncMock(return_value={'last': 110.0}), market=AsyncMock(return_value={})))
+    mocker.patch('db_utils.start_trade_closure', side_effect=start)
+    mocker.patch('db_utils.close_trade', AsyncMock(return_value=None))
+    mocker.patch('db_utils.create_notification', AsyncMock())
+
+    await bot_worker._close_flagged_trades(await claim('worker-a', 20, 120))
+
+    assert exchange.create_market_sell_order.await_count == 1 # (2 و 3 انتقلتا لـ worker-b ولم تُباعا هنا)
+    assert trades[1]['status'] == 'closing_inflight' and trades[2]['claimed_by'] == trades[3]['claimed_by'] == 'worker-b'
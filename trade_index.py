@@ -0,0 +1,77 @@
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# =======================================================================================
+# --- فهرس العتبات المرتبة لـ "العيون" (Threshold Index) ---
+#
+# لكل رمز قائمتان مرتبتان: عتبات صاعدة (تُطلق عند السعر >= العتبة) وعتبات هابطة
+# (تُطلق عند السعر <= العتبة). كل صفقة لها عتبة واحدة في كل قائمة = أقرب سعر يغير
+# شيئاً فيها (TP/SL + إدارة الصفقة). التيك يلمس فقط الصفقات التي عُبرت عتباتها (bisect)،
+# وبعد معالجتها تُعاد فهرستها بعتباتها الجديدة.
+# =======================================================================================
+
+_Entry = Tuple[float, int] # (العتبة، رقم الصفقة)
+
+
+class ThresholdIndex:
+    """(V6) عتبات صاعدة/هابطة مرتبة لكل رمز، مع الصفقات نفسها (نفس قواميس مخبأ العيون)."""
+
+    def __init__(self):
+        self._upper: Dict[str, List[_Entry]] = {}
+        self._lower: Dict[str, List[_Entry]] = {}
+        self._trades: Dict[int, Tuple[Dict, float, float]] = {} # {رقم الصفقة: (الصفقة، الصاعدة، الهابطة)}
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._upper
+
+    def __len__(self) -> int:
+        return len(self._trades)
+
+    def get(self, trade_id: int) -> Optional[Dict]:
+        entry = self._trades.get(trade_id)
+        return entry[0] if entry else None
+
+    def levels(self, trade_id: int) -> Tuple[float, float]:
+        _, upper, lower = self._trades[trade_id]
+        return upper, lower
+
+    def set(self, trade: Dict, upper: float, lower: float):
+        """يضيف الصفقة أو يحدّث عتباتها (بعد أي تغيير في TP/SL/الوقف المتحرك...)."""
+        self.discard(trade['id'])
+        symbol = trade['symbol']
+        bisect.insort(self._upper.setdefault(symbol, []), (upper, trade['id']))
+        bisect.insort(self._lower.setdefault(symbol, []), (lower, trade['id']))
+        self._trades[trade['id']] = (trade, upper, lower)
+
+    def discard(self, trade_id: int):
+        entry = self._trades.pop(trade_id, None)
+        if entry is None:
+            return
+        trade, upper, lower = entry
+        symbol = trade['symbol']
+        for levels, level in ((self._upper[symbol], upper), (self._lower[symbol], lower)):
+            i = bisect.bisect_left(levels, (level, trade_id))
+            if i < len(levels) and levels[i] == (level, trade_id):
+                del levels[i]
+        if not self._upper[symbol]:
+            del self._upper[symbol], self._lower[symbol]
+
+    def crossed(self, symbol: str, price: float) -> List[Dict]:
+        """الصفقات التي عبر السعر إحدى عتباتها (بدون إزالتها). O(log n + k)."""
+        upper, lower = self._upper.get(symbol), self._lower.get(symbol)
+        if not upper:
+            return []
+        hit = [trade_id for _, trade_id in upper[:bisect.bisect_right(upper, (price, float('inf')))]]
+        seen = set(hit)
+        hit += [trade_id for _, trade_id in lower[bisect.bisect_left(lower, (price, float('-inf'))):] if trade_id not in seen]
+        return [self._trades[trade_id][0] for trade_id in hit]
+
+    def rebuild(self, trades: Iterable[Tuple[Dict, float, float]]):
+        """يعيد بناء الفهرس بالكامل (بعد مزامنة المخبأ)."""
+        self._upper, self._lower, self._trades = {}, {}, {}
+        for trade, upper, lower in trades:
+            self._trades[trade['id']] = (trade, upper, lower)
+            self._upper.setdefault(trade['symbol'], []).append((upper, trade['id']))
+            self._lower.setdefault(trade['symbol'], []).append((lower, trade['id']))
+        for levels in (*self._upper.values(), *self._lower.values()):
+            levels.sort()
@@ -0,0 +1,269 @@
+import json
+import logging
+from typing import Dict, List, Optional, Tuple, Any
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- محرك الفحص المتجه (Vectorized Scanner Engine) ---
+#
+# بدلاً من DataFrame لكل رمز + pandas_ta لكل رمز، نكدّس شموع كل الرموز في
+# مصفوفات ثنائية الأبعاد (الرموز × الشموع) ونحسب المؤشرات عمودياً لكل الرموز
+# دفعة واحدة. شروط الدخول في core_logic تُقيّم كأقنعة منطقية (Boolean masks).
+#
+# المؤشرات هنا تطابق صيغ pandas_ta (نفس البذرة SMA للـ EMA، نفس RMA المعدّل
+# للـ RSI/ATR، نفس ddof=0 للبولنجر)، حتى تتطابق الإشارات مع الدوال الفردية.
+# =======================================================================================
+
+class OHLCVPanel:
+    """(V6) شموع عدة رموز مكدسة في مصفوفات float64 بشكل (الرموز، الشموع)."""
+
+    def __init__(self, symbols: List[str], candles: np.ndarray):
+        # candles: (S, N, 6) -> timestamp, open, high, low, close, volume
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.candles = candles
+        self.timestamp = candles[:, :, 0]
+        self.open = candles[:, :, 1]
+        self.high = candles[:, :, 2]
+        self.low = candles[:, :, 3]
+        self.close = candles[:, :, 4]
+        self.volume = candles[:, :, 5]
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def length(self) -> int:
+        return self.candles.shape[1]
+
+    @classmethod
+    def from_snapshot(cls, snapshot, length: Optional[int] = None) -> "OHLCVPanel":
+        """
+        يبني اللوحة من MarketSnapshot. الرموز التي لديها شموع أقل من length
+        تُستبعد (وتبقى على المسار الفردي)، والأطول تُقص لآخر length شمعة.
+        """
+        series = {s: snapshot.ohlcv(s) for s in snapshot.symbols}
+        if length is None:
+            length = max((len(c) for c in series.values()), default=0)
+        symbols = [s for s, c in series.items() if length and len(c) >= length]
+        candles = np.empty((len(symbols), length, 6), dtype=np.float64)
+        for i, s in enumerate(symbols):
+            candles[i] = np.asarray(series[s][-length:], dtype=np.float64)
+        return cls(symbols, candles)
+
+# =======================================================================================
+# --- المؤشرات (على المحور الزمني axis=1) ---
+# =======================================================================================
+
+def _ewm(x: np.ndarray, alpha: float, adjust: bool, min_periods: int = 0) -> np.ndarray:
+    """نفس خوارزمية pandas ewm().mean() (ignore_na=False) لكل صف."""
+    S, N = x.shape
+    out = np.full((S, N), np.nan)
+    weighted = np.full(S, np.nan)
+    old_wt = np.ones(S)
+    nobs = np.zeros(S, dtype=np.int64)
+    factor = 1.0 - alpha
+    new_wt = 1.0 if adjust else alpha
+    for t in range(N):
+        cur = x[:, t]
+        is_obs = ~np.isnan(cur)
+        nobs += is_obs
+        started = ~np.isnan(weighted)
+        old_wt = np.where(started, old_wt * factor, old_wt)
+        upd = started & is_obs
+        weighted = np.where(upd, (old_wt * weighted + new_wt * np.where(is_obs, cur, 0.0)) / (old_wt + new_wt), weighted)
+        if adjust:
+            old_wt = np.where(upd, old_wt + new_wt, old_wt)
+        else:
+            old_wt = np.where(upd, 1.0, old_wt)
+        first = ~started & is_obs
+        weighted = np.where(first, cur, weighted)
+        old_wt = np.where(first, 1.0, old_wt)
+        out[:, t] = np.where(nobs >= max(min_periods, 1), weighted, np.nan)
+    return out
+
+def ema(x: np.ndarray, length: int, start: int = 0) -> np.ndarray:
+    """pandas_ta.ema (sma=True): بذرة SMA لأول length قيمة ثم EWM غير معدّل."""
+    seeded = np.full_like(x, np.nan)
+    if x.shape[1] < start + length:
+        return seeded
+    seeded[:, start + length - 1] = np.nanmean(x[:, start:start + length], axis=1)
+    seeded[:, start + length:] = x[:, start + length:]
+    return _ewm(seeded, 2.0 / (length + 1), adjust=False)
+
+def rma(x: np.ndarray, length: int) -> np.ndarray:
+    """pandas_ta.rma: ewm(alpha=1/length, min_periods=length) المعدّل."""
+    return _ewm(x, 1.0 / length, adjust=True, min_periods=length)
+
+def sma(x: np.ndarray, length: int) -> np.ndarray:
+    out = np.full_like(x, np.nan)
+    if x.shape[1] >= length:
+        out[:, length - 1:] = sliding_window_view(x, length, axis=1).mean(axis=2)
+    return out
+
+def rolling_std(x: np.ndarray, length: int, ddof: int = 0) -> np.ndarray:
+    out = np.full_like(x, np.nan)
+    if x.shape[1] >= length:
+        out[:, length - 1:] = sliding_window_view(x, length, axis=1).std(axis=2, ddof=ddof)
+    return out
+
+def _shift(x: np.ndarray, n: int = 1) -> np.ndarray:
+    out = np.full_like(x, np.nan)
+    out[:, n:] = x[:, :-n]
+    return out
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev_close = _shift(close)
+    tr = np.fmax(np.abs(high - low), np.fmax(np.abs(high - prev_close), np.abs(prev_close - low)))
+    tr[:, 0] = np.nan
+    return tr
+
+def rsi(close: np.ndarray, length: int = 14) -> np.ndarray:
+    change = close - _shift(close)
+    positive = np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0))
+    negative = np.where(change < 0, change, np.where(np.isnan(change), np.nan, 0.0))
+    positive_avg, negative_avg = rma(positive, length), rma(negative, length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100.0 * positive_avg / (positive_avg + np.abs(negative_avg))
+
+def bbands(close: np.ndarray, length: int = 20, std: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """يعيد (lower, mid, upper)."""
+    mid = sma(close, length)
+    deviation = rolling_std(close, length, ddof=0)
+    return mid - std * deviation, mid, mid + std * deviation
+
+def kc(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int = 20, scalar: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keltner (mamode=ema, tr=True). يعيد (lower, basis, upper)."""
+    basis = ema(close, length)
+    band = ema(true_range(high, low, close), length)
+    return basis - scalar * band, basis, basis + scalar * band
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int = 14) -> np.ndarray:
+    return rma(true_range(high, low, close), length)
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """يعيد (macd, histogram, signal)."""
+    macd_line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(macd_line, signal, start=slow - 1)
+    return macd_line, macd_line - signal_line, signal_line
+
+def obv(close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+    sign = np.sign(close - _shift(close))
+    sign[:, 0] = 1.0
+    return np.cumsum(sign * volume, axis=1)
+
+def supertrend(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int = 7, multiplier: float = 3.0) -> Tuple[np.ndarray, np.ndarray]:
+    """يعيد (trend, direction) بنفس حلقة pandas_ta (متجهة عبر الرموز)."""
+    S, N = close.shape
+    hl2 = 0.5 * (high + low)
+    matr = multiplier * atr(high, low, close, length)
+    upper, lower = hl2 + matr, hl2 - matr
+    direction = np.ones((S, N))
+    trend = np.full((S, N), np.nan)
+    for i in range(1, N):
+        up_break = close[:, i] > upper[:, i - 1]
+        down_break = ~up_break & (close[:, i] < lower[:, i - 1])
+        hold = ~up_break & ~down_break
+        direction[:, i] = np.where(up_break, 1.0, np.where(down_break, -1.0, direction[:, i - 1]))
+        keep_lower = hold & (direction[:, i] > 0) & (lower[:, i] < lower[:, i - 1])
+        keep_upper = hold & (direction[:, i] < 0) & (upper[:, i] > upper[:, i - 1])
+        lower[:, i] = np.where(keep_lower, lower[:, i - 1], lower[:, i])
+        upper[:, i] = np.where(keep_upper, upper[:, i - 1], upper[:, i])
+        trend[:, i] = np.where(direction[:, i] > 0, lower[:, i], upper[:, i])
+    return trend, direction
+
+def vwap_daily(timestamp: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+    """VWAP مثبت يومياً (UTC) مثل VWAP_D."""
+    typical = (high + low + close) / 3.0
+    day = (timestamp // 86_400_000).astype(np.int64)
+    new_day = np.ones_like(day, dtype=bool)
+    new_day[:, 1:] = day[:, 1:] != day[:, :-1]
+    wp, vol = typical * volume, volume.copy()
+    cum_wp, cum_vol = np.empty_like(wp), np.empty_like(vol)
+    cum_wp[:, 0], cum_vol[:, 0] = wp[:, 0], vol[:, 0]
+    for t in range(1, wp.shape[1]):
+        cum_wp[:, t] = np.where(new_day[:, t], wp[:, t], cum_wp[:, t - 1] + wp[:, t])
+        cum_vol[:, t] = np.where(new_day[:, t], vol[:, t], cum_vol[:, t - 1] + vol[:, t])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cum_wp / cum_vol
+
+# =======================================================================================
+# --- شروط الدخول كأقنعة (نفس منطق core_logic.analyze_*) ---
+# (العمود -2 = آخر شمعة مغلقة، -3 = التي قبلها)
+# =======================================================================================
+
+def mask_momentum_breakout(p: OHLCVPanel, params: dict) -> np.ndarray:
+    _, _, bbu = bbands(p.close, 20)
+    macd_line, _, signal_line = macd(p.close)
+    rsi_v = rsi(p.close)
+    vwap_v = vwap_daily(p.timestamp, p.high, p.low, p.close, p.volume)
+    close = p.close[:, -2]
+    return ((macd_line[:, -3] <= signal_line[:, -3]) & (macd_line[:, -2] > signal_line[:, -2])
+            & (close > bbu[:, -2]) & (close > vwap_v[:, -2]) & (rsi_v[:, -2] < 68))
+
+def mask_breakout_squeeze_pro(p: OHLCVPanel, params: dict) -> np.ndarray:
+    bbl, _, bbu = bbands(p.close, 20)
+    kcl, _, kcu = kc(p.high, p.low, p.close, 20, 1.5)
+    obv_v = obv(p.close, p.volume)
+    in_squeeze = (bbl[:, -3] > kcl[:, -3]) & (bbu[:, -3] < kcu[:, -3])
+    return (in_squeeze & (p.close[:, -2] > bbu[:, -2])
+            & (p.volume[:, -2] > sma(p.volume, 20)[:, -2] * 1.5) & (obv_v[:, -2] > obv_v[:, -3]))
+
+def mask_sniper_pro(p: OHLCVPanel, params: dict) -> np.ndarray:
+    compression_candles = 24
+    if p.length < compression_candles + 2:
+        return np.zeros(len(p), dtype=bool)
+    window = slice(-compression_candles - 1, -1)
+    highest_high, lowest_low = p.high[:, window].max(axis=1), p.low[:, window].min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volatility = (highest_high - lowest_low) / lowest_low * 100
+    return ((lowest_low > 0) & (volatility < 12.0) & (p.close[:, -2] > highest_high)
+            & (p.volume[:, -2] > p.volume[:, window].mean(axis=1) * 2))
+
+def mask_supertrend_pullback(p: OHLCVPanel, params: dict) -> np.ndarray:
+    atr_period = params.get('atr_period', 10)
+    atr_mult = params.get('atr_multiplier', 3.0)
+    swing_lookback = params.get('swing_high_lookback', 10)
+    _, direction = supertrend(p.high, p.low, p.close, atr_period, atr_mult)
+    recent_swing_high = p.high[:, -swing_lookback:-2].max(axis=1)
+    return (direction[:, -3] == -1) & (direction[:, -2] == 1) & (p.close[:, -2] > recent_swing_high)
+
+# الاستراتيجيات القابلة للتوجيه. البقية (rsi_divergence بـ find_peaks،
+# support_rebound و whale_radar بالـ I/O) تبقى على المسار الفردي.
+VECTOR_STRATEGIES = {
+    "momentum_breakout": mask_momentum_breakout,
+    "breakout_squeeze_pro": mask_breakout_squeeze_pro,
+    "sniper_pro": mask_sniper_pro,
+    "supertrend_pullback": mask_supertrend_pullback,
+}
+
+class VectorScanner:
+    """(V6) يقيّم خطة فحص على لوحة كاملة. الأقنعة تُحفظ لكل (استراتيجية، معاملات) وتُشارك بين المستخدمين."""
+
+    def __init__(self, panel: OHLCVPanel):
+        self.panel = panel
+        self._masks: Dict[Tuple, np.ndarray] = {}
+
+    def mask(self, name: str, params: dict) -> np.ndarray:
+        key = (name, json.dumps(params or {}, sort_keys=True, default=str)) # (نفس مفتاح StrategyResultCache: القيم قد تكون قوائم)
+        if key not in self._masks:
+            self._masks[key] = VECTOR_STRATEGIES[name](self.panel, params or {})
+        return self._masks[key]
+
+    def reasons(self, plan, symbol: str, df, io_data: Optional[Dict] = None, stage: str = "all") -> List[str]:
+        """
+        مثل core_logic.evaluate_plan لرمز واحد: الاستراتيجيات المتجهة تُقرأ من الأقنعة،
+        والبقية تُشغّل على df كالمعتاد (نفس ترتيب الخطة والبوابات والتوقف المبكر).
+        """
+        row = self.panel.index.get(symbol)
+
+        def evaluate(spec, params, df, io_data):
+            if row is not None and spec.name in VECTOR_STRATEGIES:
+                return {"reason": spec.name} if self.mask(spec.name, params)[row] else None
+            return spec.evaluate_cached(df, params, io_data)
+
+        return plan.confirmations(df, io_data, stage, evaluate)
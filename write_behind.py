@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict
+
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+# =======================================================================================
+# --- الكتابة المؤجلة لتحديثات "العيون" (Write-Behind) ---
+#
+# أعلى سعر والوقف المتحرك وآخر إشعار ربح تتغير مع كل تيك تقريباً. بدلاً من UPDATE لكل
+# تغيير داخل حلقة التيك، تُحفظ آخر قيمة لكل صفقة في الذاكرة وتُكتب كل فترة قصيرة في
+# UPDATE ... FROM unnest(...) واحد. تغييرات الحالة (closing_*) لا تمر من هنا: تبقى فورية.
+# =======================================================================================
+
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "1"))
+
+# (دمج قيمتين لنفس الحقل: القديمة ثم الجديدة) = نفس شروط دوال التحديث المنفردة
+_MERGE: Dict[str, Callable[[Any, Any], Any]] = {
+    'highest_price': max,
+    'stop_loss': max,
+    'trailing_sl_active': lambda old, new: old or new,
+    'last_profit_notification_price': lambda old, new: new,
+}
+
+
+def _merge(row: Dict[str, Any], fields: Dict[str, Any]):
+    for field, value in fields.items():
+        row[field] = _MERGE[field](row[field], value) if row.get(field) is not None else value
+
+def merge_live(trade: Dict, live: Dict) -> Dict:
+    """ينقل قيم الحقول أعلاه من نسخة الذاكرة الحية إلى نسخة أحدث تحميلاً (بنفس قواعد الدمج)."""
+    _merge(trade, {field: live[field] for field in _MERGE if live.get(field) is not None})
+    return trade
+
+
+class TradeWriteBehind:
+    """(V6) آخر أعلى سعر/وقف/إشعار لكل صفقة في الذاكرة، تُكتب دفعة واحدة كل interval ثانية."""
+
+    def __init__(self, interval: float = WRITE_BEHIND_FLUSH_SECONDS):
+        self.interval = interval
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._inflight: Dict[int, Dict[str, Any]] = {} # (الدفعة الجاري كتابتها الآن)
+        self._lock = asyncio.Lock()
+        self.buffered = 0 # (تحديثات وصلت)
+        self.written = 0 # (صفوف كُتبت)
+        self.flushes = 0 # (جمل UPDATE)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set(self, trade_id: int, **fields):
+        """يسجل تحديثاً لصفقة (يُدمج مع أي تحديث معلق لها). لا I/O."""
+        self.buffered += 1
+        _merge(self._pending.setdefault(trade_id, {}), fields)
+
+    def apply(self, trade: Dict) -> Dict:
+        """يطبق القيم غير المكتوبة بعد على صفقة محملة من DB (المزامنة لا ترجع الوقف لقيمة أقدم)."""
+        for source in (self._inflight, self._pending):
+            fields = source.get(trade['id'])
+            if fields:
+                _merge(trade, fields)
+        return trade
+
+    async def flush(self) -> int:
+        """يكتب كل المعلق في UPDATE واحد. عند الفشل يعود للانتظار (مع ما وصل بعده) للمحاولة التالية."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, {}
+            try:
+                written = await db_utils.flush_trade_updates(self._inflight)
+                self.written += written
+                self.flushes += 1
+                return written
+            except Exception as e:
+                for trade_id, fields in self._pending.items(): # (الأحدث يُدمج فوق الدفعة الفاشلة)
+                    _merge(self._inflight.setdefault(trade_id, {}), fields)
+                self._pending = self._inflight
+                logger.error(f"WRITE_BEHIND: Failed to flush {len(self._pending)} trade updates, will retry: {e}")
+                return 0
+            finally:
+                self._inflight = {}
+
+    async def run(self):
+        """يكتب المعلق كل interval ثانية، ومرة أخيرة عند الإيقاف."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def metrics(self) -> Dict[str, int]:
+        return {"pending": len(self._pending), "buffered": self.buffered, "written": self.written, "flushes": self.flushes}